@@ -1 +1,11 @@
-from pysondb.db import PysonDB  # noqa: F401
+from typing import Any
+
+
+def __getattr__(name: str) -> Any:
+    # PysonDB is imported on first use, so `python -m pysondb` and the CLI
+    # tools start without loading the database engine
+    if name == "PysonDB":
+        from pysondb.db import PysonDB
+
+        return PysonDB
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
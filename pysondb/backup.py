@@ -0,0 +1,277 @@
+import os
+import uuid
+from threading import Lock
+from time import perf_counter
+from time import sleep
+from time import time
+from typing import Any
+from typing import Dict
+from typing import IO
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from pysondb.checkpoint import atomic_write
+from pysondb.checkpoint import atomic_write_json
+from pysondb.checkpoint import dump_database
+from pysondb.db_types import DBSchemaType
+from pysondb.errors import BackupError
+
+try:
+    import ujson as json
+except ImportError:
+    import json as json
+
+
+# A backup directory holds the points of one database and their manifest:
+#   manifest.json            {"version": 1, "points": [{"id", "type", "base", "seq", ...}]}
+#   <id>.full.json           the database file as it was at the point
+#   <id>.incremental.json    what changed since the point "base":
+#       {"version": 2, "keys": {...},
+#        "sections": {section: {id: record}},   sections purged / re-keyed, in full
+#        "upsert": {section: {id: record}}, "delete": {section: [id, ...]}}
+# Restoring a point reads the full point it builds on and applies the
+# incremental ones after it in order.
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+
+# throttled writes are split in pieces of this many characters
+WRITE_CHUNK = 64 * 1024
+
+# ({section: ids written}, sections rewritten as a whole)
+ChangesType = Tuple[Dict[str, Set[str]], Set[str]]
+
+
+class ChangeTracker:
+    """
+    The records written since the last backup point of a database, by
+    section, kept from its mutation events (see
+    PysonDB.snapshot_with_changes). A section that was purged or given a new
+    key is backed up as a whole.
+    """
+
+    def __init__(self) -> None:
+        # the point the changes are relative to
+        self.point: Optional[str] = None
+        # the run of the database the changes were seen in (see PysonDB.seq)
+        self.run_id: Optional[str] = None
+        self._changed: Dict[str, Set[str]] = {}
+        self._reset: Set[str] = set()
+
+    def observe(self, event: Dict) -> None:
+        # PysonDB listener, runs under the database lock
+        op, section = event["op"], event["section"]
+        if op in ("insert", "update", "delete"):
+            if section not in self._reset:
+                self._changed.setdefault(section, set()).add(event["id"])
+        elif op in ("purge", "add_section", "add_new_key"):
+            self._reset.add(section)
+            self._changed.pop(section, None)
+
+    def take(self) -> ChangesType:
+        changes = (self._changed, self._reset)
+        self._changed, self._reset = {}, set()
+        return changes
+
+    def put_back(self, changes: ChangesType) -> None:
+        # changes of a backup that failed, to be part of the next one
+        changed, reset = changes
+        self._reset |= reset
+        for section, ids in changed.items():
+            if section not in self._reset:
+                self._changed.setdefault(section, set()).update(ids)
+        for section in self._reset:
+            self._changed.pop(section, None)
+
+
+class ThrottledWriter:
+    """
+    File wrapper writing at most `rate` characters per second on average,
+    so that a backup does not take the disk from the database's own writes.
+    """
+
+    def __init__(self, f: IO[str], rate: float) -> None:
+        self._f = f
+        self.rate = rate
+        self._start = perf_counter()
+        self._written = 0
+
+    def write(self, s: str) -> int:
+        for i in range(0, len(s), WRITE_CHUNK):
+            chunk = s[i:i + WRITE_CHUNK]
+            self._f.write(chunk)
+            self._written += len(chunk)
+            ahead = self._written / self.rate - (perf_counter() - self._start)
+            if ahead > 0:
+                sleep(ahead)
+        return len(s)
+
+
+def _write(path: str, data: Dict, rate: float) -> int:
+    def write(f: IO[str]) -> None:
+        dump_database(data, ThrottledWriter(f, rate) if rate else f)
+
+    atomic_write(path, write)
+    return os.path.getsize(path)
+
+
+def read_manifest(directory: str) -> Dict:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {"version": MANIFEST_VERSION, "points": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _records(view: DBSchemaType, section: str) -> Dict:
+    records = view.get(section)
+    # spilled sections are only read back when they changed
+    return records.load() if hasattr(records, "load") else records
+
+
+def _increment(view: DBSchemaType, changes: ChangesType) -> Tuple[Dict, int, int]:
+    changed, reset = changes
+    increment: Dict[str, Any] = {
+        "version": view.get("version", 2),
+        "keys": view["keys"],
+        "sections": {},
+        "upsert": {},
+        "delete": {},
+    }
+    upserted = deleted = 0
+    for section in reset:
+        if section in view["keys"]:
+            increment["sections"][section] = _records(view, section)
+            upserted += len(increment["sections"][section])
+    for section, ids in changed.items():
+        if section not in view["keys"]:
+            continue
+        records = _records(view, section)
+        upsert = {id: records[id] for id in ids if id in records}
+        delete = sorted(id for id in ids if id not in records)
+        if upsert:
+            increment["upsert"][section] = upsert
+        if delete:
+            increment["delete"][section] = delete
+        upserted += len(upsert)
+        deleted += len(delete)
+    return increment, upserted, deleted
+
+
+class BackupManager:
+    """
+    Backs up the databases of a server to directory/<database name>. The
+    first backup of a database after a start is full, the next ones only
+    hold the records written since the previous one, unless full is asked
+    for. The snapshot is taken under the database lock like any read, the
+    writing happens outside of it, throttled to `rate` bytes per second
+    (0: unlimited).
+    """
+
+    def __init__(self, directory: str, rate: float = 0) -> None:
+        self.directory = directory
+        self.rate = rate
+        self._trackers: Dict[str, ChangeTracker] = {}
+        self._locks: Dict[str, Lock] = {}
+        self._lock = Lock()
+
+    def backup(self, dbname: str, db: Any, full: bool = False, rate: Optional[float] = None) -> Dict:
+        rate = self.rate if rate is None else rate
+        with self._lock:
+            lock = self._locks.setdefault(dbname, Lock())
+            tracker = self._trackers.setdefault(dbname, ChangeTracker())
+        # one backup of a database at a time, the points form a chain
+        with lock:
+            directory = os.path.join(self.directory, dbname)
+            os.makedirs(directory, exist_ok=True)
+            manifest = read_manifest(directory)
+            points = manifest["points"]
+            start = perf_counter()
+            seq, view, changes = db.snapshot_with_changes(tracker)
+            incremental = (
+                not full
+                and changes is not None
+                and bool(points)
+                and points[-1]["id"] == tracker.point
+            )
+            point = {
+                "id": f"{len(points) + 1:06d}-{uuid.uuid4().hex[:8]}",
+                "type": "incremental" if incremental else "full",
+                "base": points[-1]["id"] if incremental else None,
+                "seq": seq,
+                "created": time(),
+            }
+            point["file"] = f"{point['id']}.{point['type']}.json"
+            try:
+                if incremental:
+                    increment, point["records"], point["deleted"] = _increment(view, changes)
+                    point["bytes"] = _write(os.path.join(directory, point["file"]), increment, rate)
+                else:
+                    point["records"] = sum(
+                        view[s].records if hasattr(view[s], "load") else len(view[s])
+                        for s in view["keys"]
+                    )
+                    point["bytes"] = _write(os.path.join(directory, point["file"]), view, rate)
+                points.append(point)
+                atomic_write_json(os.path.join(directory, MANIFEST), manifest)
+            except BaseException:
+                if changes is not None:
+                    with db.lock:
+                        tracker.put_back(changes)
+                raise
+            tracker.point = point["id"]
+            point["seconds"] = round(perf_counter() - start, 4)
+            return point
+
+    def points(self, dbname: str) -> List[Dict]:
+        return read_manifest(os.path.join(self.directory, dbname))["points"]
+
+
+def _apply(data: DBSchemaType, increment: Dict) -> None:
+    data["version"] = increment.get("version", data.get("version"))
+    for section in list(data["keys"]):
+        if section not in increment["keys"]:
+            data.pop(section, None)
+    data["keys"] = increment["keys"]
+    for section in data["keys"]:
+        data.setdefault(section, {})
+    for section, records in increment["sections"].items():
+        data[section] = records
+    for section, records in increment["upsert"].items():
+        data[section].update(records)
+    for section, ids in increment["delete"].items():
+        for id in ids:
+            data[section].pop(id, None)
+
+
+def restore(directory: str, point: Optional[str] = None) -> DBSchemaType:
+    """
+    The database as it was at point (an id of the manifest, or just its
+    number), the latest one by default.
+    """
+    points = read_manifest(directory)["points"]
+    if not points:
+        raise BackupError(f"no backup points in {directory}")
+    if point is None:
+        last = len(points) - 1
+    else:
+        matches = [i for i, p in enumerate(points) if p["id"] == point or p["id"].split("-")[0] == point]
+        if not matches:
+            raise BackupError(f"no backup point {point!r} in {directory}")
+        last = matches[0]
+    first = last
+    while points[first]["type"] != "full":
+        first -= 1
+        if first < 0 or points[first]["id"] != points[first + 1]["base"]:
+            raise BackupError(f"backup point {points[last]['id']} has no full point to start from")
+    data = None
+    for p in points[first:last + 1]:
+        with open(os.path.join(directory, p["file"]), encoding="utf-8") as f:
+            content = json.load(f)
+        if data is None:
+            data = content
+        else:
+            _apply(data, content)
+    return data
@@ -0,0 +1,249 @@
+import uuid
+from collections import deque
+from queue import Full
+from queue import Queue
+from threading import Lock
+from threading import Thread
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from pysondb.errors import WatchResumeError
+from pysondb.filters import compile_filter
+
+
+# ops that are not about a single record reach every subscriber of the section
+SECTION_OPS = {"purge", "add_section", "add_new_key"}
+
+# subscribes to every section of a database
+ALL_SECTIONS = "*"
+
+
+def public_event(event: Dict) -> Dict:
+    # "old" is only kept to match filters against deleted / updated records
+    return {k: v for k, v in event.items() if k != "old"}
+
+
+class Subscriber:
+    """
+    One watching connection. Matched events are queued here by the dispatcher
+    and written to the socket by a dedicated thread, so a slow client can
+    never stall the dispatcher (it is dropped when its queue overflows).
+    """
+
+    def __init__(self, send: Callable[[Dict], None], max_pending: int = 10000) -> None:
+        self._send = send
+        self._queue: Queue = Queue(max_pending)
+        self.closed = False
+        self.on_overflow: Optional[Callable[["Subscriber"], None]] = None
+        Thread(target=self._run, name="watch-pusher", daemon=True).start()
+
+    def offer(self, message: Dict) -> None:
+        # on_overflow runs on the dispatcher thread under its lock, it must
+        # not call back into the dispatcher
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait(message)
+        except Full:
+            self.closed = True
+            if self.on_overflow is not None:
+                self.on_overflow(self)
+
+    def _run(self) -> None:
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            try:
+                self._send(message)
+            except Exception:
+                self.closed = True
+                return
+
+    def close(self) -> None:
+        self.closed = True
+        self._queue.put(None)
+
+
+class Subscription:
+    __slots__ = ("watch_id", "dbname", "section", "match", "subscriber", "kind", "after", "run_id")
+
+    def __init__(
+        self,
+        dbname: str,
+        section: str,
+        spec: Any,
+        subscriber: Subscriber,
+        kind: str = "WATCH",
+        after: int = 0,
+        run_id: Optional[str] = None,
+    ) -> None:
+        self.watch_id = uuid.uuid4().hex
+        self.dbname = dbname
+        self.section = section
+        self.match = compile_filter(spec)
+        self.subscriber = subscriber
+        self.kind = kind
+        # events of run_id up to seq after are not delivered
+        self.after = after
+        self.run_id = run_id
+
+    def covers(self, event: Dict) -> bool:
+        return self.section == ALL_SECTIONS or event.get("section") == self.section
+
+    def seen(self, event: Dict) -> bool:
+        # committed before the subscription started, but still queued for
+        # the dispatcher when it was registered
+        return event["seq"] <= self.after and event.get("run_id") == self.run_id
+
+    def wants(self, event: Dict) -> bool:
+        if event["op"] in SECTION_OPS:
+            return True
+        for record in (event.get("data"), event.get("old")):
+            if isinstance(record, dict) and self.match(record):
+                return True
+        return False
+
+    def deliver(self, event: Dict) -> None:
+        self.subscriber.offer(
+            {
+                "error": "NoError",
+                "push": self.kind,
+                "watch_id": self.watch_id,
+                "db": self.dbname,
+                "data": public_event(event),
+            }
+        )
+
+
+class ChangeDispatcher:
+    """
+    Single thread fanning committed mutation events out to WATCH
+    subscriptions. Subscriptions are indexed by (database, section) so an
+    event is only matched against the watchers of its own section, and the
+    last `buffer_size` events of each database are kept for resuming.
+    """
+
+    def __init__(self, buffer_size: int = 10000) -> None:
+        self._buffer_size = buffer_size
+        self._events: Queue = Queue()
+        self._lock = Lock()
+        self._subs: Dict[Tuple[str, str], Dict[str, Subscription]] = {}
+        self._by_id: Dict[str, Subscription] = {}
+        self._history: Dict[str, Deque[Dict]] = {}
+        self._last_seq: Dict[str, int] = {}
+        # the run_id of the events in the history of each database
+        self._run_ids: Dict[str, str] = {}
+        Thread(target=self._run, name="change-dispatcher", daemon=True).start()
+
+    def publish(self, dbname: str, event: Dict) -> None:
+        """
+        PysonDB listener, called under the database lock so it only enqueues.
+        """
+        self._events.put((dbname, event))
+
+    def listener(self, dbname: str) -> Callable[[Dict], None]:
+        return lambda event: self.publish(dbname, event)
+
+    def _run(self) -> None:
+        while True:
+            dbname, event = self._events.get()
+            overflowed = set()
+            with self._lock:
+                history = self._history.get(dbname)
+                if history is None or self._run_ids.get(dbname) != event.get("run_id"):
+                    # a new handle of the database numbers its events from 1 again
+                    history = self._history[dbname] = deque(maxlen=self._buffer_size)
+                    self._run_ids[dbname] = event.get("run_id")
+                history.append(event)
+                self._last_seq[dbname] = event["seq"]
+                for key in ((dbname, event.get("section")), (dbname, ALL_SECTIONS)):
+                    subs = self._subs.get(key)
+                    if subs:
+                        for sub in list(subs.values()):
+                            if sub.subscriber.closed:
+                                overflowed.add(sub.subscriber)
+                            elif sub.wants(event) and not sub.seen(event):
+                                sub.deliver(event)
+                                if sub.subscriber.closed:
+                                    overflowed.add(sub.subscriber)
+            # the lock is not reentrant, closed subscribers are dropped after it
+            for subscriber in overflowed:
+                self.unsubscribe_all(subscriber)
+
+    def subscribe(
+        self,
+        subscriber: Subscriber,
+        dbname: str,
+        section: str,
+        spec: Any = None,
+        since: Optional[int] = None,
+        current_seq: int = 0,
+        kind: str = "WATCH",
+        run_id: Optional[str] = None,
+        current_run_id: Optional[str] = None,
+    ) -> Subscription:
+        """
+        Resumes after seq since when given, replaying the buffered events,
+        and starts after current_seq otherwise. A since taken from another
+        run of the database (run_id is not current_run_id) names different
+        events and cannot be resumed from.
+        """
+        after = current_seq if since is None else since
+        sub = Subscription(dbname, section, spec, subscriber, kind, after, current_run_id)
+        with self._lock:
+            if since is not None:
+                if run_id != current_run_id:
+                    raise WatchResumeError(
+                        f"cannot resume {dbname}/{section} from seq {since} of run {run_id}, "
+                        f"the database was reloaded since (run {current_run_id})"
+                    )
+                history = self._history.get(dbname, deque())
+                if self._run_ids.get(dbname, current_run_id) != current_run_id:
+                    # no event of the current run was dispatched yet
+                    history, oldest = deque(), 1
+                else:
+                    oldest = history[0]["seq"] if history else self._last_seq.get(dbname, 0) + 1
+                if since + 1 < oldest or since > current_seq:
+                    raise WatchResumeError(
+                        f"cannot resume {dbname}/{section} from seq {since}, "
+                        f"events are available from seq {oldest}"
+                    )
+                # replay what was already dispatched, the queue delivers the rest
+                for event in history:
+                    if event["seq"] > since and sub.covers(event) and sub.wants(event):
+                        sub.deliver(event)
+            self._subs.setdefault((dbname, section), {})[sub.watch_id] = sub
+            self._by_id[sub.watch_id] = sub
+        if subscriber.closed:
+            # overflowed by the replay
+            self.unsubscribe_all(subscriber)
+        return sub
+
+    def unsubscribe(self, watch_id: str) -> bool:
+        with self._lock:
+            sub = self._by_id.pop(watch_id, None)
+            if sub is None:
+                return False
+            self._subs.get((sub.dbname, sub.section), {}).pop(watch_id, None)
+            return True
+
+    def unsubscribe_all(self, subscriber: Subscriber) -> List[str]:
+        with self._lock:
+            ids = [i for i, s in self._by_id.items() if s.subscriber is subscriber]
+        for watch_id in ids:
+            self.unsubscribe(watch_id)
+        return ids
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "subscriptions": len(self._by_id),
+                "pending_events": self._events.qsize(),
+                "last_seq": dict(self._last_seq),
+            }
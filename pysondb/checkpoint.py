@@ -0,0 +1,144 @@
+import atexit
+import os
+import tempfile
+from threading import Condition
+from threading import Event
+from threading import Thread
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import IO
+from typing import Optional
+
+
+try:
+    import ujson as json
+except ImportError:
+    import json as json
+
+
+def _dump_with_segments(data: Dict, f: IO[str], indent: int) -> None:
+    # sections spilled to disk (see SpilledSection) are copied as they are
+    f.write("{")
+    for i, (key, value) in enumerate(data.items()):
+        f.write(("," if i else "") + "\n" + " " * indent + json.dumps(key) + ": ")
+        if hasattr(value, "copy_to"):
+            value.copy_to(f)
+        else:
+            f.write(json.dumps(value, indent=indent))
+    f.write("\n}")
+
+
+def dump_database(data: Dict, f: IO[str], indent: int = 4) -> None:
+    if any(hasattr(v, "copy_to") for v in data.values()):
+        _dump_with_segments(data, f, indent)
+    else:
+        json.dump(data, f, indent=indent)
+
+
+def atomic_write(filename: str, write: Callable[[IO[str]], None]) -> None:
+    """
+    Calls write with a file next to filename, fsyncs it and renames it over
+    filename so a crash leaves either the old or the new file, never a
+    truncated one.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(prefix=".pysondb-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, encoding="utf-8", mode="w") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, filename)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        # persist the rename itself (not supported on windows)
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def atomic_write_json(filename: str, data: Any, indent: int = 4) -> None:
+    atomic_write(filename, lambda f: dump_database(data, f, indent))
+
+
+class Checkpointer(Thread):
+    """
+    Background thread that periodically writes a frozen view of a database to
+    disk. A commit requests a checkpoint and waits for it, commits arriving
+    while one is written share the next one.
+    """
+
+    def __init__(self, db, interval: float) -> None:
+        super().__init__(name=f"checkpoint-{os.path.basename(db.filename)}", daemon=True)
+        self._db = db
+        self.interval = interval
+        self._stop_event = Event()
+        self._wake = Event()
+        self._cond = Condition()
+        # requests made, and requests covered by the last finished flush
+        self._requested = 0
+        self._flushed = 0
+        self._error: Optional[Exception] = None
+        atexit.register(self.close)
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        with self._cond:
+            # a checkpoint started now holds every write requested so far
+            covered = self._requested
+        error = None
+        try:
+            self._db.checkpoint()
+        except Exception as e:
+            print(f"checkpoint of {self._db.filename} failed: {e}")
+            error = e
+        with self._cond:
+            self._flushed = max(self._flushed, covered)
+            self._error = error
+            self._cond.notify_all()
+
+    def request(self, wait: bool = False) -> None:
+        """
+        Asks for a checkpoint now rather than at the end of the interval.
+        With wait, returns once one that started after the request is on
+        disk, and raises the error of a failed one.
+        """
+        with self._cond:
+            self._requested += 1
+            ticket = self._requested
+        if self._stop_event.is_set():
+            # closing, the thread may already be gone
+            self.flush()
+        else:
+            self._wake.set()
+        if not wait:
+            return
+        with self._cond:
+            while self._flushed < ticket:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+
+    def close(self) -> None:
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        # the hook would keep the closed database alive until exit
+        atexit.unregister(self.close)
+        self._wake.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
@@ -5,7 +5,9 @@ import sys
 from typing import Optional
 from typing import Sequence
 
-from pysondb import db
+from pysondb.backup import read_manifest
+from pysondb.backup import restore
+from pysondb.checkpoint import atomic_write_json
 from pysondb.utils import merge_n_db
 from pysondb.utils import migrate
 from pysondb.utils import print_db_as_table
@@ -43,10 +45,32 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
         '--output', '-o', help='The name fo the output csv file')
     purge = sub.add_parser('purge', help='purge / empty the whole DB')
     purge.add_argument('db_file', help='The DB file to purge')
+    backup = sub.add_parser(
+        'backup', help='back up a database of a running server')
+    backup.add_argument('dbname', help='the name of the database')
+    backup.add_argument('--host', default='localhost')
+    backup.add_argument('--port', type=int, default=9999)
+    backup.add_argument('--user', required=True)
+    backup.add_argument('--password', required=True)
+    backup.add_argument('--full', action='store_true',
+                        help='a full backup even if an incremental one is possible')
+    backup.add_argument('--max-mb-per-sec', type=float,
+                        help='limit the backup writes, overrides the server config')
+    restore_cmd = sub.add_parser(
+        'restore', help='rebuild a DB file from its backup directory')
+    restore_cmd.add_argument(
+        'backup_dir', help='the backup directory of the database')
+    restore_cmd.add_argument(
+        '--point', help='the backup point to restore, the latest by default')
+    restore_cmd.add_argument(
+        '--output', '-o', help='The name of the output JSON file.')
+    restore_cmd.add_argument('--list', action='store_true',
+                             help='list the backup points instead')
 
     args = parser.parse_args(argv)
     if args.info:
         print('PysonDB - 2.0.0')
+        from pysondb import db
         if db.UJSON:
             print("using 'ujson' JSON parser")
         else:
@@ -100,6 +124,30 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
             new_p_data = purge_db({})
             json.dump(new_p_data, f)
         return 0
+
+    if args.sub == 'backup':
+        from pysondb.client import Connection
+
+        conn = Connection(args.host, args.port, args.user, args.password)
+        try:
+            point = conn.backup(args.dbname, args.full, args.max_mb_per_sec)
+        finally:
+            conn.close()
+        print(f"{point['type']} backup {point['id']}: "
+              f"{point['records']} records, {point['bytes']} bytes")
+        return 0
+
+    if args.sub == 'restore':
+        if args.list:
+            for p in read_manifest(args.backup_dir)['points']:
+                print(f"{p['id']}  {p['type']:<11}  seq {p['seq']}  {p['bytes']} bytes")
+            return 0
+        if not args.output:
+            print('--output is required to restore', file=sys.stderr)
+            return 1
+        atomic_write_json(args.output, restore(args.backup_dir, args.point))
+        print(f'restored to {args.output}')
+        return 0
     return 0
 
 
@@ -0,0 +1,991 @@
+import abc
+import asyncio
+import builtins
+import secrets
+import select
+import socket
+import time
+from base64 import urlsafe_b64encode as b64e
+from collections import deque
+from contextlib import asynccontextmanager
+from contextlib import contextmanager
+from threading import Condition
+from typing import Any
+from typing import AsyncIterator
+from typing import Deque
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+try:
+    import ujson as json
+except ImportError:
+    import json as json
+
+from pysondb import errors
+from pysondb.config import obscure
+from pysondb.config import password_decrypt
+from pysondb.config import password_encrypt
+from pysondb.replication import WRITE_COMMANDS
+
+
+# Client side of the wire protocol: every message is an 8 byte big endian
+# length and a JSON body {"cmd", "auth", "payload"}. AUTH is obscured, the
+# messages after it plain or, with encrypt, password encrypted (see
+# pysondb.config). A connection announces one salt in AUTH and the server
+# encrypts its replies with it, so the slow key derivation runs once per
+# salt, and the connections of a pool share theirs.
+#
+#   with ConnectionPool(user="test", password="password", dbname="testfile") as pool:
+#       id = pool.add("test", {"name": "ada"})
+#       with pool.pipeline() as p:
+#           p.get_by_id("test", id)
+#           p.find("test", {"age": {"$gte": 18}})
+#           record, adults = p.execute()
+#
+# The server answers the messages of a connection in order, so a pipeline
+# writes a batch of them before reading the replies: one round trip instead
+# of one per command.
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 9999
+
+# commands written before reading their replies, so neither side blocks
+# writing while the other one is not reading
+PIPELINE_WINDOW = 128
+
+# connection state held by the server, a pool cannot run them call by call
+SESSION_COMMANDS = {"BEGIN", "COMMIT", "ROLLBACK", "USE_SECTION"}
+
+ReplyType = Dict[str, Any]
+
+
+def server_error(reply: ReplyType) -> Exception:
+    """
+    The exception for an error reply, of the class the server raised when
+    this package or the builtins have it.
+    """
+    name, message = reply.get("error"), reply.get("data")
+    cls = getattr(errors, name, None) or getattr(builtins, name, None)
+    e = None
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        try:
+            e = cls(message)
+        except Exception:
+            # e.g. UnicodeDecodeError, which takes more than a message
+            pass
+    if e is None:
+        e = errors.ServerError(f"{name}: {message}")
+    if "redirect" in reply:
+        e.redirect = reply["redirect"]
+    return e
+
+
+class _Commands(abc.ABC):
+    """
+    One method per request / reply command of the server (see
+    ClientTCPHandler._commands), on top of _call(cmd, payload). What they
+    return depends on the class: the reply data for Connection, a coroutine
+    for AsyncConnection, the pipeline itself for Pipeline. AUTH is sent by
+    the connections themselves. WATCH / UNWATCH and REPLICATE are left out:
+    the events they push interleave with the replies, which the connections
+    here match to commands by order (see pysondb.replication for a reader).
+    """
+
+    @abc.abstractmethod
+    def _call(self, cmd: str, payload: Dict) -> Any:
+        """
+        Sends cmd with payload, what it returns is the result of every command method.
+        """
+
+    def add(self, section: str, data: Dict, ignore_missing_key: bool = False) -> Any:
+        return self._call("ADD", {"section": section, "data": data, "ignore_missing_key": ignore_missing_key})
+
+    def add_many(
+        self, section: str, data: List[Dict], json_response: bool = True, ignore_missing_key: bool = False
+    ) -> Any:
+        return self._call(
+            "ADD_MANY",
+            {
+                "section": section,
+                "data": data,
+                "json_response": json_response,
+                "ignore_missing_key": ignore_missing_key,
+            },
+        )
+
+    def add_new_key(self, section: str, key: str, default: Any = None) -> Any:
+        return self._call("ADD_NEW_KEY", {"section": section, "key": key, "default": default})
+
+    def add_section(self, section: str, use: bool = False) -> Any:
+        return self._call("ADD_SECTION", {"section": section, "use": use})
+
+    def aggregate(
+        self,
+        section: str,
+        field: str,
+        filter: Optional[Dict] = None,
+        bins: Optional[int] = None,
+        bounds: Optional[List[float]] = None,
+    ) -> Any:
+        return self._call(
+            "AGGREGATE", {"section": section, "field": field, "filter": filter, "bins": bins, "bounds": bounds}
+        )
+
+    def backup(
+        self, dbname: Optional[str] = None, full: bool = False, max_mb_per_sec: Optional[float] = None
+    ) -> Any:
+        return self._call("BACKUP", {"dbname": dbname, "full": full, "max_mb_per_sec": max_mb_per_sec})
+
+    def begin(self) -> Any:
+        return self._call("BEGIN", {})
+
+    def commit(self) -> Any:
+        return self._call("COMMIT", {})
+
+    def create_db(self, dbname: str, force: bool = False, use: bool = False) -> Any:
+        return self._call("CREATE_DB", {"dbname": dbname, "force": force, "use": use})
+
+    def delete_by_id(self, section: str, id: str) -> Any:
+        return self._call("DELETE_BY_ID", {"section": section, "id": id})
+
+    def delete_by_query(self, section: str, query: str) -> Any:
+        return self._call("DELETE_BY_QUERY", {"section": section, "query": query})
+
+    def find(
+        self,
+        section: str,
+        filter: Optional[Dict] = None,
+        fields: Optional[List[str]] = None,
+        order_by: Optional[Union[str, List[str]]] = None,
+        limit: Optional[int] = None,
+    ) -> Any:
+        return self._call(
+            "FIND", {"section": section, "filter": filter, "fields": fields, "order_by": order_by, "limit": limit}
+        )
+
+    def get_all(self) -> Any:
+        return self._call("GET_ALL", {})
+
+    def get_all_by_section(
+        self,
+        section: str,
+        fields: Optional[List[str]] = None,
+        order_by: Optional[Union[str, List[str]]] = None,
+        limit: Optional[int] = None,
+    ) -> Any:
+        return self._call(
+            "GET_ALL_BY_SECTION", {"section": section, "fields": fields, "order_by": order_by, "limit": limit}
+        )
+
+    def get_by_id(self, section: str, id: str, fields: Optional[List[str]] = None) -> Any:
+        return self._call("GET_BY_ID", {"section": section, "id": id, "fields": fields})
+
+    def get_by_query(
+        self,
+        section: str,
+        query: str,
+        fields: Optional[List[str]] = None,
+        order_by: Optional[Union[str, List[str]]] = None,
+        limit: Optional[int] = None,
+    ) -> Any:
+        return self._call(
+            "GET_BY_QUERY",
+            {"section": section, "query": query, "fields": fields, "order_by": order_by, "limit": limit},
+        )
+
+    def health(self) -> Any:
+        return self._call("HEALTH", {})
+
+    def lookup(
+        self,
+        section: str,
+        field: Optional[str],
+        other: str,
+        other_field: Optional[str] = None,
+        filter: Optional[Dict] = None,
+        other_filter: Optional[Dict] = None,
+        fields: Optional[List[str]] = None,
+        other_fields: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        outer: bool = False,
+    ) -> Any:
+        return self._call(
+            "LOOKUP",
+            {
+                "section": section,
+                "field": field,
+                "other": other,
+                "other_field": other_field,
+                "filter": filter,
+                "other_filter": other_filter,
+                "fields": fields,
+                "other_fields": other_fields,
+                "limit": limit,
+                "outer": outer,
+            },
+        )
+
+    def profile(self, seconds: float = 5, interval_ms: float = 5) -> Any:
+        return self._call("PROFILE", {"seconds": seconds, "interval_ms": interval_ms})
+
+    def purge(self, section: str) -> Any:
+        return self._call("PURGE", {"section": section})
+
+    def purge_all(self) -> Any:
+        return self._call("PURGE_ALL", {})
+
+    def rollback(self) -> Any:
+        return self._call("ROLLBACK", {})
+
+    def search(
+        self,
+        section: str,
+        query: str,
+        limit: int = 20,
+        offset: int = 0,
+        mode: str = "all",
+        fields: Optional[List[str]] = None,
+    ) -> Any:
+        return self._call(
+            "SEARCH",
+            {"section": section, "query": query, "limit": limit, "offset": offset, "mode": mode, "fields": fields},
+        )
+
+    def set_id_generator(self, fn: Optional[str] = None, **conf: Any) -> Any:
+        # fn is the source of a lambda, conf a built in generator: type="snowflake", node=2
+        return self._call("SET_ID_GENERATOR", {"fn": fn} if fn is not None else conf)
+
+    def stats(self) -> Any:
+        return self._call("STATS", {})
+
+    def update_by_id(self, section: str, id: str, data: Dict) -> Any:
+        return self._call("UPDATE_BY_ID", {"section": section, "id": id, "data": data})
+
+    def update_by_query(self, section: str, query: str, data: Dict) -> Any:
+        return self._call("UPDATE_BY_QUERY", {"section": section, "query": query, "data": data})
+
+    def use_db(self, dbname: str, section: Optional[str] = None) -> Any:
+        return self._call("USE_DB", {"dbname": dbname, "section": section})
+
+    def use_section(self, section: str) -> Any:
+        return self._call("USE_SECTION", {"section": section})
+
+
+class Pipeline(_Commands):
+    """
+    Queues commands, execute() sends them together and returns their
+    results in order. With raise_on_error, the first failed command raises
+    once every reply was read, otherwise its exception takes its place in
+    the results.
+    """
+
+    def __init__(self, target: Any) -> None:
+        self._target = target
+        self._queue: List[Tuple[str, Dict]] = []
+
+    def _call(self, cmd: str, payload: Dict) -> "Pipeline":
+        self._queue.append((cmd, payload))
+        return self
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def execute(self, raise_on_error: bool = True) -> Any:
+        queue, self._queue = self._queue, []
+        return self._target._pipeline(queue, raise_on_error)
+
+    def __enter__(self) -> "Pipeline":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._queue = []
+
+
+class _Session(_Commands):
+    # message encoding and the connection state both connection classes track
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: str,
+        password: str,
+        encrypt: bool,
+        dbname: Optional[str],
+        section: Optional[str],
+        timeout: Optional[float],
+        retries: int,
+        salt: Optional[bytes],
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.encrypt = encrypt
+        self.dbname = dbname
+        self.section = section
+        self.timeout = timeout
+        self.retries = retries
+        self.salt = salt if salt is not None else secrets.token_bytes(16)
+        self.in_transaction = False
+        self.last_used = time.monotonic()
+        self._password = password
+        self._key: Optional[str] = None
+
+    def _auth_message(self) -> bytes:
+        credentials = "c" + str(
+            obscure(bytes(json.dumps({"u": self.user, "p": self._password}), "utf-8")), "utf-8"
+        )
+        payload = {"encrypt": self.encrypt, "credentials": credentials, "salt": str(b64e(self.salt), "utf-8")}
+        if self._key is None:
+            # the first message of a connection is obscured
+            msg = obscure(bytes(json.dumps({"cmd": "AUTH", "payload": payload}), "utf-8"))
+            return len(msg).to_bytes(8, "big") + msg
+        return self._encode("AUTH", payload)
+
+    def _encode(self, cmd: str, payload: Dict) -> bytes:
+        # a framed message, length prefix included
+        msg = bytes(json.dumps({"cmd": cmd, "auth": self._key, "payload": payload}), "utf-8")
+        if self.encrypt:
+            msg = password_encrypt(msg, self._password, salt=self.salt)
+        return len(msg).to_bytes(8, "big") + msg
+
+    def _decode(self, msg: bytes) -> ReplyType:
+        # a failed AUTH is answered in plain JSON, encrypted messages never start with "{"
+        if self.encrypt and not msg.startswith(b"{"):
+            msg = password_decrypt(msg, self._password)
+        return json.loads(msg)
+
+    def _authenticated(self, reply: ReplyType) -> None:
+        if reply.get("error") != "NoError":
+            raise server_error(reply)
+        self._key = reply["data"]
+
+    def _result(self, cmd: str, payload: Dict, reply: Any) -> Any:
+        if cmd in ("COMMIT", "ROLLBACK"):
+            # the transaction is over even if COMMIT failed
+            self.in_transaction = False
+        if not isinstance(reply, dict) or "error" not in reply:
+            return reply
+        if reply["error"] != "NoError":
+            raise server_error(reply)
+        if cmd == "USE_DB":
+            self.dbname, self.section = payload["dbname"], payload["section"]
+        elif cmd == "USE_SECTION":
+            self.section = payload["section"]
+        elif cmd == "CREATE_DB" and payload["use"]:
+            self.dbname, self.section = payload["dbname"], None
+        elif cmd == "BEGIN":
+            self.in_transaction = True
+        return reply.get("data")
+
+    def _retry(self, cmd: str, sent: bool, attempt: int) -> bool:
+        # after a lost connection: a write may have been applied before it
+        # dropped, and the server discarded an open transaction with it
+        if attempt >= self.retries or self.in_transaction:
+            self.in_transaction = False
+            return False
+        return not (sent and cmd in WRITE_COMMANDS)
+
+    def _use_db_payload(self) -> Optional[Dict]:
+        if self.dbname is None:
+            return None
+        return {"dbname": self.dbname, "section": self.section}
+
+
+class Connection(_Session):
+    """
+    One authenticated connection. Lost connections are reopened, re-AUTHed
+    and given their database back, and the command is retried `retries`
+    times, unless it was a write already sent or the connection was in a
+    transaction: those raise ConnectionError.
+    """
+
+    def __init__(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        user: str = "",
+        password: str = "",
+        encrypt: bool = False,
+        dbname: Optional[str] = None,
+        section: Optional[str] = None,
+        timeout: Optional[float] = None,
+        retries: int = 1,
+        salt: Optional[bytes] = None,
+    ) -> None:
+        super().__init__(host, port, user, password, encrypt, dbname, section, timeout, retries, salt)
+        self._sock: Optional[socket.socket] = None
+        self._rfile = None
+        self.connect()
+
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def connect(self) -> None:
+        self.close()
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._rfile = sock.makefile("rb")
+        self._key = None
+        try:
+            self.authenticate()
+            payload = self._use_db_payload()
+            if payload is not None:
+                self._result("USE_DB", payload, self._roundtrip(self._encode("USE_DB", payload)))
+        except BaseException:
+            self.close()
+            raise
+
+    def authenticate(self) -> None:
+        self._authenticated(self._roundtrip(self._auth_message()))
+
+    def _write(self, msg: bytes) -> None:
+        self._sock.sendall(msg)
+
+    def _read(self) -> ReplyType:
+        header = self._rfile.read(8)
+        if len(header) < 8:
+            raise ConnectionError(f"connection to {self.host}:{self.port} closed")
+        size = int.from_bytes(header, "big")
+        msg = self._rfile.read(size)
+        if len(msg) < size:
+            raise ConnectionError(f"connection to {self.host}:{self.port} closed")
+        return self._decode(msg)
+
+    def _roundtrip(self, msg: bytes) -> ReplyType:
+        self._write(msg)
+        return self._read()
+
+    def _call(self, cmd: str, payload: Dict) -> Any:
+        attempt = 0
+        while True:
+            sent = False
+            try:
+                if self._sock is None:
+                    self.connect()
+                self._write(self._encode(cmd, payload))
+                sent = True
+                reply = self._read()
+            except OSError as e:
+                self.close()
+                if not self._retry(cmd, sent, attempt):
+                    raise ConnectionError(f"{cmd} failed, connection to {self.host}:{self.port} lost: {e}")
+                attempt += 1
+                continue
+            if reply.get("error") == "InvalidUserError" and attempt < self.retries:
+                # the server forgot our key, e.g. after a config reload
+                self.authenticate()
+                attempt += 1
+                continue
+            self.last_used = time.monotonic()
+            return self._result(cmd, payload, reply)
+
+    def _pipeline(self, queue: List[Tuple[str, Dict]], raise_on_error: bool) -> List[Any]:
+        if self._sock is None:
+            self.connect()
+        results: List[Any] = []
+        try:
+            for start in range(0, len(queue), PIPELINE_WINDOW):
+                window = queue[start : start + PIPELINE_WINDOW]
+                self._sock.sendall(b"".join(self._encode(cmd, payload) for cmd, payload in window))
+                for cmd, payload in window:
+                    reply = self._read()
+                    try:
+                        results.append(self._result(cmd, payload, reply))
+                    except Exception as e:
+                        results.append(e)
+        except OSError as e:
+            self.close()
+            self.in_transaction = False
+            raise ConnectionError(f"pipeline failed after {len(results)} replies, connection lost: {e}")
+        self.last_used = time.monotonic()
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    def pipeline(self) -> Pipeline:
+        return Pipeline(self)
+
+    def is_stale(self) -> bool:
+        # an idle connection has nothing to read, unless the server closed it
+        if self._sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._rfile.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._rfile = None
+
+    def __enter__(self) -> "Connection":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class ConnectionPool(_Commands):
+    """
+    Up to `size` connections shared by threads. Every command method takes a
+    connection for one call, pipeline() for one batch and connection() for
+    longer, e.g. a transaction. A connection idle for `check_interval`
+    seconds is checked with HEALTH before it is handed out, one closed by
+    the server is reopened.
+    """
+
+    def __init__(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        user: str = "",
+        password: str = "",
+        encrypt: bool = False,
+        dbname: Optional[str] = None,
+        section: Optional[str] = None,
+        size: int = 8,
+        timeout: Optional[float] = None,
+        retries: int = 1,
+        check_interval: float = 30.0,
+    ) -> None:
+        self._options = dict(
+            host=host, port=port, user=user, password=password, encrypt=encrypt, timeout=timeout, retries=retries
+        )
+        self.dbname = dbname
+        self.section = section
+        self.size = size
+        self.check_interval = check_interval
+        # shared by the connections, so the key is derived once for the pool
+        self.salt = secrets.token_bytes(16)
+        self._idle: Deque[Connection] = deque()
+        self._open = 0
+        self._closed = False
+        self._cond = Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> Connection:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise ConnectionError("the pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    conn = None
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"no connection free in the pool after {timeout}s")
+                self._cond.wait(remaining)
+        try:
+            if conn is None:
+                conn = Connection(dbname=self.dbname, section=self.section, salt=self.salt, **self._options)
+            else:
+                self._check(conn)
+            return conn
+        except BaseException:
+            if conn is not None:
+                conn.close()
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def _check(self, conn: Connection) -> None:
+        if conn.is_stale():
+            conn.connect()
+        elif time.monotonic() - conn.last_used > self.check_interval:
+            try:
+                conn.health()
+            except ConnectionError:
+                conn.connect()
+        if conn.dbname != self.dbname and self.dbname is not None:
+            conn.use_db(self.dbname, self.section)
+
+    def release(self, conn: Connection) -> None:
+        if conn.in_transaction:
+            # never hand a transaction over to the next user
+            try:
+                conn.rollback()
+            except Exception:
+                conn.close()
+        with self._cond:
+            if conn.connected and not self._closed:
+                self._idle.append(conn)
+            else:
+                conn.close()
+                self._open -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[Connection]:
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def _call(self, cmd: str, payload: Dict) -> Any:
+        if cmd in SESSION_COMMANDS:
+            raise TypeError(f"{cmd} holds connection state, run it on pool.connection()")
+        with self.connection() as conn:
+            result = conn._call(cmd, payload)
+        if cmd == "USE_DB":
+            # the other connections switch when they are next acquired
+            self.dbname, self.section = payload["dbname"], payload["section"]
+        return result
+
+    def _pipeline(self, queue: List[Tuple[str, Dict]], raise_on_error: bool) -> List[Any]:
+        with self.connection() as conn:
+            return conn._pipeline(queue, raise_on_error)
+
+    def pipeline(self) -> Pipeline:
+        return Pipeline(self)
+
+    def pool_stats(self) -> Dict:
+        with self._cond:
+            return {"size": self.size, "open": self._open, "idle": len(self._idle)}
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def __enter__(self) -> "ConnectionPool":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class AsyncConnection(_Session):
+    """
+    The asyncio counterpart of Connection, created with `await
+    AsyncConnection.open(...)`. Commands of concurrent tasks are pipelined
+    on the connection: each one is written at once and its reply is
+    matched by order. A transaction therefore covers the commands of every
+    task using the connection, give it one of its own.
+    """
+
+    def __init__(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        user: str = "",
+        password: str = "",
+        encrypt: bool = False,
+        dbname: Optional[str] = None,
+        section: Optional[str] = None,
+        timeout: Optional[float] = None,
+        retries: int = 1,
+        salt: Optional[bytes] = None,
+    ) -> None:
+        super().__init__(host, port, user, password, encrypt, dbname, section, timeout, retries, salt)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._replies: Optional[asyncio.Task] = None
+        self._waiting: Deque[asyncio.Future] = deque()
+        self._connecting: Optional[asyncio.Lock] = None
+
+    @classmethod
+    async def open(cls, *args: Any, **kwargs: Any) -> "AsyncConnection":
+        conn = cls(*args, **kwargs)
+        await conn.connect()
+        return conn
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def connect(self) -> None:
+        self.close()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        sock = self._writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._key = None
+        try:
+            self._writer.write(self._auth_message())
+            self._authenticated(await self._read())
+            self._replies = asyncio.ensure_future(self._dispatch_replies())
+            payload = self._use_db_payload()
+            if payload is not None:
+                await self._send("USE_DB", payload)
+        except BaseException:
+            self.close()
+            raise
+
+    async def _read(self) -> ReplyType:
+        header = await self._reader.readexactly(8)
+        return self._decode(await self._reader.readexactly(int.from_bytes(header, "big")))
+
+    async def _dispatch_replies(self) -> None:
+        # resolves the waiting commands in the order they were written
+        error: BaseException = ConnectionError(f"connection to {self.host}:{self.port} closed")
+        try:
+            while True:
+                header = await self._reader.readexactly(8)
+                msg = await self._reader.readexactly(int.from_bytes(header, "big"))
+                waiter = self._waiting.popleft()
+                if not waiter.done():
+                    waiter.set_result(msg)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            error = ConnectionError(f"connection to {self.host}:{self.port} lost: {e}")
+        except asyncio.CancelledError:
+            pass
+        waiting, self._waiting = self._waiting, deque()
+        for waiter in waiting:
+            if not waiter.done():
+                waiter.set_exception(error)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _write(self, msg: bytes) -> asyncio.Future:
+        # no await between queueing the waiter and the write, replies come back in write order
+        if self._writer is None:
+            raise ConnectionError(f"connection to {self.host}:{self.port} closed")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.append(waiter)
+        self._writer.write(msg)
+        return waiter
+
+    async def _send(self, cmd: str, payload: Dict) -> Any:
+        reply = self._decode(await self._write(self._encode(cmd, payload)))
+        return self._result(cmd, payload, reply)
+
+    async def _ensure_connected(self) -> None:
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self._writer is None:
+                await self.connect()
+
+    async def _call(self, cmd: str, payload: Dict) -> Any:
+        attempt = 0
+        while True:
+            sent = False
+            try:
+                await self._ensure_connected()
+                writer = self._writer
+                waiter = self._write(self._encode(cmd, payload))
+                sent = True
+                await writer.drain()
+                reply = self._decode(await waiter)
+            except OSError as e:
+                self.close()
+                if not self._retry(cmd, sent, attempt):
+                    raise ConnectionError(f"{cmd} failed, connection to {self.host}:{self.port} lost: {e}")
+                attempt += 1
+                continue
+            if reply.get("error") == "InvalidUserError" and attempt < self.retries:
+                self._authenticated(self._decode(await self._write(self._auth_message())))
+                attempt += 1
+                continue
+            self.last_used = time.monotonic()
+            return self._result(cmd, payload, reply)
+
+    async def _pipeline(self, queue: List[Tuple[str, Dict]], raise_on_error: bool) -> List[Any]:
+        await self._ensure_connected()
+        results: List[Any] = []
+        for start in range(0, len(queue), PIPELINE_WINDOW):
+            window = queue[start : start + PIPELINE_WINDOW]
+            writer = self._writer
+            waiters = [self._write(self._encode(cmd, payload)) for cmd, payload in window]
+            await writer.drain()
+            for (cmd, payload), waiter in zip(window, waiters):
+                reply = self._decode(await waiter)
+                try:
+                    results.append(self._result(cmd, payload, reply))
+                except Exception as e:
+                    results.append(e)
+        self.last_used = time.monotonic()
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    def pipeline(self) -> Pipeline:
+        return Pipeline(self)
+
+    def close(self) -> None:
+        if self._replies is not None:
+            self._replies.cancel()
+            self._replies = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def __aenter__(self) -> "AsyncConnection":
+        if self._writer is None:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class AsyncConnectionPool(_Commands):
+    """
+    The asyncio counterpart of ConnectionPool. Since an AsyncConnection
+    pipelines the commands of concurrent tasks, a few connections go a long
+    way, the pool mostly serves transactions (connection()).
+    """
+
+    def __init__(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        user: str = "",
+        password: str = "",
+        encrypt: bool = False,
+        dbname: Optional[str] = None,
+        section: Optional[str] = None,
+        size: int = 4,
+        timeout: Optional[float] = None,
+        retries: int = 1,
+        check_interval: float = 30.0,
+    ) -> None:
+        self._options = dict(
+            host=host, port=port, user=user, password=password, encrypt=encrypt, timeout=timeout, retries=retries
+        )
+        self.dbname = dbname
+        self.section = section
+        self.size = size
+        self.check_interval = check_interval
+        self.salt = secrets.token_bytes(16)
+        self._idle: Deque[AsyncConnection] = deque()
+        self._open = 0
+        self._closed = False
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        # created on first use, inside the running loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self, timeout: Optional[float] = None) -> AsyncConnection:
+        cond = self._condition()
+        async with cond:
+            if not self._idle and self._open >= self.size:
+                try:
+                    await asyncio.wait_for(
+                        cond.wait_for(lambda: self._closed or self._idle or self._open < self.size), timeout
+                    )
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"no connection free in the pool after {timeout}s")
+            if self._closed:
+                raise ConnectionError("the pool is closed")
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open += 1
+        try:
+            if conn is None:
+                conn = await AsyncConnection.open(
+                    dbname=self.dbname, section=self.section, salt=self.salt, **self._options
+                )
+            else:
+                await self._check(conn)
+            return conn
+        except BaseException:
+            if conn is not None:
+                conn.close()
+            async with cond:
+                self._open -= 1
+                cond.notify()
+            raise
+
+    async def _check(self, conn: AsyncConnection) -> None:
+        if not conn.connected:
+            await conn.connect()
+        elif time.monotonic() - conn.last_used > self.check_interval:
+            try:
+                await conn.health()
+            except ConnectionError:
+                await conn.connect()
+        if conn.dbname != self.dbname and self.dbname is not None:
+            await conn.use_db(self.dbname, self.section)
+
+    async def release(self, conn: AsyncConnection) -> None:
+        if conn.in_transaction:
+            try:
+                await conn.rollback()
+            except Exception:
+                conn.close()
+        cond = self._condition()
+        async with cond:
+            if conn.connected and not self._closed:
+                self._idle.append(conn)
+            else:
+                conn.close()
+                self._open -= 1
+            cond.notify()
+
+    @asynccontextmanager
+    async def connection(self, timeout: Optional[float] = None) -> AsyncIterator[AsyncConnection]:
+        conn = await self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    async def _call(self, cmd: str, payload: Dict) -> Any:
+        if cmd in SESSION_COMMANDS:
+            raise TypeError(f"{cmd} holds connection state, run it on pool.connection()")
+        async with self.connection() as conn:
+            result = await conn._call(cmd, payload)
+        if cmd == "USE_DB":
+            self.dbname, self.section = payload["dbname"], payload["section"]
+        return result
+
+    async def _pipeline(self, queue: List[Tuple[str, Dict]], raise_on_error: bool) -> List[Any]:
+        async with self.connection() as conn:
+            return await conn._pipeline(queue, raise_on_error)
+
+    def pipeline(self) -> Pipeline:
+        return Pipeline(self)
+
+    def pool_stats(self) -> Dict:
+        return {"size": self.size, "open": self._open, "idle": len(self._idle)}
+
+    async def close(self) -> None:
+        cond = self._condition()
+        async with cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+            cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    async def __aenter__(self) -> "AsyncConnectionPool":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
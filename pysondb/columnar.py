@@ -0,0 +1,324 @@
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from pysondb.errors import MalformedQueryError
+from pysondb.filters import MISSING
+from pysondb.filters import get_path
+
+
+# A column store keeps the numeric fields of a section as NumPy arrays, one
+# row per record, so structured filters and aggregates over them run as
+# array operations instead of a Python call per record. NumPy is optional
+# and only imported when a section declares columns.
+
+AGGREGATES = ("count", "sum", "avg", "min", "max")
+
+# operators with a vectorized form, for numeric operands only
+_RANGE_OPS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin")
+
+# ints beyond it are rounded by float64, neighbours would compare equal
+MAX_EXACT_INT = 2 ** 53
+
+
+def is_number(value: Any) -> bool:
+    # booleans are numbers, as in the Python comparisons of filters.py
+    return isinstance(value, (int, float))
+
+
+def is_exact(value: Any) -> bool:
+    # whether value is the same number as a float64
+    return not isinstance(value, int) or -MAX_EXACT_INT <= value <= MAX_EXACT_INT
+
+
+def _np():
+    import numpy
+
+    return numpy
+
+
+def numpy_available() -> bool:
+    try:
+        _np()
+    except ImportError:
+        return False
+    return True
+
+
+class ColumnStore:
+    """
+    The numeric fields of a section as float64 arrays aligned with an id list.
+    A value that is missing or not a number is NaN, which never matches a
+    comparison, like MISSING in filters.py. Deleted rows are tombstoned in
+    the `live` mask and compacted away once they are half of the rows. Kept
+    up to date from the database's mutation events like the other indexes.
+    A column that was given an int float64 cannot hold exactly is `inexact`
+    until the next rebuild: its conditions are checked row wise.
+    """
+
+    def __init__(self, section: str, fields: List[str], capacity: int = 1024) -> None:
+        np = _np()
+        self.section = section
+        self.fields = list(fields)
+        self._ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._live = np.zeros(capacity, dtype=bool)
+        self._columns = {f: np.full(capacity, np.nan) for f in self.fields}
+        self._dead = 0
+        self.inexact: Set[str] = set()
+
+    def _value(self, record: Any, field: str) -> float:
+        value = get_path(record, field) if isinstance(record, dict) else MISSING
+        if not is_number(value):
+            return float("nan")
+        if not is_exact(value):
+            self.inexact.add(field)
+        return float(value)
+
+    def _grow(self, size: int) -> None:
+        np = _np()
+        capacity = len(self._live)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        live = np.zeros(capacity, dtype=bool)
+        live[: len(self._ids)] = self._live[: len(self._ids)]
+        self._live = live
+        for field, column in self._columns.items():
+            grown = np.full(capacity, np.nan)
+            grown[: len(self._ids)] = column[: len(self._ids)]
+            self._columns[field] = grown
+
+    def rebuild(self, records: Any) -> None:
+        np = _np()
+        records = records if isinstance(records, dict) else {}
+        n = len(records)
+        self._ids = list(records)
+        self._rows = {id: row for row, id in enumerate(self._ids)}
+        capacity = max(1024, n)
+        self._live = np.zeros(capacity, dtype=bool)
+        self._live[:n] = True
+        values = list(records.values())
+        self.inexact = set()
+        for field in self.fields:
+            column = np.full(capacity, np.nan)
+            column[:n] = [self._value(r, field) for r in values]
+            self._columns[field] = column
+        self._dead = 0
+
+    def _set(self, row: int, record: Any) -> None:
+        for field, column in self._columns.items():
+            column[row] = self._value(record, field)
+
+    def observe(self, event: Dict) -> None:
+        # PysonDB listener, runs under the database lock
+        if event["section"] != self.section:
+            return
+        op = event["op"]
+        if op == "insert":
+            row = len(self._ids)
+            self._grow(row + 1)
+            self._ids.append(event["id"])
+            self._rows[event["id"]] = row
+            self._live[row] = True
+            self._set(row, event["data"])
+        elif op == "update":
+            row = self._rows.get(event["id"])
+            if row is not None:
+                self._set(row, event["data"])
+        elif op == "delete":
+            row = self._rows.pop(event["id"], None)
+            if row is not None:
+                self._live[row] = False
+                self._ids[row] = None
+                self._dead += 1
+                if self._dead * 2 > len(self._ids):
+                    self._compact()
+        elif op in ("purge", "add_section"):
+            self.rebuild(None)
+        elif op == "add_new_key":
+            n = len(self._ids)
+            for field in self.fields:
+                if field.split(".", 1)[0] == event["key"]:
+                    self._columns[field][:n] = self._value({event["key"]: event["default"]}, field)
+
+    def _compact(self) -> None:
+        n = len(self._ids)
+        keep = self._live[:n].nonzero()[0]
+        capacity = max(1024, len(keep) * 2)
+        np = _np()
+        live = np.zeros(capacity, dtype=bool)
+        live[: len(keep)] = True
+        for field, column in self._columns.items():
+            compacted = np.full(capacity, np.nan)
+            compacted[: len(keep)] = column[keep]
+            self._columns[field] = compacted
+        self._live = live
+        self._ids = [self._ids[row] for row in keep]
+        self._rows = {id: row for row, id in enumerate(self._ids)}
+        self._dead = 0
+
+    def compile(self, spec: Any) -> Optional[Callable[[], Any]]:
+        """
+        Turns a structured filter into a function returning the boolean row
+        mask, or None if some condition has no vectorized form (a field
+        without a column, a non numeric operand, $exists, $contains, ...).
+        """
+        mask, rest = self.split(spec)
+        return mask if mask is not None and not rest else None
+
+    def split(self, spec: Any) -> Tuple[Optional[Callable[[], Any]], Dict]:
+        """
+        Splits the conditions of a structured filter, implicitly and-ed, into
+        the row mask function of those with a vectorized form (None if there
+        are none) and a filter of the others, to be checked row wise on the
+        rows of the mask.
+        """
+        np = _np()
+        if spec is None or spec == {}:
+            return (lambda: self._live[: len(self._ids)].copy()), {}
+        if not isinstance(spec, dict):
+            raise MalformedQueryError(f"a filter must be of type dict and not {type(spec)}")
+        parts = []
+        rest = {}
+        for key, cond in spec.items():
+            part = None
+            if key in ("$and", "$or") and isinstance(cond, list):
+                subs = [self.compile(c) for c in cond]
+                if cond and all(sub is not None for sub in subs):
+                    combine = np.logical_and if key == "$and" else np.logical_or
+                    part = lambda subs=subs, combine=combine: combine.reduce([sub() for sub in subs])
+            elif key == "$not":
+                sub = self.compile(cond)
+                if sub is not None:
+                    part = lambda sub=sub: ~sub()
+            elif not key.startswith("$") and key in self._columns:
+                part = self._compile_field(key, cond)
+            if part is None:
+                rest[key] = cond
+            else:
+                parts.append(part)
+        if not parts:
+            return None, rest
+
+        def mask():
+            result = parts[0]()
+            for part in parts[1:]:
+                result &= part()
+            # tombstoned rows never match, whatever the condition
+            return result & self._live[: len(self._ids)]
+
+        return mask, rest
+
+    def _compile_field(self, field: str, cond: Any) -> Optional[Callable[[], Any]]:
+        np = _np()
+        if field in self.inexact:
+            return None
+        if not (isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond)):
+            cond = {"$eq": cond}
+        checks = []
+        for op, arg in cond.items():
+            if op not in _RANGE_OPS:
+                return None
+            if op in ("$in", "$nin"):
+                if not isinstance(arg, list) or not all(is_number(a) and is_exact(a) for a in arg):
+                    return None
+            elif not is_number(arg) or not is_exact(arg):
+                return None
+            checks.append((op, arg))
+
+        def mask():
+            column = self._columns[field][: len(self._ids)]
+            result = np.ones(len(column), dtype=bool)
+            with np.errstate(invalid="ignore"):
+                for op, arg in checks:
+                    if op == "$eq":
+                        result &= column == arg
+                    elif op == "$ne":
+                        result &= column != arg
+                    elif op == "$gt":
+                        result &= column > arg
+                    elif op == "$gte":
+                        result &= column >= arg
+                    elif op == "$lt":
+                        result &= column < arg
+                    elif op == "$lte":
+                        result &= column <= arg
+                    elif op == "$in":
+                        result &= np.isin(column, arg)
+                    else:
+                        result &= ~np.isin(column, arg)
+            return result
+
+        return mask
+
+    def ids(self, mask: Any) -> List[str]:
+        return [self._ids[row] for row in mask.nonzero()[0]]
+
+    def keep(self, mask: Any, fn: Callable[[str], bool]) -> Any:
+        # clears the rows of mask whose id fails fn, e.g. expired records
+        for row in mask.nonzero()[0]:
+            if not fn(self._ids[row]):
+                mask[row] = False
+        return mask
+
+    def column(self, field: str) -> Any:
+        return self._columns[field][: len(self._ids)]
+
+    def aggregate(self, field: str, mask: Any, bins: Optional[int], bounds: Optional[List[float]]) -> Dict:
+        np = _np()
+        values = self.column(field)[mask]
+        values = values[~np.isnan(values)]
+        result: Dict[str, Any] = {"count": int(len(values))}
+        if len(values):
+            result.update(
+                sum=float(values.sum()),
+                avg=float(values.mean()),
+                min=float(values.min()),
+                max=float(values.max()),
+            )
+        else:
+            result.update(sum=0, avg=None, min=None, max=None)
+        if bins:
+            counts, edges = np.histogram(values, bins=bins, range=bounds)
+            result["histogram"] = {"edges": edges.tolist(), "counts": counts.tolist()}
+        return result
+
+    def stats(self) -> Dict:
+        return {
+            "fields": self.fields,
+            "rows": len(self._ids) - self._dead,
+            "tombstones": self._dead,
+            "inexact": sorted(self.inexact),
+        }
+
+
+def aggregate_values(values: List[float], bins: Optional[int], bounds: Optional[List[float]]) -> Dict:
+    """
+    The row wise counterpart of ColumnStore.aggregate, for sections without columns.
+    """
+    result: Dict[str, Any] = {"count": len(values)}
+    if values:
+        total = float(sum(values))
+        result.update(sum=total, avg=total / len(values), min=float(min(values)), max=float(max(values)))
+    else:
+        result.update(sum=0, avg=None, min=None, max=None)
+    if bins:
+        lo, hi = bounds if bounds else ((min(values), max(values)) if values else (0.0, 1.0))
+        if lo == hi:
+            lo, hi = lo - 0.5, hi + 0.5
+        width = (hi - lo) / bins
+        counts = [0] * bins
+        for v in values:
+            if lo <= v <= hi:
+                counts[min(int((v - lo) / width), bins - 1)] += 1
+        result["histogram"] = {
+            "edges": [lo + i * width for i in range(bins)] + [float(hi)],
+            "counts": counts,
+        }
+    return result
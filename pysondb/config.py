@@ -2,17 +2,17 @@
 
 from os.path import exists
 from os import remove
-from symbol import try_stmt
 import uuid
 from threading import Lock
+from threading import Thread
+from threading import Timer
+import hashlib
+import os
 import secrets
+import time
+from copy import deepcopy
 from base64 import urlsafe_b64encode as b64e, urlsafe_b64decode as b64d
 
-from cryptography.fernet import Fernet
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-
 
 try:
     import ujson as json
@@ -23,7 +23,9 @@ import uuid
 from typing import List
 from typing import Optional
 from typing import Union
+from typing import Callable
 from typing import Dict
+from typing import Tuple
 
 from pysondb.errors import MissingConfigError
 from pysondb.errors import InvalidUserError
@@ -31,37 +33,161 @@ from os import getcwd
 import zlib
 from base64 import urlsafe_b64encode as b64e, urlsafe_b64decode as b64d
 
-backend = default_backend()
 iterations = 100_000
+# cached AUTH verifications, cleared whenever the config is swapped
+AUTH_CACHE_SIZE = 4096
+# derived encryption keys by (password, salt, iterations), see derive_key
+KEY_CACHE_SIZE = 1024
+_key_cache: Dict[Tuple[bytes, bytes, int], bytes] = {}
+
+
 class Config:
 
-    def __init__(self, filename: str) -> None:
+    def __init__(
+        self, filename: str, reload_interval: Optional[float] = None, write_delay: Optional[float] = None
+    ) -> None:
         self._filename: str = filename
         self._lock = Lock()
-
+        self._listeners: List[Callable[[Dict], None]] = []
+        self._auth_cache: Dict[bytes, Optional[str]] = {}
+        self._save_timer: Optional[Timer] = None
+        # the changes made since the last save, applied again to the file
+        # when it was edited meanwhile, see _save
+        self._pending: List[Callable[[Dict], None]] = []
+        self._watcher: Optional[Thread] = None
 
         with self._lock:
             self._pwd = getcwd()
             if exists(self._filename):
-                with open(self._filename, encoding="utf-8", mode="r") as f:
-                    self._config: dict = json.load(f)
+                self._swap(self._read())
             else:
                 raise (
                     MissingConfigError(
                         f"the config file :{self._filename} does not exist."
                     )
                 )
+        self._reload_interval = (
+            self._config.get("config_reload_interval", 2.0)
+            if reload_interval is None else reload_interval
+        )
+        self._write_delay = (
+            self._config.get("config_write_delay", 0.5)
+            if write_delay is None else write_delay
+        )
+
+    def _stat(self):
+        st = os.stat(self._filename)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read(self) -> Dict:
+        with open(self._filename, encoding="utf-8", mode="r") as f:
+            config = json.load(f)
+        self._mtime = self._stat()
+        return config
+
+    def _swap(self, config: Dict) -> None:
+        # readers only ever see a complete config, users index and empty auth cache
+        self._users = {u["user"]: u for u in config.get("users", [])}
+        self._databases = {d["name"]: d for d in config.get("databases", [])}
+        self._auth_cache = {}
+        self._config: dict = config
+
+    def add_listener(self, fn: Callable[[Dict], None]) -> None:
+        """
+        fn is called with the new config every time it is swapped in.
+        """
+        self._listeners.append(fn)
+
+    def _notify(self) -> None:
+        for fn in self._listeners:
+            fn(self._config)
+
+    def reload(self) -> bool:
+        try:
+            config = self._read()
+        except (OSError, ValueError) as e:
+            print(f"config reload failed, keeping the current config: {e}")
+            return False
+        with self._lock:
+            for change in self._pending:
+                change(config)
+            self._swap(config)
+        self._notify()
+        print("config reloaded")
+        return True
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self._reload_interval)
+            try:
+                changed = self._stat() != self._mtime
+            except OSError:
+                continue
+            if changed:
+                self.reload()
+
+    def start_watching(self) -> None:
+        """
+        Polls the config file and hot reloads users and databases when it changes.
+        """
+        if self._reload_interval and self._watcher is None:
+            self._watcher = Thread(target=self._watch, name="config-watcher", daemon=True)
+            self._watcher.start()
 
     def obscure(self, data: bytes) -> bytes:
-        return b64e(zlib.compress(data, 9))
+        return obscure(data)
 
     def unobscure(self, obscured: bytes) -> bytes:
         return zlib.decompress(b64d(obscured))
 
     def _save(self) -> None:
+        edited = False
         with self._lock:
-            with open(self._filename, encoding="utf-8", mode="w") as f:
+            self._save_timer = None
+            pending, self._pending = self._pending, []
+            try:
+                edited = self._stat() != self._mtime
+            except OSError:
+                pass
+            if edited:
+                # changed on disk since it was read, keep those edits and apply ours on top
+                try:
+                    config = self._read()
+                except (OSError, ValueError) as e:
+                    print(f"config re-read failed, overwriting it with the current config: {e}")
+                    edited = False
+                else:
+                    for change in pending:
+                        change(config)
+                    self._swap(config)
+            tmp = f"{self._filename}.tmp"
+            with open(tmp, encoding="utf-8", mode="w") as f:
                 json.dump(self._config, f, indent=4)
+            os.replace(tmp, self._filename)
+            self._mtime = self._stat()
+        if edited:
+            self._notify()
+
+    def _change(self, change: Callable[[Dict], None]) -> None:
+        # applies change to a copy of the config and schedules its save; call with the lock held
+        config = deepcopy(self._config)
+        change(config)
+        self._swap(config)
+        self._pending.append(change)
+        self._schedule_save()
+
+    def _schedule_save(self) -> None:
+        # coalesces bursts of CREATE_DB / del_db into a single write; call with the lock held
+        if self._save_timer is None:
+            self._save_timer = Timer(self._write_delay, self._save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self) -> None:
+        timer = self._save_timer
+        if timer is not None:
+            timer.cancel()
+            self._save()
 
     def get_config(self) -> Dict:
         return self._config
@@ -69,71 +195,131 @@ class Config:
     def get_pwd(self):
         return self._pwd
 
-    def add_db(self, db: str,user:str) -> bool:
-        self._config['databases'].append({'name': db, 'filename': db + '.json'})
-        for u in self._config['users']:
-            if u == user:
-                u['access'].append(db)
-        self._save()
+    def get_db_conf(self, dbname: str) -> Optional[Dict]:
+        return self._databases.get(dbname)
+
+    def add_db(self, db: str, user: str) -> bool:
+        def change(config: Dict) -> None:
+            if all(d["name"] != db for d in config["databases"]):
+                config["databases"].append({"name": db, "filename": db + ".json"})
+            for u in config["users"]:
+                if u["user"] == user and db not in u["access"]:
+                    u["access"].append(db)
+
+        with self._lock:
+            self._change(change)
+        self._notify()
         return True
 
     def del_db(self, dbname: str) -> bool:
-        dbs = self._config["databases"]
-        for db in dbs:
-            if db["name"] == dbname:
-                remove(db["filename"])
-                dbs.remove(db)
-                for u in self._config["users"]:
-                    try:
-                        u["access"].remove(dbname)
-                    except ValueError:
-                        pass
-                self._save()
-                return True
-        return False
+        def change(config: Dict) -> None:
+            config["databases"] = [d for d in config["databases"] if d["name"] != dbname]
+            for u in config["users"]:
+                try:
+                    u["access"].remove(dbname)
+                except ValueError:
+                    pass
+
+        with self._lock:
+            db = self._databases.get(dbname)
+            if db is None:
+                return False
+            remove(db["filename"])
+            self._change(change)
+        self._notify()
+        return True
 
     def exists(self, dbname: str) -> bool:
-        for db in self._config:
-            if db["name"] == dbname:
-                return True
-        return False
+        return dbname in self._databases
 
     def auth_user(self, data: object) -> Dict:
         upass = json.loads(self.unobscure(bytes(data[1:], "utf-8")))
         u = upass["u"]
         p = upass["p"]
-        passwd = str(self.obscure(bytes(u + p + u, "utf-8")), "utf-8")
-        for user in self._config["users"]:
-            if user["user"] == u and user["passwd"] == passwd:
-                _auth = user.copy()
-                _auth["passwd"] = p
-                _auth["key"] = str(
-                    self.obscure(bytes(str(uuid.uuid4()) + u, "utf-8")), "utf-8"
-                )
-                return _auth
+        digest = hashlib.sha256(bytes(u + "\0" + p, "utf-8")).digest()
+        users, cache = self._users, self._auth_cache
+        if digest in cache:
+            name = cache[digest]
+        else:
+            passwd = str(self.obscure(bytes(u + p + u, "utf-8")), "utf-8")
+            user = users.get(u)
+            name = u if user is not None and user["passwd"] == passwd else None
+            if len(cache) >= AUTH_CACHE_SIZE:
+                cache.clear()
+            cache[digest] = name
+        if name is not None and name in users:
+            _auth = users[name].copy()
+            _auth["access"] = list(_auth.get("access", []))
+            _auth["passwd"] = p
+            _auth["key"] = str(
+                self.obscure(bytes(str(uuid.uuid4()) + u, "utf-8")), "utf-8"
+            )
+            return _auth
         raise InvalidUserError(f"User '{u}' does not exist or has an invalid password")
 
     def _derive_key(self,password: bytes, salt: bytes, iterations: int = iterations) -> bytes:
-        """Derive a secret key from a given password and salt"""
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(), length=32, salt=salt,
-            iterations=iterations, backend=backend)
-        return b64e(kdf.derive(password))
+        return derive_key(password, salt, iterations)
+
+    def password_encrypt(
+        self, message: bytes, password: str, iterations: int = iterations, salt: Optional[bytes] = None
+    ) -> bytes:
+        return password_encrypt(message, password, iterations, salt)
+
+    def password_decrypt(self,token: bytes, password: str) -> bytes:
+        return password_decrypt(token, password)
+
+
+# The wire encryption, shared by the server, replicas and pysondb.client. A
+# message is b64(salt + iterations + Fernet token) with a key derived from the
+# password with PBKDF2, which is slow on purpose: the derived keys are cached,
+# so a connection sticking to one salt (see the "salt" of AUTH) derives once.
 
-    def password_encrypt(self,message: bytes, password: str, iterations: int = iterations) -> bytes:
+def obscure(data: bytes) -> bytes:
+    return b64e(zlib.compress(data, 9))
+
+
+def derive_key(password: bytes, salt: bytes, iterations: int = iterations) -> bytes:
+    """Derive a secret key from a given password and salt"""
+    cache_key = (password, salt, iterations)
+    key = _key_cache.get(cache_key)
+    if key is not None:
+        return key
+    # cryptography is imported on first use, plain connections and the CLI never need it
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(), length=32, salt=salt,
+        iterations=iterations)
+    key = b64e(kdf.derive(password))
+    if len(_key_cache) >= KEY_CACHE_SIZE:
+        _key_cache.clear()
+    _key_cache[cache_key] = key
+    return key
+
+
+def password_encrypt(
+    message: bytes, password: str, iterations: int = iterations, salt: Optional[bytes] = None
+) -> bytes:
+    from cryptography.fernet import Fernet
+
+    if salt is None:
         salt = secrets.token_bytes(16)
-        key = self._derive_key(password.encode(), salt, iterations)
-        return b64e(
-            b'%b%b%b' % (
-                salt,
-                iterations.to_bytes(4, 'big'),
-                b64d(Fernet(key).encrypt(message)),
-            )
+    key = derive_key(password.encode(), salt, iterations)
+    return b64e(
+        b'%b%b%b' % (
+            salt,
+            iterations.to_bytes(4, 'big'),
+            b64d(Fernet(key).encrypt(message)),
         )
+    )
 
-    def password_decrypt(self,token: bytes, password: str) -> bytes:
-        decoded = b64d(token)
-        salt, iter, token = decoded[:16], decoded[16:20], b64e(decoded[20:])
-        iterations = int.from_bytes(iter, 'big')
-        key = self._derive_key(password.encode(), salt, iterations)
-        return Fernet(key).decrypt(token)
+
+def password_decrypt(token: bytes, password: str) -> bytes:
+    from cryptography.fernet import Fernet
+
+    decoded = b64d(token)
+    salt, iter, token = decoded[:16], decoded[16:20], b64e(decoded[20:])
+    iterations = int.from_bytes(iter, 'big')
+    key = derive_key(password.encode(), salt, iterations)
+    return Fernet(key).decrypt(token)
@@ -3,10 +3,20 @@
 
 
 import uuid
-from copy import deepcopy
-from pathlib import Path
+from bisect import insort
+from contextlib import contextmanager
+from itertools import islice
+from os.path import isfile
 from threading import Lock
+from threading import local
+from time import perf_counter
+from time import time
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Tuple
 from typing import Optional
 from typing import Union
 from typing import Dict
@@ -14,10 +24,18 @@ from typing import Dict
 
 try:
     import ujson as json
+    UJSON = True
 except ImportError:
     import json as json
+    UJSON = False
 
 
+from pysondb.checkpoint import Checkpointer
+from pysondb.columnar import ColumnStore
+from pysondb.columnar import aggregate_values
+from pysondb.columnar import is_number
+from pysondb.columnar import numpy_available
+from pysondb.checkpoint import atomic_write_json
 from pysondb.db_types import DBSchemaType
 from pysondb.db_types import IdGeneratorType
 from pysondb.db_types import NewKeyValidTypes
@@ -25,16 +43,61 @@ from pysondb.db_types import SingleDataType
 from pysondb.db_types import ReturnWithIdType
 from pysondb.db_types import QueryType
 from pysondb.errors import IdDoesNotExistError
+from pysondb.errors import IndexNotFoundError
 from pysondb.errors import SchemaTypeError
 from pysondb.errors import UnknownKeyError
 from pysondb.errors import SectionNotFoundError
 from pysondb.errors import SectionAlreadExistsError
 from pysondb.errors import MalformedQueryError
+from pysondb.errors import TransactionConflictError
+from pysondb.expiry import ExpiryIndex
+from pysondb.expiry import Sweeper
+from pysondb.expiry import TtlType
+from pysondb.expiry import is_expired
+from pysondb.filters import compile_filter
+from pysondb.filters import get_path
+from pysondb.id_generators import make_id_generator
+from pysondb.interning import Interner
+from pysondb.interning import intern_data
+from pysondb.jsoncache import JsonCache
+from pysondb.loader import record_size
+from pysondb.loader import section_size
+from pysondb.ordering import NULL_KEY
+from pysondb.ordering import OrderType
+from pysondb.ordering import SortKeyType
+from pysondb.ordering import SortedIndex
+from pysondb.ordering import check_limit
+from pysondb.ordering import compile_order
+from pysondb.ordering import sort_key
+from pysondb.ordering import top_k
+from pysondb.schema import SectionSchema
+from pysondb.search import TextIndex
+from pysondb.search import rank
+from pysondb.spill import MemoryBudget
+from pysondb.spill import SpilledSection
+from pysondb.spill import clear_segments
+from pysondb.updates import compile_projection
+from pysondb.updates import compile_update
+from pysondb.updates import copy_value
+from pysondb.updates import is_update_spec
+from pysondb.updates import update_keys
 
 
 class PysonDB:
+    # In memory mode (auto_update=False) records are never modified in place:
+    # every mutation stores a new dict. Snapshots therefore only need to copy
+    # the section dicts, and can be serialized without holding the lock.
+    # The records given to and returned by the public methods are copied, so
+    # that the caller cannot change them behind the JSON cache, the indexes
+    # or the interner; the server, which only serializes them, passes
+    # copy=False.
+
     def __init__(
-        self, filename: str, auto_update: bool = True, indent: int = 4
+        self,
+        filename: str,
+        auto_update: bool = True,
+        indent: int = 4,
+        checkpoint_interval: float = 0,
     ) -> None:
         self.filename = filename
         self.auto_update = auto_update
@@ -42,27 +105,430 @@ class PysonDB:
         self.indent = indent
         self._id_generator = self._gen_id
         self.lock = Lock()
+        self._write_lock = Lock()
+        self._op_stats = local()
+        self._version = 0
+        self._written_version = 0
+        self._checkpointer: Optional[Checkpointer] = None
+        self._listeners: List[Callable[[Dict], None]] = []
+        self._seq = 0
+        # seq numbers only mean something within one run, see run_id
+        self.run_id = uuid.uuid4().hex
+        self._section_seq: Dict[str, int] = {}
+        self._schemas: Dict[str, SectionSchema] = {}
+        self._schema_conf: Dict[str, Tuple[Optional[Dict], Optional[Dict]]] = {}
+        self._ttl: Dict[str, TtlType] = {}
+        self._expiry: Optional[ExpiryIndex] = None
+        self._sweeper: Optional[Sweeper] = None
+        self._indexes: Dict[Tuple[str, str], SortedIndex] = {}
+        self._text_indexes: Dict[str, TextIndex] = {}
+        self._column_stores: Dict[str, ColumnStore] = {}
+        # encoded JSON of the records for the server's responses, see enable_json_cache
+        self.json_cache: Optional[JsonCache] = None
+        # shares the repeated values of the records, see enable_interning
+        self._interner: Optional[Interner] = None
+        # approximate bytes held by the records of every section in memory,
+        # kept up to date on every mutation
+        self._sizes: Dict[str, int] = {}
+        self._budget: Optional[MemoryBudget] = None
 
         self._gen_db_file()
+        if checkpoint_interval and not auto_update:
+            self._checkpointer = Checkpointer(self, checkpoint_interval)
+            self._checkpointer.start()
 
-    def _load_file(self) -> DBSchemaType:
-        if self.auto_update:
-            with open(self.filename, encoding="utf-8", mode="r") as f:
-                return json.load(f)
+    def _stats(self) -> Dict:
+        stats = getattr(self._op_stats, "data", None)
+        if stats is None:
+            stats = self._op_stats.data = {"scanned": 0, "returned": 0, "phases": {}}
+        return stats
+
+    def reset_op_stats(self) -> None:
+        """
+        Clears the per thread statistics collected for the next operation.
+        """
+        self._op_stats.data = None
+
+    def last_op_stats(self) -> Dict:
+        """
+        Records scanned / returned and phase timings (ms) of the last operation run by this thread.
+        """
+        return self._stats()
+
+    def _count(self, scanned: int, returned: int) -> None:
+        stats = self._stats()
+        stats["scanned"] += scanned
+        stats["returned"] += returned
+
+    @contextmanager
+    def _phase(self, name: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            phases = self._stats()["phases"]
+            phases[name] = phases.get(name, 0.0) + (perf_counter() - start) * 1000
+
+    @property
+    def seq(self) -> int:
+        """
+        Sequence number of the last mutation, see add_listener. The numbering
+        starts over with every handle of the database (a server restart, a
+        reload), run_id names it and every event carries it. run_id changes
+        too when the whole content is replaced without events (force_load,
+        load_snapshot): seqs and events only follow on from the same run_id.
+        """
+        return self._seq
+
+    def add_listener(self, fn: Callable[[Dict], None]) -> None:
+        """
+        fn is called with every mutation event ({"seq", "op", "section", ...}) while
+        the database lock is held, so it must be quick and must not call back into the db.
+        """
+        with self.lock:
+            self._listeners.append(fn)
+
+    def remove_listener(self, fn: Callable[[Dict], None]) -> None:
+        with self.lock:
+            self._listeners.remove(fn)
+
+    def _emit(self, op: str, section: str, **fields) -> None:
+        self._seq += 1
+        self._section_seq[section] = self._seq
+        if not self.auto_update:
+            self._account(op, section, fields)
+        if self._listeners:
+            event = {
+                "seq": self._seq, "ts": time(), "run_id": self.run_id, "op": op, "section": section, **fields
+            }
+            for fn in self._listeners:
+                fn(event)
+
+    def _account(self, op: str, section: str, fields: Dict) -> None:
+        sizes = self._sizes
+        if op == "insert":
+            sizes[section] = sizes.get(section, 0) + record_size(fields["id"], fields["data"])
+        elif op == "update":
+            sizes[section] = (
+                sizes.get(section, 0)
+                + record_size(fields["id"], fields["data"])
+                - record_size(fields["id"], fields["old"])
+            )
+        elif op == "delete":
+            sizes[section] = sizes.get(section, 0) - record_size(fields["id"], fields["old"])
+        elif op in ("purge", "add_section"):
+            sizes[section] = section_size({})
+        elif op == "add_new_key":
+            sizes[section] = section_size(self._au_memory[section])
+
+    def _compile_query(self, query: QueryType) -> QueryType:
+        with self._phase("eval"):
+            try:
+                _query = eval(query)
+            except Exception:
+                raise MalformedQueryError(f"Query {query} is malformed.")
+        if not callable(_query):
+            raise TypeError(f'"query" must be a callable and not {type(query)!r}')
+        return _query
+
+    def _compile_update(self, new_data: Dict) -> Tuple[List[str], Callable[[Dict], Dict]]:
+        # an update document ({"$set": ..., "$inc": ...}) only copies the changed
+        # paths, a plain dict is merged into the record as before
+        if is_update_spec(new_data):
+            written, update = update_keys(new_data), compile_update(new_data)
         else:
-            return deepcopy(self._au_memory)
+            written, update = list(new_data), lambda old: {**old, **new_data}
+        interner = self._interner
+        if interner is not None:
+            # called under the lock, like the interner
+            return written, lambda old: interner.record(update(old))
+        return written, update
+
+    def _copy(self, value: Any, copy: bool) -> Any:
+        # records on disk (auto_update) are parsed again for every call
+        return copy_value(value) if copy and not self.auto_update else value
+
+    def _schema(self, section: str, data: DBSchemaType, first: Optional[Dict] = None) -> SectionSchema:
+        keys = data["keys"][section]
+        if not isinstance(keys, list):
+            raise SchemaTypeError(f"keys must of type 'list' and not {type(keys)}")
+        types, defaults = self._schema_conf.get(section, (None, None))
+        if not keys and first is not None:
+            # the first record of an empty section defines its keys
+            return SectionSchema(sorted({**(defaults or {}), **first}), types, defaults)
+        schema = self._schemas.get(section)
+        # key lists are replaced, never changed in place, so a new list means a new schema
+        if schema is None or schema.source is not keys:
+            schema = self._schemas[section] = SectionSchema(keys, types, defaults)
+        return schema
+
+    def _adopt_schema(self, section: str, data: DBSchemaType, schema: SectionSchema) -> None:
+        if data["keys"][section] is not schema.source:
+            data["keys"][section] = schema.source
+            self._schemas[section] = schema
+
+    def set_schema(
+        self,
+        section: str,
+        types: Optional[Dict[str, str]] = None,
+        defaults: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Declares field types (str, int, float, bool, list, dict) and defaults for
+        the keys of a section, checked by add / add_many / update_*.
+        """
+        SectionSchema.check_conf(types, defaults)
+        with self.lock:
+            self._schema_conf[section] = (types, defaults)
+            self._schemas.pop(section, None)
+
+    def _read_file(self) -> DBSchemaType:
+        with open(self.filename, encoding="utf-8", mode="r") as f:
+            return json.load(f)
+
+    def _load_file(self, *sections: str) -> DBSchemaType:
+        # sections: the ones the caller is going to use, read back if spilled
+        with self._phase("load"):
+            if self.auto_update:
+                return self._read_file()
+            else:
+                for section in sections:
+                    self._page_in(self._au_memory, section)
+                return self._au_memory
+
+    def _page_in(self, data: DBSchemaType, section: str) -> None:
+        value = data.get(section)
+        if isinstance(value, SpilledSection):
+            with self._phase("page_in"):
+                data[section] = value.load()
+                if self._interner is not None:
+                    self._interner.records(data[section])
+            if self._budget is not None:
+                self._budget.paged_in()
+        if self._budget is not None and value is not None:
+            self._budget.touch(self, section)
+
+    @staticmethod
+    def _materialized(view: DBSchemaType) -> DBSchemaType:
+        # spilled sections read into the view only, the database stays within its budget
+        for k, v in view.items():
+            if isinstance(v, SpilledSection):
+                view[k] = v.load()
+        return view
 
     def _dump_file(self, data: DBSchemaType) -> None:
-        if self.auto_update:
-            with open(self.filename, encoding="utf-8", mode="w") as f:
-                json.dump(data, f, indent=self.indent)
-        else:
-            self._au_memory = deepcopy(data)
+        with self._phase("dump"):
+            if self.auto_update:
+                atomic_write_json(self.filename, data, self.indent)
+            else:
+                self._au_memory = data
+                self._version += 1
         return None
 
+    def _frozen_view(self) -> Tuple[int, DBSchemaType]:
+        data = self._au_memory
+        view = {k: (dict(v) if isinstance(v, dict) else v) for k, v in data.items()}
+        view["keys"] = {k: list(v) for k, v in data["keys"].items()}
+        return self._version, view
+
+    def snapshot(self) -> DBSchemaType:
+        """
+        A consistent point in time copy of the database, cheap since records are shared.
+        """
+        with self.lock:
+            if self.auto_update:
+                return self._read_file()
+            view = self._frozen_view()[1]
+        return self._materialized(view)
+
+    def snapshot_with_seq(self, materialize: bool = True) -> Tuple[int, DBSchemaType]:
+        """
+        Like snapshot, together with the seq of the last mutation it contains.
+        Without materialize, spilled sections are left as SpilledSection.
+        """
+        with self.lock:
+            if self.auto_update:
+                return self._seq, self._read_file()
+            seq, view = self._seq, self._frozen_view()[1]
+        return seq, (self._materialized(view) if materialize else view)
+
+    def snapshot_with_changes(self, tracker: Any) -> Tuple[int, DBSchemaType, Optional[Any]]:
+        """
+        Like snapshot_with_seq without materializing, together with what
+        tracker (a pysondb.backup.ChangeTracker) saw written since the previous
+        call, taken at the same point in time. The first call starts tracker
+        and returns no changes, so does the first one after the database was
+        replaced as a whole (see seq).
+        """
+        with self.lock:
+            if tracker.observe not in self._listeners:
+                self._listeners.append(tracker.observe)
+                changes = None
+            elif tracker.run_id != self.run_id:
+                # reloaded since the previous call, the events do not cover it
+                tracker.take()
+                changes = None
+            else:
+                changes = tracker.take()
+            tracker.run_id = self.run_id
+            if self.auto_update:
+                return self._seq, self._read_file(), changes
+            seq, view = self._seq, self._frozen_view()[1]
+        return seq, view, changes
+
+    def load_snapshot(self, data: DBSchemaType, seq: int) -> None:
+        """
+        Replaces the whole database, e.g. with a snapshot received from a primary.
+        """
+        with self.lock:
+            self._seq = seq
+            self.run_id = uuid.uuid4().hex
+            self._section_seq = {section: seq for section in data["keys"]}
+            if self._interner is not None:
+                intern_data(self._interner, data)
+            self._dump_file(data)
+            self._measure(data)
+            self._seed_id_generator(data)
+            if self._expiry is not None:
+                self._expiry.rebuild(data)
+            self._rebuild_indexes(data)
+
+    def _rebuild_indexes(self, data: DBSchemaType) -> None:
+        if self.json_cache is not None:
+            self.json_cache.clear()
+        for index in [
+            *self._indexes.values(),
+            *self._text_indexes.values(),
+            *self._column_stores.values(),
+        ]:
+            index.rebuild(data.get(index.section))
+
+    def apply_event(self, event: Dict) -> None:
+        """
+        Replays a mutation event produced by another database (see add_listener),
+        keeping its seq so both databases number their mutations the same way.
+        """
+        with self.lock:
+            data = self._load_file(event["section"])
+            self._replay(data, event)
+            self._dump_file(data)
+            self._seq = event["seq"] - 1
+            self._emit_replayed(event)
+
+    def _replay(self, data: DBSchemaType, event: Dict) -> None:
+        op, section = event["op"], event["section"]
+        if op in ("add_section", "purge"):
+            data["keys"][section] = []
+            data[section] = {}
+        elif op == "add_new_key":
+            key, default = event["key"], event["default"]
+            keys = list(data["keys"][section])
+            insort(keys, key)
+            data["keys"][section] = keys
+            records = data[section]
+            for id, d in records.items():
+                records[id] = {**d, key: default}
+        elif op in ("insert", "update"):
+            if op == "insert" and not data["keys"][section]:
+                data["keys"][section] = sorted(event["data"].keys())
+            record = event["data"]
+            if self._interner is not None:
+                record = self._interner.record(record)
+            data[section][event["id"]] = record
+        elif op == "delete":
+            data[section].pop(event["id"], None)
+        else:
+            raise ValueError(f"unknown event op {op!r}")
+
+    def _emit_replayed(self, event: Dict) -> None:
+        fields = {k: v for k, v in event.items() if k not in ("seq", "ts", "run_id", "op", "section")}
+        self._emit(event["op"], event["section"], **fields)
+
+    def commit_transaction(
+        self, events: List[Dict], base_seq: int, base_keys: Dict[str, List[str]]
+    ) -> int:
+        """
+        Applies the mutation events buffered by a transaction that started from the
+        snapshot at base_seq, all or nothing. Raises TransactionConflictError when
+        a record or section it wrote was changed by someone else since then.
+        """
+        with self.lock:
+            data = self._load_file(*{event["section"] for event in events})
+            self._check_conflicts(data, events, base_seq, base_keys)
+            with self._phase("apply"):
+                for event in events:
+                    self._replay(data, event)
+            self._dump_file(data)
+            for event in events:
+                self._emit_replayed(event)
+            return self._seq
+
+    def _check_conflicts(
+        self, data: DBSchemaType, events: List[Dict], base_seq: int, base_keys: Dict[str, List[str]]
+    ) -> None:
+        # first write of each record wins the comparison: its "old" is the
+        # snapshot's version, later writes of the same record see our own data
+        checked = set()
+        for event in events:
+            op, section = event["op"], event["section"]
+            if op in ("add_section", "purge", "add_new_key"):
+                if self._section_seq.get(section, 0) > base_seq:
+                    raise TransactionConflictError(
+                        f"section {section} was changed by another client since BEGIN"
+                    )
+                continue
+            if op == "insert":
+                if data["keys"].get(section) != base_keys.get(section):
+                    raise TransactionConflictError(
+                        f"the keys of section {section} changed since BEGIN"
+                    )
+                # the record is new, later writes of it in the transaction have nothing to compare
+                checked.add((section, event["id"]))
+                continue
+            key = (section, event["id"])
+            if key in checked:
+                continue
+            checked.add(key)
+            current = data.get(section, {}).get(event["id"])
+            old = event.get("old")
+            # records are copy-on-write, so an untouched record is the very same object
+            if current is not old and current != old:
+                raise TransactionConflictError(
+                    f"record {event['id']} of section {section} was changed by another client since BEGIN"
+                )
+
+    def checkpoint(self) -> bool:
+        """
+        Writes the in memory database to disk if it changed since the last checkpoint.
+        """
+        if self.auto_update:
+            return False
+        with self._write_lock:
+            with self.lock:
+                if self._version == self._written_version:
+                    return False
+                version, view = self._frozen_view()
+            # serialization runs outside the lock, writers carry on meanwhile
+            with self._phase("checkpoint"):
+                atomic_write_json(self.filename, view, self.indent)
+            self._written_version = version
+        return True
+
+    def close(self) -> None:
+        if self._budget is not None:
+            self._budget.unregister(self)
+            self._budget = None
+        if self._sweeper is not None:
+            self._sweeper.close()
+            self._sweeper = None
+        if self._checkpointer is not None:
+            self._checkpointer.close()
+            self._checkpointer = None
+        self.checkpoint()
+
     def _gen_db_file(self) -> None:
         if self.auto_update:
-            if not Path(self.filename).is_file():
+            if not isfile(self.filename):
                 self.lock.acquire()
                 self._dump_file({"version": 2, "keys": {}})
                 self.lock.release()
@@ -71,49 +537,683 @@ class PysonDB:
         # generates a random 18 digit uuid
         return str(int(uuid.uuid4()))[:18]
 
-    def force_load(self) -> None:
+    def _seed_id_generator(self, data: DBSchemaType) -> None:
+        # ordered generators must never hand out an id below one already stored
+        seed = getattr(self._id_generator, "seed", None)
+        if seed is None:
+            return
+        ids = []
+        for section in data["keys"]:
+            records = data.get(section)
+            if isinstance(records, SpilledSection):
+                records = records.load()
+            if isinstance(records, dict):
+                ids.extend(records.keys())
+        seed(ids)
+
+    def _gen_ids(self, n: int) -> List[str]:
+        reserve = getattr(self._id_generator, "reserve", None)
+        if reserve is not None:
+            return reserve(n)
+        return [str(self._id_generator()) for _ in range(n)]
+
+    def force_load(self, data: Optional[DBSchemaType] = None) -> None:
         """
         Used when the data from a file needs to be loaded when auto update is turned off.
+        data, if given, is the already parsed content of the file.
         """
         if not self.auto_update:
-            self.auto_update = True
-            self._au_memory = self._load_file()
-            self.auto_update = False
+            if data is None:
+                data = self._read_file()
+            with self.lock:
+                if self._interner is not None:
+                    with self._phase("intern"):
+                        intern_data(self._interner, data)
+                self._au_memory = data
+                self.run_id = uuid.uuid4().hex
+                self._version += 1
+                self._written_version = self._version
+                self._measure(data)
+                self._seed_id_generator(self._au_memory)
+                if self._expiry is not None:
+                    self._expiry.rebuild(self._au_memory)
+                self._rebuild_indexes(data)
+
+    def _measure(self, data: DBSchemaType) -> None:
+        self._sizes = {
+            section: section_size(data[section])
+            for section in data["keys"]
+            if isinstance(data.get(section), dict)
+        }
+
+    def section_bytes(self, section: str) -> int:
+        return self._sizes.get(section, 0)
+
+    def resident_bytes(self) -> int:
+        """
+        Approximate bytes held by the records that are in memory, read without the lock.
+        """
+        data = self._au_memory
+        cached = self.json_cache.bytes if self.json_cache is not None else 0
+        return cached + sum(
+            size
+            for section, size in list(self._sizes.items())
+            if not isinstance(data.get(section), SpilledSection)
+        )
+
+    def memory_stats(self) -> Dict:
+        with self.lock:
+            spilled = {
+                section: value
+                for section, value in self._au_memory.items()
+                if isinstance(value, SpilledSection)
+            }
+            total = sum(self._sizes.values())
+        spilled_bytes = sum(self._sizes.get(section, 0) for section in spilled)
+        stats = {
+            "resident_bytes": total - spilled_bytes,
+            "spilled_bytes": spilled_bytes,
+            "spilled_sections": sorted(spilled),
+        }
+        if self.json_cache is not None:
+            stats["json_cache"] = self.json_cache.stats()
+        if self._interner is not None:
+            stats["interning"] = self._interner.stats()
+        return stats
+
+    def enable_json_cache(self, max_bytes: int) -> None:
+        """
+        Caches the encoded JSON of the records read through the server (see
+        pysondb.jsoncache), up to max_bytes. Only in memory databases hold on
+        to their records between reads.
+        """
+        if self.auto_update:
+            return
+        with self.lock:
+            if self.json_cache is None:
+                self.json_cache = JsonCache(max_bytes)
+                self._listeners.append(self.json_cache.observe)
+            self.json_cache.max_bytes = max_bytes
+
+    def enable_interning(self, max_entries: int = 1 << 18) -> None:
+        """
+        Shares the repeated strings and small sub-objects of the records, as
+        they are loaded, inserted and updated, so that documents made of the
+        same values are held once (see pysondb.interning). The table of shared
+        values holds up to max_entries of them. Only in memory databases hold
+        on to their records.
+        """
+        if self.auto_update:
+            return
+        with self.lock:
+            if self._interner is None:
+                self._interner = Interner(max_entries)
+                intern_data(self._interner, self._au_memory)
+                if self.json_cache is not None:
+                    # the records are new objects, the cached ones are stale
+                    self.json_cache.clear()
+            self._interner.max_entries = max_entries
+
+    def set_memory_budget(self, budget: MemoryBudget) -> None:
+        """
+        Lets budget spill the least recently used sections of this database to
+        segment files next to it, they are read back on access.
+        """
+        if self.auto_update:
+            return
+        clear_segments(self._segment_dir())
+        with self.lock:
+            self._measure(self._au_memory)
+            self._budget = budget
+            budget.register(self)
+            for section in self._au_memory["keys"]:
+                budget.touch(self, section)
+
+    def _segment_dir(self) -> str:
+        return self.filename + ".segments"
+
+    def spill(self, section: str) -> bool:
+        """
+        Moves the records of section to a segment file, returns False if the
+        section is missing, already spilled or was written meanwhile.
+        """
+        if self.auto_update:
+            return False
+        with self.lock:
+            records = self._au_memory.get(section)
+            if not isinstance(records, dict) or section == "keys":
+                return False
+            seq = self._section_seq.get(section, 0)
+            copy = dict(records)
+        # serialized outside the lock, the copy shares the copy-on-write records
+        segment = SpilledSection.write(self._segment_dir(), copy, self._sizes.get(section, 0))
+        with self.lock:
+            if self._au_memory.get(section) is not records or self._section_seq.get(section, 0) != seq:
+                return False
+            self._au_memory[section] = segment
+            if self.json_cache is not None:
+                # the cache would keep the records alive
+                self.json_cache.drop(section)
+        return True
 
     def commit(self) -> None:
-        if not self.auto_update:
-            self.auto_update = True
-            self._dump_file(self._au_memory)
-            self.auto_update = False
+        """
+        Persists the in memory database. With a background checkpointer it
+        writes it, and concurrent commits wait for the same write.
+        """
+        if self.auto_update:
+            return
+        if self._checkpointer is None:
+            self.checkpoint()
+        else:
+            self._checkpointer.request(wait=True)
 
     def set_id_generator(self, fn: IdGeneratorType) -> None:
-        self._id_generator = fn
+        with self.lock:
+            self._id_generator = fn
+            self._seed_id_generator(self._load_file())
 
-    def add(self, section: str, data: object, ignore: bool = False) -> Dict:
-        if not isinstance(data, dict):
-            raise TypeError(f"data must be of type dict and not {type(data)}")
+    def use_id_generator(self, conf: Dict) -> None:
+        """
+        Switches to a built in id generator, e.g. {"type": "snowflake", "node": 2}.
+        """
+        self.set_id_generator(make_id_generator(conf))
+
+    def set_ttl(self, section: str, field: str, seconds: Optional[float] = None) -> None:
+        """
+        Records of section expire at the epoch timestamp (seconds) held in field.
+        With seconds, records added with field empty expire that long after the insert.
+        Expired records are hidden from reads at once and deleted by expire().
+        """
+        with self.lock:
+            self._ttl[section] = (field, seconds)
+            created = self._expiry is None
+            if created:
+                self._expiry = ExpiryIndex(self._ttl)
+            self._expiry.rebuild(self._load_file(*self._ttl))
+        if created:
+            self.add_listener(self._expiry.observe)
+
+    def start_sweeper(self, interval: float = 1.0, batch: int = 500) -> None:
+        """
+        Deletes expired records in the background, `batch` records per dump.
+        """
+        if self._sweeper is None:
+            self._sweeper = Sweeper(self, interval, batch)
+            self._sweeper.start()
+
+    def next_expiry(self) -> Optional[float]:
+        with self.lock:
+            return self._expiry.next_due() if self._expiry is not None else None
+
+    def expire(self, limit: int = 500) -> int:
+        """
+        Deletes up to limit expired records, returns how many were deleted. Only
+        the expiry index is consulted, never the whole section.
+        """
+        if self._expiry is None:
+            return 0
+        now = time()
+        with self.lock:
+            due = self._expiry.next_due()
+            if due is None or due > now:
+                return 0
+            data = self._load_file()
+            removed = []
+            for expires_at, section, id in self._expiry.due(now, limit):
+                self._page_in(data, section)
+                records = data.get(section)
+                record = records.get(id) if isinstance(records, dict) else None
+                field = self._ttl.get(section, (None, None))[0]
+                # stale entries: the record is gone or its expiry changed since
+                if record is not None and field and record.get(field) == expires_at:
+                    removed.append((section, id, records.pop(id)))
+            if removed:
+                self._dump_file(data)
+                for section, id, old in removed:
+                    self._emit("delete", section, id=id, old=old, expired=True)
+            return len(removed)
+
+    def _stamp_expiry(self, section: str, record: Dict) -> Dict:
+        ttl = self._ttl.get(section)
+        if ttl is None or ttl[1] is None or record.get(ttl[0]) is not None:
+            return record
+        return {**record, ttl[0]: time() + ttl[1]}
+
+    def _alive(self, section: str) -> Optional[Callable[[Dict], bool]]:
+        # None when the section has no TTL, so scans of other sections pay nothing
+        ttl = self._ttl.get(section)
+        if ttl is None:
+            return None
+        field, now = ttl[0], time()
+        return lambda record: not is_expired(record.get(field), now)
+
+    def create_index(self, section: str, path: str) -> None:
+        """
+        Keeps the ids of section sorted by the value at path (dotted), so reads
+        ordered by that path alone walk the index instead of ranking every record.
+        """
+        with self.lock:
+            if (section, path) in self._indexes:
+                return
+            index = SortedIndex(section, path)
+            index.rebuild(self._load_file(section).get(section))
+            self._indexes[(section, path)] = index
+            self._listeners.append(index.observe)
+
+    def drop_index(self, section: str, path: str) -> None:
+        with self.lock:
+            index = self._indexes.pop((section, path), None)
+            if index is not None:
+                self._listeners.remove(index.observe)
+
+    def indexes(self) -> List[Tuple[str, str]]:
+        with self.lock:
+            return list(self._indexes)
+
+    def create_text_index(self, section: str, fields: List[str]) -> None:
+        """
+        Indexes the words of the string (or list of strings) fields of section
+        for search(), replacing its previous text index.
+        """
+        if not isinstance(fields, list) or not fields or not all(isinstance(f, str) for f in fields):
+            raise TypeError(f"fields must be a non empty list of str and not {fields!r}")
+        with self.lock:
+            old = self._text_indexes.get(section)
+            if old is not None:
+                if old.fields == fields:
+                    return
+                self._listeners.remove(old.observe)
+            index = TextIndex(section, fields, lambda: self._load_file(section).get(section))
+            index.rebuild(self._load_file(section).get(section))
+            self._text_indexes[section] = index
+            self._listeners.append(index.observe)
+
+    def drop_text_index(self, section: str) -> None:
+        with self.lock:
+            index = self._text_indexes.pop(section, None)
+            if index is not None:
+                self._listeners.remove(index.observe)
+
+    def text_indexes(self) -> Dict[str, List[str]]:
+        with self.lock:
+            return {section: index.fields for section, index in self._text_indexes.items()}
+
+    def search(
+        self,
+        section: str,
+        query: str,
+        limit: int = 20,
+        offset: int = 0,
+        mode: str = "all",
+        fields: Optional[List[str]] = None,
+        copy: bool = True,
+    ) -> Dict:
+        """
+        Ranked ids of the records of section matching a text query (see
+        pysondb.search), one page of them: {"total": ..., "hits": [{"id", "score"}]}.
+        With fields, every hit also carries its record projected to them.
+        """
+        limit = check_limit(limit)
+        offset = check_limit(offset)
+        project = compile_projection(fields)
+        with self.lock:
+            index = self._text_indexes.get(section)
+            if index is None:
+                raise IndexNotFoundError(f"section {section} has no text index")
+            with self._phase("search"):
+                scores = index.search(query, mode)
+            alive = self._alive(section)
+            if alive is not None or fields is not None:
+                records = self._load_file(section)[section]
+            if alive is not None:
+                scores = {id: score for id, score in scores.items() if alive(records[id])}
+            hits = []
+            for id, score in rank(scores, offset, len(scores) if limit is None else limit):
+                hit = {"id": id, "score": round(score, 4)}
+                if fields is not None:
+                    hit["record"] = project(records[id])
+                hits.append(hit)
+            self._count(len(scores), len(hits))
+        return {"total": len(scores), "hits": self._copy(hits, copy) if fields is not None else hits}
+
+    def create_columns(self, section: str, fields: List[str]) -> bool:
+        """
+        Keeps the numeric values at fields (dotted paths) of section in NumPy
+        arrays, so find() and aggregate() evaluate the conditions on them as
+        array operations. Returns False, and reads stay row wise, without numpy.
+        """
+        if not isinstance(fields, list) or not fields or not all(isinstance(f, str) for f in fields):
+            raise TypeError(f"fields must be a non empty list of str and not {fields!r}")
+        if not numpy_available():
+            return False
+        with self.lock:
+            old = self._column_stores.get(section)
+            if old is not None:
+                if old.fields == fields:
+                    return True
+                self._listeners.remove(old.observe)
+            store = ColumnStore(section, fields)
+            store.rebuild(self._load_file(section).get(section))
+            self._column_stores[section] = store
+            self._listeners.append(store.observe)
+            return True
+
+    def drop_columns(self, section: str) -> None:
+        with self.lock:
+            store = self._column_stores.pop(section, None)
+            if store is not None:
+                self._listeners.remove(store.observe)
+
+    def columns(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {section: store.stats() for section, store in self._column_stores.items()}
+
+    def _column_mask(self, section: str, records: Dict, spec: Any) -> Tuple[Optional[ColumnStore], Any]:
+        # the rows of the section's column store matching the structured filter
+        # spec, or (None, None) when none of its conditions can be vectorized
+        store = self._column_stores.get(section)
+        if store is None:
+            return None, None
+        mask, rest = store.split(spec)
+        if mask is None:
+            return None, None
+        with self._phase("vectorized"):
+            rows = mask()
+        alive = self._alive(section)
+        if rest or alive is not None:
+            match = compile_filter(rest) if rest else None
+            rows = store.keep(
+                rows,
+                lambda id: (alive is None or alive(records[id])) and (match is None or match(records[id])),
+            )
+        return store, rows
+
+    def find(
+        self,
+        section: str,
+        filter: Optional[Dict] = None,
+        fields: Optional[List[str]] = None,
+        order_by: Optional[Union[str, List[str]]] = None,
+        limit: Optional[int] = None,
+        copy: bool = True,
+    ) -> Dict:
+        """
+        Like get_by_query with a structured filter (see pysondb.filters) instead
+        of a lambda. Conditions on the fields of the section's columns (see
+        create_columns) are evaluated on the whole column at once.
+        """
+        match = compile_filter(filter)
+        project = compile_projection(fields)
+        order = compile_order(order_by)
+        limit = check_limit(limit)
         try:
             with self.lock:
-                db_data = self._load_file()
-                keys = db_data["keys"][section]
-                if not isinstance(keys, list):
-                    raise SchemaTypeError(
-                        f"keys must of type 'list' and not {type(keys)}"
+                data = self._load_file(section)[section]
+                if not isinstance(data, dict):
+                    raise SchemaTypeError('"data" key in the DB must be of type dict')
+                store, rows = self._column_mask(section, data, filter)
+                if store is None:
+                    with self._phase("scan"):
+                        selected, scanned = self._select(section, data, match, order, limit)
+                else:
+                    ids = store.ids(rows)
+                    items = ((id, data[id]) for id in ids)
+                    if order is None:
+                        selected = dict(islice(items, limit))
+                    else:
+                        selected = dict(top_k(items, order, limit))
+                    scanned = len(ids)
+                if project is not None:
+                    selected = {id: project(values) for id, values in selected.items()}
+                self._count(scanned, len(selected))
+        except KeyError:
+            raise SectionNotFoundError(f"section: {section} must existing in database ")
+        return self._copy(selected, copy)
+
+    def _matching(
+        self, section: str, records: Dict, match: Optional[Callable[[Dict], bool]]
+    ) -> Iterator[Tuple[str, Dict]]:
+        # the (unexpired) records matching match, lazily
+        alive = self._alive(section)
+        for id, record in records.items():
+            if (
+                isinstance(record, dict)
+                and (alive is None or alive(record))
+                and (match is None or match(record))
+            ):
+                yield id, record
+
+    def lookup(
+        self,
+        section: str,
+        field: Optional[str],
+        other: str,
+        other_field: Optional[str] = None,
+        filter: Optional[Dict] = None,
+        other_filter: Optional[Dict] = None,
+        fields: Optional[List[str]] = None,
+        other_fields: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        outer: bool = False,
+        copy: bool = True,
+    ) -> List[List[Any]]:
+        """
+        Joins the records of section matching filter to the records of other
+        matching other_filter whose value at other_field equals their value at
+        field (None: the record id, on either side). Returns the joined rows,
+        [id, record, other id, other record], in the order of section, at most
+        limit of them. With outer, records of section without a match are
+        returned once, with None for the other side.
+
+        Joined on the id of other, each record is a dict lookup away, on an
+        indexed other_field (see create_index) a bisect away. Otherwise a hash
+        table is built over the side with the fewer matching records.
+        """
+        match = compile_filter(filter)
+        other_match = compile_filter(other_filter)
+        project = compile_projection(fields)
+        other_project = compile_projection(other_fields)
+        limit = check_limit(limit)
+        try:
+            with self.lock:
+                db_data = self._load_file(section, other)
+                records, other_records = db_data[section], db_data[other]
+                if not isinstance(records, dict) or not isinstance(other_records, dict):
+                    raise SchemaTypeError('"data" key in the DB must be of type dict')
+                other_alive = self._alive(other)
+
+                def key(id: str, record: Dict) -> SortKeyType:
+                    return sort_key(id if field is None else get_path(record, field))
+
+                def other_key(id: str, record: Dict) -> SortKeyType:
+                    return sort_key(id if other_field is None else get_path(record, other_field))
+
+                def accept(id: str) -> bool:
+                    record = other_records[id]
+                    return (
+                        isinstance(record, dict)
+                        and (other_alive is None or other_alive(record))
+                        and (other_match is None or other_match(record))
                     )
-                if len(keys) == 0:
-                    db_data["keys"][section] = sorted(list(data.keys()))
+
+                left = self._matching(section, records, match)
+                scanned = 0
+                index = self._indexes.get((other, other_field)) if other_field is not None else None
+                if other_field is None or index is not None:
+
+                    def probe(id: str, record: Dict) -> List[str]:
+                        k = key(id, record)
+                        if other_field is None:
+                            # ids are strings, sort_key puts them in group 2
+                            ids: Iterable[str] = (k[1],) if k[0] == 2 and k[1] in other_records else ()
+                        else:
+                            ids = index.equal(k) if k != NULL_KEY else ()
+                        return [i for i in ids if accept(i)]
+
+                    joined = ((id, record, probe(id, record)) for id, record in left)
                 else:
-                    if not ignore and not sorted(keys) == sorted(data.keys()):
-                        raise UnknownKeyError(
-                            f"Unrecognized / missing key(s) {set(keys) ^ set(data.keys())}"
-                            "(Either the key(s) does not exists in the DB or is missing in the given data)"
-                        )
+                    with self._phase("build"):
+                        right = list(self._matching(other, other_records, other_match))
+                        scanned += len(other_records)
+                        if len(right) > len(records):
+                            # the left side may match fewer records, it is read
+                            # whole only when the right side is the larger one
+                            left = list(left)
+                        if isinstance(left, list) and len(left) < len(right):
+                            # the table maps the keys of the left records to their
+                            # matches, filled while scanning the right side
+                            matches: Dict[SortKeyType, List[str]] = {}
+                            for id, record in left:
+                                matches.setdefault(key(id, record), [])
+                            matches.pop(NULL_KEY, None)
+                            for id, record in right:
+                                found = matches.get(other_key(id, record))
+                                if found is not None:
+                                    found.append(id)
+                        else:
+                            matches = {}
+                            for id, record in right:
+                                matches.setdefault(other_key(id, record), []).append(id)
+                            matches.pop(NULL_KEY, None)
+                        joined = ((id, record, matches.get(key(id, record), ())) for id, record in left)
+
+                rows: List[List[Any]] = []
+                with self._phase("join"):
+                    for id, record, other_ids in joined:
+                        if limit is not None and len(rows) >= limit:
+                            break
+                        scanned += 1
+                        if project is not None and (other_ids or outer):
+                            record = project(record)
+                        for other_id in other_ids:
+                            other_record = other_records[other_id]
+                            if other_project is not None:
+                                other_record = other_project(other_record)
+                            rows.append([id, record, other_id, other_record])
+                            if limit is not None and len(rows) >= limit:
+                                break
+                        if outer and not other_ids:
+                            rows.append([id, record, None, None])
+                self._count(scanned, len(rows))
+        except KeyError as e:
+            raise SectionNotFoundError(f"section: {e.args[0]} must existing in database ")
+        return self._copy(rows, copy)
+
+    def aggregate(
+        self,
+        section: str,
+        field: str,
+        filter: Optional[Dict] = None,
+        bins: Optional[int] = None,
+        bounds: Optional[List[float]] = None,
+    ) -> Dict:
+        """
+        count, sum, avg, min and max of the numeric values at field over the
+        records matching filter, and a histogram of `bins` equal bins between
+        bounds ([low, high], by default the min and max) if bins is given.
+        Records without a number at field are not counted.
+        """
+        if not isinstance(field, str):
+            raise TypeError(f"field must be of type str and not {type(field)}")
+        if bins is not None and (not isinstance(bins, int) or isinstance(bins, bool) or bins < 1):
+            raise MalformedQueryError(f"bins must be a positive int and not {bins!r}")
+        if bounds is not None and not (
+            isinstance(bounds, list)
+            and len(bounds) == 2
+            and all(is_number(b) for b in bounds)
+            and bounds[0] < bounds[1]
+        ):
+            raise MalformedQueryError(f"bounds must be [low, high] and not {bounds!r}")
+        match = compile_filter(filter)
+        try:
+            with self.lock:
+                data = self._load_file(section)[section]
+                if not isinstance(data, dict):
+                    raise SchemaTypeError('"data" key in the DB must be of type dict')
+                store, rows = self._column_mask(section, data, filter)
+                if store is not None and field in store.fields:
+                    result = store.aggregate(field, rows, bins, bounds)
+                    self._count(len(data), result["count"])
+                    return result
+                with self._phase("scan"):
+                    selected, scanned = self._select(section, data, match, None, None)
+                    values = []
+                    for record in selected.values():
+                        value = get_path(record, field)
+                        if is_number(value):
+                            values.append(float(value))
+                result = aggregate_values(values, bins, bounds)
+                self._count(scanned, result["count"])
+                return result
+        except KeyError:
+            raise SectionNotFoundError(f"section: {section} must existing in database ")
+
+    def _select(
+        self,
+        section: str,
+        records: Dict,
+        match: Optional[Callable[[Dict], bool]],
+        order: Optional[OrderType],
+        limit: Optional[int],
+    ) -> Tuple[Dict, int]:
+        # the matching (unexpired) records in order_by order, at most limit of
+        # them, and how many records were looked at
+        alive = self._alive(section)
+        index = None
+        if order is not None and len(order[0]) == 1:
+            index = self._indexes.get((section, order[0][0][0]))
+        if order is None or index is not None:
+            # insertion or index order: stop as soon as limit records matched
+            ids = records if index is None else index.walk(order[0][0][1])
+            selected: Dict = {}
+            scanned = 0
+            for id in ids:
+                if limit is not None and len(selected) >= limit:
+                    break
+                record = records[id]
+                scanned += 1
+                if not isinstance(record, dict):
+                    continue
+                if alive is not None and not alive(record):
+                    continue
+                if match is None or match(record):
+                    selected[id] = record
+            return selected, scanned
+        items: Iterable[Tuple[str, Dict]] = (
+            (id, record)
+            for id, record in records.items()
+            if isinstance(record, dict)
+            and (alive is None or alive(record))
+            and (match is None or match(record))
+        )
+        return dict(top_k(items, order, limit)), len(records)
+
+    def sections(self) -> List[str]:
+        with self.lock:
+            return list(self._load_file()["keys"])
+
+    def add(self, section: str, data: object, ignore: bool = False, copy: bool = True) -> Dict:
+        if not isinstance(data, dict):
+            raise TypeError(f"data must be of type dict and not {type(data)}")
+        data = self._copy(data, copy)
+        try:
+            with self.lock:
+                db_data = self._load_file(section)
+                if self._ttl:
+                    data = self._stamp_expiry(section, data)
+                schema = self._schema(section, db_data, data)
+                data = schema.validate(data, ignore)
+                if self._interner is not None:
+                    data = self._interner.record(data)
                 _id = str(self._id_generator())
                 if not isinstance(db_data[section], dict):
                     raise SchemaTypeError('data key in the db must be of type "dict"')
 
+                self._adopt_schema(section, db_data, schema)
                 db_data[section][_id] = data
                 self._dump_file(db_data)
+                self._emit("insert", section, id=_id, data=data)
                 return _id
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must existing in database ")
@@ -124,6 +1224,7 @@ class PysonDB:
         data: object,
         json_response: bool = True,
         ignore: bool = False,
+        copy: bool = True,
     ) -> Dict:  # Union[SingleDataType, None]:
         if not data:
             return None
@@ -133,113 +1234,158 @@ class PysonDB:
 
         if not all(isinstance(i, dict) for i in data):
             raise TypeError("all the new data in the data list must of type dict")
+        data = self._copy(data, copy)
         try:
             with self.lock:
                 # new_data: SingleDataType = {}
                 new_ids = []
-                db_data = self._load_file()
+                db_data = self._load_file(section)
+                if self._ttl:
+                    data = [self._stamp_expiry(section, d) for d in data]
                 # verify all the keys in all the dicts in the list are valid
-                keys = db_data["keys"][section]
-                if not keys:
-                    db_data["keys"][section] = sorted(list(data[0].keys()))
-                    keys = db_data["keys"][section]
-                if not isinstance(keys, list):
-                    raise SchemaTypeError(
-                        f"keys must of type 'list' and not {type(keys)}"
-                    )
-
-                for d in data:
-                    if not ignore and not sorted(keys) == sorted(d.keys()):
-                        raise UnknownKeyError(
-                            f"Unrecognized / missing key(s) {set(keys) ^ set(d.keys())}"
-                            "(Either the key(s) does not exists in the DB or is missing in the given data)"
-                        )
+                schema = self._schema(section, db_data, data[0])
+                with self._phase("validate"):
+                    data = [schema.validate(d, ignore) for d in data]
+                if self._interner is not None:
+                    with self._phase("intern"):
+                        data = [self._interner.record(d) for d in data]
 
                 if not isinstance(db_data[section], dict):
                     raise SchemaTypeError('data key in the db must be of type "dict"')
+                self._adopt_schema(section, db_data, schema)
 
-                for d in data:
-                    _id = str(self._id_generator())
+                inserted = list(zip(self._gen_ids(len(data)), data))
+                for _id, d in inserted:
                     db_data[section][_id] = d
                     if json_response:
                         new_ids.append(_id)
                         # new_data[_id] = d
                 self._dump_file(db_data)
+                for _id, d in inserted:
+                    self._emit("insert", section, id=_id, data=d)
                 return new_ids if json_response else True
                 # return  new_data if json_response else True
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must existing in database ")
 
-    def get_all(self) -> Dict:  # ReturnWithIdType:
+    def get_all(self, copy: bool = True) -> Dict:  # ReturnWithIdType:
         with self.lock:
             data = self._load_file()
             if isinstance(data, dict):
-                data.pop("version")
-                data.pop("keys")
-                return data
+                data = self._materialized(
+                    {
+                        k: dict(v) if isinstance(v, dict) else v
+                        for k, v in data.items()
+                        if k not in ("version", "keys")
+                    }
+                )
+                for section in self._ttl:
+                    alive = self._alive(section)
+                    if isinstance(data.get(section), dict):
+                        data[section] = {i: r for i, r in data[section].items() if alive(r)}
+                records = sum(len(v) for v in data.values() if isinstance(v, dict))
+                self._count(records, records)
+        if isinstance(data, dict):
+            return self._copy(data, copy)
         return ""
 
-    def get_all_by_section(self, section: str) -> Dict:
+    def get_all_by_section(
+        self,
+        section: str,
+        fields: Optional[List[str]] = None,
+        order_by: Optional[Union[str, List[str]]] = None,
+        limit: Optional[int] = None,
+        copy: bool = True,
+    ) -> Dict:
+        project = compile_projection(fields)
+        order = compile_order(order_by)
+        limit = check_limit(limit)
         try:
             with self.lock:
-                data = self._load_file()[section]
+                data = self._load_file(section)[section]
                 if isinstance(data, dict):
-                    return data
-            return ""
+                    if order is not None or limit is not None:
+                        with self._phase("scan"):
+                            data, scanned = self._select(section, data, None, order, limit)
+                        self._count(scanned, len(data))
+                    else:
+                        alive = self._alive(section)
+                        if alive is not None:
+                            data = {id: values for id, values in data.items() if alive(values)}
+                        self._count(len(data), len(data))
+                    if project is not None:
+                        data = {id: project(values) for id, values in data.items()}
+                    else:
+                        data = dict(data)
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must existing in database ")
+        if isinstance(data, dict):
+            return self._copy(data, copy)
+        return ""
 
-    def get_by_id(self, section: str, id: str) -> Dict:  # SingleDataType:
+    def get_by_id(
+        self, section: str, id: str, fields: Optional[List[str]] = None, copy: bool = True
+    ) -> Dict:  # SingleDataType:
         if not isinstance(id, str):
             raise TypeError(f'id must be of type "str" and not {type(id)}')
+        project = compile_projection(fields)
         try:
             with self.lock:
-                data = self._load_file()[section]
+                data = self._load_file(section)[section]
                 if isinstance(data, dict):
-                    if id in data:
-                        return data[id]
+                    alive = self._alive(section)
+                    if id in data and (alive is None or alive(data[id])):
+                        self._count(1, 1)
+                        record = data[id] if project is None else project(data[id])
                     else:
                         raise IdDoesNotExistError(f"{id!r} does not exists in the DB")
                 else:
                     raise SchemaTypeError('"data" key in the DB must be of type dict')
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must existing in database ")
+        return self._copy(record, copy)
 
-    def get_by_query(self, section: str, query: QueryType) -> Dict:  # ReturnWithIdType:
-        try:
-            _query = eval(query)
-        except Exception:
-            raise MalformedQueryError(f"Query {query} is malformed.")
-        if not callable(_query):
-            raise TypeError(f'"query" must be a callable and not {type(query)!r}')
+    def get_by_query(
+        self,
+        section: str,
+        query: QueryType,
+        fields: Optional[List[str]] = None,
+        order_by: Optional[Union[str, List[str]]] = None,
+        limit: Optional[int] = None,
+        copy: bool = True,
+    ) -> Dict:  # ReturnWithIdType:
+        _query = self._compile_query(query)
+        project = compile_projection(fields)
+        order = compile_order(order_by)
+        limit = check_limit(limit)
         try:
             with self.lock:
                 new_data: ReturnWithIdType = {}
-                data = self._load_file()[section]
+                data = self._load_file(section)[section]
                 if isinstance(data, dict):
-                    for id, values in data.items():
-                        if isinstance(values, dict):
-                            if _query(values):
-                                new_data[id] = values
-                return new_data
+                    with self._phase("scan"):
+                        new_data, scanned = self._select(section, data, _query, order, limit)
+                    if project is not None:
+                        new_data = {id: project(values) for id, values in new_data.items()}
+                    self._count(scanned, len(new_data))
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must existing in database ")
+        return self._copy(new_data, copy)
 
     def update_by_id(
-        self, section: str, id: str, new_data: object
+        self, section: str, id: str, new_data: object, copy: bool = True
     ) -> Dict:  # SingleDataType:
         if not isinstance(new_data, dict):
             raise TypeError(f"new_data must be of type dict and not {type(new_data)!r}")
+        new_data = self._copy(new_data, copy)
+        written, update = self._compile_update(new_data)
         try:
             with self.lock:
-                data = self._load_file()
-                keys = data["keys"][section]
-
-                if isinstance(keys, list):
-                    if not all(i in keys for i in new_data):
-                        raise UnknownKeyError(
-                            f"Unrecognized key(s) {[i for i in new_data if i not in keys]}"
-                        )
+                data = self._load_file(section)
+                schema = self._schema(section, data)
+                unknown = schema.unknown(written)
+                if unknown:
+                    raise UnknownKeyError(f"Unrecognized key(s) {unknown}")
 
                 if not isinstance(data[section], dict):
                     raise SchemaTypeError(
@@ -251,47 +1397,57 @@ class PysonDB:
                         f"The id {id!r} does noe exists in the DB"
                     )
 
-                data[section][id] = {**data[section][id], **new_data}
+                old = data[section][id]
+                new = update(old)
+                if schema.types:
+                    schema.check_types(new)
+                data[section][id] = new
                 self._dump_file(data)
-                return data[section][id]
+                self._emit("update", section, id=id, data=new, old=old)
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must existing in database ")
+        return self._copy(new, copy)
 
     def update_by_query(
-        self, section: str, query: QueryType, new_data: object
+        self, section: str, query: QueryType, new_data: object, copy: bool = True
     ) -> Dict:  # List[str]:
-        try:
-            _query = eval(query)
-        except Exception:
-            raise MalformedQueryError(f"Query {query} is malformed.")
-        if not callable(_query):
-            raise TypeError(f'"query" must be a callable and not {type(query)!r}')
+        _query = self._compile_query(query)
 
         if not isinstance(new_data, dict):
             raise TypeError(
                 f'"new_data" must be of type dict and not f{type(new_data)!r}'
             )
+        new_data = self._copy(new_data, copy)
+        written, update = self._compile_update(new_data)
         try:
             with self.lock:
                 updated_keys = []
-                db_data = self._load_file()
-                keys = db_data["keys"][section]
-
-                if isinstance(keys, list):
-                    if not all(i in keys for i in new_data):
-                        raise UnknownKeyError(
-                            f"Unrecognized / missing key(s) {[i for i in new_data if i not in keys]}"
-                        )
+                db_data = self._load_file(section)
+                schema = self._schema(section, db_data)
+                unknown = schema.unknown(written)
+                if unknown:
+                    raise UnknownKeyError(f"Unrecognized / missing key(s) {unknown}")
 
                 if not isinstance(db_data[section], dict):
                     raise SchemaTypeError("The data key in the DB must be of type dict")
 
-                for key, value in db_data[section].items():
-                    if _query(value):
-                        db_data[section][key] = {**db_data[section][key], **new_data}
-                        updated_keys.append(key)
+                with self._phase("scan"):
+                    for key, value in db_data[section].items():
+                        if _query(value):
+                            updated_keys.append(key)
+                records = db_data[section]
+                old = {key: records[key] for key in updated_keys}
+                with self._phase("update"):
+                    updated = {key: update(records[key]) for key in updated_keys}
+                    if schema.types:
+                        for record in updated.values():
+                            schema.check_types(record)
+                records.update(updated)
+                self._count(len(records), len(updated_keys))
 
                 self._dump_file(db_data)
+                for key in updated_keys:
+                    self._emit("update", section, id=key, data=records[key], old=old[key])
                 return updated_keys
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must existing in database ")
@@ -299,36 +1455,35 @@ class PysonDB:
     def delete_by_id(self, section: str, id: str) -> Dict:  # None:
         try:
             with self.lock:
-                data = self._load_file()
+                data = self._load_file(section)
                 if not isinstance(data[section], dict):
                     raise SchemaTypeError('"data" key in the DB must be of type dict')
                 if id not in data[section]:
                     raise IdDoesNotExistError(f"ID {id} does not exists in the DB")
-                del data[section][id]
+                old = data[section].pop(id)
                 self._dump_file(data)
+                self._emit("delete", section, id=id, old=old)
                 return {}
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must existing in database ")
 
     def delete_by_query(self, section: str, query: QueryType) -> List[str]:
-        try:
-            _query = eval(query)
-        except Exception:
-            raise MalformedQueryError(f"Query {query} is malformed.")
-        if not callable(_query):
-            raise TypeError(f'"query" must be a callable and not {type(query)!r}')
+        _query = self._compile_query(query)
         try:
             with self.lock:
-                data = self._load_file()
+                data = self._load_file(section)
                 if not isinstance(data[section], dict):
                     raise SchemaTypeError('"data" key in the DB must be of type dict')
                 ids_to_delete = []
-                for id, value in data[section].items():
-                    if _query(value):
-                        ids_to_delete.append(id)
-                for id in ids_to_delete:
-                    del data[section][id]
+                with self._phase("scan"):
+                    for id, value in data[section].items():
+                        if _query(value):
+                            ids_to_delete.append(id)
+                self._count(len(data[section]), len(ids_to_delete))
+                old = [data[section].pop(id) for id in ids_to_delete]
                 self._dump_file(data)
+                for id, record in zip(ids_to_delete, old):
+                    self._emit("delete", section, id=id, old=record)
                 return ids_to_delete
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must existing in database ")
@@ -337,13 +1492,15 @@ class PysonDB:
         try:
             with self.lock:
                 data = self._load_file()
-                if not isinstance(data[section], dict):
+                # a spilled section is dropped without reading it back
+                if not isinstance(data[section], (dict, SpilledSection)):
                     raise SchemaTypeError('"data" key in the DB must be of type dict')
                 if not isinstance(data["keys"][section], list):
                     raise SchemaTypeError('"key" key in the DB must be of type dict')
                 data[section] = {}
                 data["keys"][section] = []
                 self._dump_file(data)
+                self._emit("purge", section)
                 return {}
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must existing in database ")
@@ -361,15 +1518,19 @@ class PysonDB:
                 )
         try:
             with self.lock:
-                data = self._load_file()
+                data = self._load_file(section)
                 if isinstance(data["keys"][section], list):
-                    data["keys"][section].append(key)
-                    data["keys"][section].sort()
+                    # a new list, so the cached schema of the section is rebuilt
+                    keys = list(data["keys"][section])
+                    insort(keys, key)
+                    data["keys"][section] = keys
 
                 if isinstance(data[section], dict):
-                    for d in data[section].values():
-                        d[key] = default
+                    records = data[section]
+                    for id, d in records.items():
+                        records[id] = {**d, key: default}
                 self._dump_file(data)
+                self._emit("add_new_key", section, key=key, default=default)
                 return {}
         except KeyError:
             raise SectionNotFoundError(f"section: {section} must exist in database ")
@@ -384,4 +1545,5 @@ class PysonDB:
             data["keys"][section] = []
             data[section] = {}
             self._dump_file(data)
+            self._emit("add_section", section)
             return section
@@ -78,3 +78,108 @@ class InvalidUserError(Exception):
 
     def __str__(self) -> str:
         return str(self.message)
+
+
+class PermissionDeniedError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class RateLimitExceededError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class TooManyConnectionsError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class ServerBusyError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class WatchResumeError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class ReadOnlyReplicaError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class WorkerRedirectError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class MalformedUpdateError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class TransactionError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class TransactionConflictError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class IndexNotFoundError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class ServerError(Exception):
+    # raised by pysondb.client for a server error it has no class for
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+class BackupError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
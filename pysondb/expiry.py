@@ -0,0 +1,109 @@
+import heapq
+import os
+import time
+from threading import Event
+from threading import Thread
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+# A section with a TTL keeps the expiry of each record in one of its fields,
+# as an epoch timestamp in seconds. Records whose field is empty (or not a
+# number) never expire.
+
+TtlType = Tuple[str, Optional[float]]  # (field, default seconds)
+
+
+def is_timestamp(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_expired(value: Any, now: float) -> bool:
+    return is_timestamp(value) and value <= now
+
+
+class ExpiryIndex:
+    """
+    Min-heap of (expires_at, section, id) over the records of the TTL
+    sections, kept up to date from the database's mutation events. Entries
+    are never removed in place: an entry whose record was deleted or got a
+    new expiry is stale, and is dropped when the sweeper pops it.
+    """
+
+    def __init__(self, ttl: Dict[str, TtlType]) -> None:
+        self._ttl = ttl
+        self._heap: List[Tuple[float, str, str]] = []
+
+    def rebuild(self, data: Dict) -> None:
+        heap = []
+        for section, (field, _) in self._ttl.items():
+            records = data.get(section)
+            if not isinstance(records, dict):
+                continue
+            for id, record in records.items():
+                value = record.get(field) if isinstance(record, dict) else None
+                if is_timestamp(value):
+                    heap.append((value, section, id))
+        heapq.heapify(heap)
+        self._heap = heap
+
+    def observe(self, event: Dict) -> None:
+        # PysonDB listener, runs under the database lock
+        ttl = self._ttl.get(event["section"])
+        if ttl is None or event["op"] not in ("insert", "update"):
+            return
+        value = event["data"].get(ttl[0])
+        old = event.get("old")
+        if old is not None and old.get(ttl[0]) == value:
+            return
+        if is_timestamp(value):
+            heapq.heappush(self._heap, (value, event["section"], event["id"]))
+
+    def next_due(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def due(self, now: float, limit: int) -> List[Tuple[float, str, str]]:
+        entries = []
+        while self._heap and self._heap[0][0] <= now and len(entries) < limit:
+            entries.append(heapq.heappop(self._heap))
+        return entries
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+class Sweeper(Thread):
+    """
+    Background thread deleting expired records in batches of `batch`, one
+    dump per batch, releasing the database lock between batches.
+    """
+
+    def __init__(self, db, interval: float = 1.0, batch: int = 500) -> None:
+        super().__init__(name=f"ttl-sweeper-{os.path.basename(db.filename)}", daemon=True)
+        self._db = db
+        self.interval = interval
+        self.batch = batch
+        self.expired = 0
+        self._stop_event = Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                while not self._stop_event.is_set():
+                    count = self._db.expire(self.batch)
+                    if count:
+                        self.expired += count
+                        self._db.commit()
+                    due = self._db.next_expiry()
+                    if due is None or due > time.time():
+                        break
+            except Exception as e:
+                print(f"ttl sweep of {self._db.filename} failed: {e}")
+
+    def close(self) -> None:
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,108 @@
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from pysondb.errors import MalformedQueryError
+
+
+# Structured filters are plain JSON, so unlike the lambda queries they need no
+# eval and can be inspected (e.g. to pick an index). A filter maps dotted
+# paths to a value (equality) or to an operator document:
+#   {"states.on": true, "age": {"$gte": 18, "$lt": 65}, "$or": [{...}, {...}]}
+
+MISSING = object()
+
+
+def get_path(record: Any, path: str) -> Any:
+    value = record
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def _compare(op: str, a: Any, b: Any) -> bool:
+    if a is MISSING or a is None:
+        return False
+    try:
+        if op == "$gt":
+            return a > b
+        if op == "$gte":
+            return a >= b
+        if op == "$lt":
+            return a < b
+        return a <= b
+    except TypeError:
+        return False
+
+
+def _contains(value: Any, needle: Any) -> bool:
+    if isinstance(value, str) and isinstance(needle, str):
+        return needle.lower() in value.lower()
+    if isinstance(value, list):
+        return needle in value
+    return False
+
+
+OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "$eq": lambda a, b: a is not MISSING and a == b,
+    "$ne": lambda a, b: a is MISSING or a != b,
+    "$gt": lambda a, b: _compare("$gt", a, b),
+    "$gte": lambda a, b: _compare("$gte", a, b),
+    "$lt": lambda a, b: _compare("$lt", a, b),
+    "$lte": lambda a, b: _compare("$lte", a, b),
+    "$in": lambda a, b: a is not MISSING and a in b,
+    "$nin": lambda a, b: a is MISSING or a not in b,
+    "$exists": lambda a, b: (a is not MISSING) == bool(b),
+    "$contains": _contains,
+}
+
+
+def _compile_field(path: str, cond: Any) -> Callable[[Dict], bool]:
+    if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+        checks = []
+        for op, arg in cond.items():
+            if op not in OPERATORS:
+                raise MalformedQueryError(f"unknown operator {op!r} for {path!r}")
+            if op in ("$in", "$nin") and not isinstance(arg, list):
+                raise MalformedQueryError(f"{op} for {path!r} expects a list")
+            checks.append((OPERATORS[op], arg))
+        return lambda r: all(fn(get_path(r, path), arg) for fn, arg in checks)
+    return lambda r: get_path(r, path) == cond
+
+
+def compile_filter(spec: Any) -> Callable[[Dict], bool]:
+    """
+    Turns a structured filter into a predicate over a single record.
+    """
+    if spec is None or spec == {}:
+        return lambda r: True
+    if not isinstance(spec, dict):
+        raise MalformedQueryError(f"a filter must be of type dict and not {type(spec)}")
+    checks: List[Callable[[Dict], bool]] = []
+    for key, cond in spec.items():
+        if key in ("$and", "$or"):
+            if not isinstance(cond, list):
+                raise MalformedQueryError(f"{key} expects a list of filters")
+            subs = [compile_filter(c) for c in cond]
+            if key == "$and":
+                checks.append(lambda r, subs=subs: all(f(r) for f in subs))
+            else:
+                checks.append(lambda r, subs=subs: any(f(r) for f in subs))
+        elif key == "$not":
+            sub = compile_filter(cond)
+            checks.append(lambda r, sub=sub: not sub(r))
+        elif key.startswith("$"):
+            raise MalformedQueryError(f"unknown operator {key!r}")
+        else:
+            checks.append(_compile_field(key, cond))
+    if len(checks) == 1:
+        return checks[0]
+    return lambda r: all(f(r) for f in checks)
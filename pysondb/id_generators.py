@@ -0,0 +1,144 @@
+import time
+import uuid
+from threading import Lock
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from pysondb.errors import MalformedIdGeneratorError
+
+
+# ids are fixed width decimal strings so lexical order matches numeric order
+ID_WIDTH = 19
+
+
+def _own_ids(ids: Iterable[str]) -> Iterator[int]:
+    # only ids of the ordered generators count when seeding: the legacy
+    # uuid ids are 18 digits and random, seeding from them would start a
+    # counter near 10**18 and a snowflake clock years ahead
+    for _id in ids:
+        if len(_id) == ID_WIDTH and _id.isdigit():
+            yield int(_id)
+
+
+class UuidIdGenerator:
+    """
+    The original generator: a random 18 digit id, unordered.
+    """
+
+    def __call__(self) -> str:
+        return str(int(uuid.uuid4()))[:18]
+
+    def reserve(self, n: int) -> List[str]:
+        return [self() for _ in range(n)]
+
+
+class TimeOrderedIdGenerator:
+    """
+    Snowflake style ids: 41 bits of milliseconds since EPOCH_MS, 10 bits of
+    node id and a 12 bit per millisecond sequence. Ids from one node are
+    strictly increasing, even if the wall clock steps backwards.
+    """
+
+    EPOCH_MS = 1577836800000  # 2020-01-01T00:00:00Z
+    NODE_BITS = 10
+    SEQUENCE_BITS = 12
+
+    def __init__(self, node: int = 0) -> None:
+        if not 0 <= node < (1 << self.NODE_BITS):
+            raise MalformedIdGeneratorError(
+                f"node must be between 0 and {(1 << self.NODE_BITS) - 1} and not {node}"
+            )
+        self.node = node
+        self._lock = Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def _now_ms(self) -> int:
+        return int(time.time() * 1000) - self.EPOCH_MS
+
+    def seed(self, ids: Iterable[str]) -> None:
+        highest = max(_own_ids(ids), default=-1)
+        if highest < 0:
+            return
+        with self._lock:
+            self._last_ms = max(self._last_ms, highest >> (self.NODE_BITS + self.SEQUENCE_BITS))
+            self._sequence = (1 << self.SEQUENCE_BITS) - 1
+
+    def _next(self) -> int:
+        now = max(self._now_ms(), self._last_ms)
+        if now == self._last_ms:
+            self._sequence += 1
+            if self._sequence >= (1 << self.SEQUENCE_BITS):
+                # sequence exhausted for this millisecond, borrow the next one
+                now += 1
+                self._sequence = 0
+        else:
+            self._sequence = 0
+        self._last_ms = now
+        return (
+            (now << (self.NODE_BITS + self.SEQUENCE_BITS))
+            | (self.node << self.SEQUENCE_BITS)
+            | self._sequence
+        )
+
+    def __call__(self) -> str:
+        with self._lock:
+            return str(self._next()).zfill(ID_WIDTH)
+
+    def reserve(self, n: int) -> List[str]:
+        with self._lock:
+            return [str(self._next()).zfill(ID_WIDTH) for _ in range(n)]
+
+
+class CounterIdGenerator:
+    """
+    A monotonic counter. ``reserve`` hands out a whole block of ids under a
+    single lock acquisition, which is what ``add_many`` uses.
+    """
+
+    def __init__(self, start: int = 1) -> None:
+        self._next = start
+        self._lock = Lock()
+
+    def seed(self, ids: Iterable[str]) -> None:
+        highest = max(_own_ids(ids), default=-1)
+        with self._lock:
+            self._next = max(self._next, highest + 1)
+
+    def __call__(self) -> str:
+        with self._lock:
+            _id = self._next
+            self._next += 1
+        return str(_id).zfill(ID_WIDTH)
+
+    def reserve(self, n: int) -> List[str]:
+        with self._lock:
+            start = self._next
+            self._next += n
+        return [str(i).zfill(ID_WIDTH) for i in range(start, start + n)]
+
+
+ID_GENERATORS = {
+    "uuid": UuidIdGenerator,
+    "snowflake": TimeOrderedIdGenerator,
+    "counter": CounterIdGenerator,
+}
+
+
+def make_id_generator(conf: Optional[Dict]):
+    """
+    Builds a generator from a config entry such as {"type": "snowflake", "node": 3}.
+    """
+    options = dict(conf or {})
+    name = options.pop("type", "uuid")
+    if name not in ID_GENERATORS:
+        raise MalformedIdGeneratorError(
+            f"unknown id generator {name!r}, expected one of {sorted(ID_GENERATORS)}"
+        )
+    try:
+        return ID_GENERATORS[name](**options)
+    except TypeError as e:
+        raise MalformedIdGeneratorError(f"invalid options for id generator {name!r}: {e}")
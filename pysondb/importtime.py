@@ -0,0 +1,80 @@
+"""
+Import time benchmark, based on `python -X importtime`.
+
+    python -m pysondb.importtime                       # server, engine and CLI
+    python -m pysondb.importtime pysondb.cli -n 20 --top 15
+
+Every module is imported in a fresh interpreter `-n` times; the median
+cumulative time and the modules with the largest self time are reported.
+The package is byte-compiled first, so source compilation is not measured
+even with PYTHONDONTWRITEBYTECODE set.
+"""
+import argparse
+import compileall
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+
+DEFAULT_MODULES = ["pysondb.pysondb_server", "pysondb.db", "pysondb.cli"]
+
+
+def parse_importtime(stderr: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Maps every imported module to its (self, cumulative) time in microseconds.
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def measure(module: str, runs: int) -> List[Dict[str, Tuple[int, int]]]:
+    results = []
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"importing {module} failed:\n{proc.stderr}")
+        results.append(parse_importtime(proc.stderr))
+    return results
+
+
+def report(module: str, results: List[Dict[str, Tuple[int, int]]], top: int) -> str:
+    total = statistics.median(r.get(module, (0, 0))[1] for r in results)
+    names = set().union(*results)
+    self_times = {
+        name: statistics.median(r.get(name, (0, 0))[0] for r in results) for name in names
+    }
+    lines = [f"{module}: {total / 1000:.1f} ms cumulative, {len(names)} modules"]
+    for name, us in sorted(self_times.items(), key=lambda kv: kv[1], reverse=True)[:top]:
+        lines.append(f"    {us / 1000:8.2f} ms  {name}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="measure the import time of pysondb modules")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("-n", "--runs", type=int, default=10, help="fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=10, help="modules with the largest self time to show")
+    args = parser.parse_args(argv)
+    compileall.compile_dir(os.path.dirname(os.path.abspath(__file__)), quiet=1)
+    for module in args.modules:
+        print(report(module, measure(module, args.runs), args.top))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
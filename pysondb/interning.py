@@ -0,0 +1,128 @@
+from sys import getsizeof
+from typing import Any
+from typing import Dict
+from typing import Hashable
+from typing import Tuple
+
+
+# Records repeat the same strings and sub-objects (a device "type", its
+# "traits" list, default "attributes"), and json.load makes a new object for
+# every copy. The interner hash-conses them: values are rebuilt bottom up and
+# each one is looked up by its content, so equal values end up as a single
+# shared object.
+#
+# Sharing is safe because records are copy-on-write (see PysonDB): nothing
+# modifies a stored value in place, an update copies the containers along the
+# paths it changes (see pysondb.updates), so the other records keep the
+# shared original.
+
+# longer strings are rarely repeated, the table would only hold them twice
+MAX_STRING = 128
+# containers with more items are rarely repeated verbatim either, and the
+# key of a container costs about as much as the container
+MAX_ITEMS = 32
+
+_SCALARS = frozenset((int, float))
+
+
+def _token(value: Any) -> Hashable:
+    # the part of a container's key standing for one of its interned values:
+    # the identity of containers (equal ones are the same object by now),
+    # the type and value of the rest, so that 1, 1.0 and True stay apart
+    if type(value) in (dict, list):
+        return id(value)
+    return (type(value), value)
+
+
+class Interner:
+    """
+    Hash-consing table of strings, numbers and small containers. The table
+    holds the shared values, it is cleared once it has `max_entries` of them
+    (values shared so far stay shared).
+    """
+
+    def __init__(self, max_entries: int = 1 << 18) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_bytes = 0
+        self.clears = 0
+        self._table: Dict[Hashable, Any] = {}
+
+    def _lookup(self, key: Hashable, value: Any) -> Any:
+        shared = self._table.get(key)
+        if shared is not None:
+            if shared is not value:
+                self.hits += 1
+                self.saved_bytes += getsizeof(value)
+            return shared
+        self.misses += 1
+        if len(self._table) >= self.max_entries:
+            self._table.clear()
+            self.clears += 1
+        self._table[key] = value
+        return value
+
+    def intern(self, value: Any) -> Any:
+        t = type(value)
+        if t is str:
+            return self._lookup(value, value) if len(value) <= MAX_STRING else value
+        if t in _SCALARS:
+            return self._lookup((t, value), value)
+        if t is dict:
+            items = [(self.intern(k), self.intern(v)) for k, v in value.items()]
+            if any(v is not value[k] for k, v in items):
+                # never modify the given value, it may still be the caller's
+                value = dict(items)
+            if len(items) > MAX_ITEMS:
+                return value
+            return self._lookup((dict, tuple((k, _token(v)) for k, v in items)), value)
+        if t is list:
+            items = [self.intern(v) for v in value]
+            if any(a is not b for a, b in zip(items, value)):
+                value = items
+            if len(items) > MAX_ITEMS:
+                return value
+            return self._lookup((list, tuple(map(_token, items))), value)
+        return value
+
+    def record(self, record: Any) -> Any:
+        """
+        Interns the values of a record, not the record itself: two equal
+        records stay two objects, the JSON cache and the indexes tell
+        records apart by identity.
+        """
+        if type(record) is not dict:
+            return record
+        items = [(self.intern(k), self.intern(v)) for k, v in record.items()]
+        if any(v is not record[k] for k, v in items):
+            record = dict(items)
+        return record
+
+    def records(self, records: Dict[str, Any]) -> Dict[str, Any]:
+        for id, record in records.items():
+            # the same keys, so the dict is not resized while iterating
+            records[id] = self.record(record)
+        return records
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._table),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "saved_bytes": self.saved_bytes,
+            "clears": self.clears,
+        }
+
+
+def intern_data(interner: Interner, data: Dict) -> Tuple[int, int]:
+    """
+    Interns every record of a database in place, returns the (hits, saved
+    bytes) of the pass.
+    """
+    hits, saved = interner.hits, interner.saved_bytes
+    for section in data.get("keys", {}):
+        if isinstance(data.get(section), dict):
+            interner.records(data[section])
+    return interner.hits - hits, interner.saved_bytes - saved
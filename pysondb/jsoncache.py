@@ -0,0 +1,174 @@
+from threading import Lock
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+try:
+    import ujson as json
+except ImportError:
+    import json as json
+
+
+# Records are copy-on-write (see PysonDB): a mutation stores a new dict, so
+# a record object that is still the one the cache encoded is unchanged, and
+# its cached bytes are valid. The mutation events only free the entries of
+# records that are gone.
+
+# (record, b'"id": {...}', length of the b'"id": ' prefix)
+EntryType = Tuple[Dict, bytes, int]
+
+
+class RawJSON:
+    """
+    Already encoded JSON, spliced as is into a server response (see
+    ClientTCPHandler._encode_response).
+    """
+
+    __slots__ = ("parts",)
+
+    def __init__(self, parts: List[bytes]) -> None:
+        self.parts = parts
+
+    def __bytes__(self) -> bytes:
+        return b"".join(self.parts)
+
+
+class JsonCache:
+    """
+    The encoded JSON of the records of a database, by section and id.
+    Responses made of whole records are assembled from the cached bytes
+    instead of encoding every record again. Once the cache holds more than
+    `max_bytes`, it is cleared (like the AUTH cache of Config).
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.clears = 0
+        self._sections: Dict[str, Dict[str, EntryType]] = {}
+        self._bytes = 0
+        # a lookup is a dict get, only storing needs the lock
+        self._lock = Lock()
+
+    def _entry(self, entries: Dict[str, EntryType], id: str, record: Any) -> EntryType:
+        entry = entries.get(id)
+        if entry is not None and entry[0] is record:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        key = json.dumps(id).encode() + b": "
+        entry = (record, key + json.dumps(record).encode(), len(key))
+        with self._lock:
+            old = entries.get(id)
+            self._bytes += len(entry[1]) - (len(old[1]) if old is not None else 0)
+            entries[id] = entry
+            if self._bytes > self.max_bytes:
+                self._clear()
+        return entry
+
+    def _entries(self, section: str) -> Dict[str, EntryType]:
+        entries = self._sections.get(section)
+        if entries is None:
+            with self._lock:
+                entries = self._sections.setdefault(section, {})
+        return entries
+
+    def record(self, section: str, id: str, record: Dict) -> RawJSON:
+        _, pair, start = self._entry(self._entries(section), id, record)
+        return RawJSON([pair[start:]])
+
+    def records(self, section: str, records: Dict[str, Dict]) -> RawJSON:
+        """
+        {id: record, ...} of section as JSON, in the order of records.
+        """
+        entries = self._entries(section)
+        pairs = [self._entry(entries, id, record)[1] for id, record in records.items()]
+        return RawJSON([b"{", b", ".join(pairs), b"}"])
+
+    def rows(self, section: str, other: str, rows: List[List[Any]], cached: Tuple[bool, bool]) -> RawJSON:
+        """
+        LOOKUP rows, [id, record, other id, other record], as JSON. The records
+        of the sides flagged in cached are whole ones, taken from the cache.
+        """
+        sides = [self._entries(section) if cached[0] else None, self._entries(other) if cached[1] else None]
+        parts: List[bytes] = []
+        for row in rows:
+            parts.append(b", [" if parts else b"[[")
+            for i, (id, record) in enumerate(((row[0], row[1]), (row[2], row[3]))):
+                entries = sides[i]
+                if entries is not None and isinstance(record, dict):
+                    _, pair, start = self._entry(entries, id, record)
+                    parts.extend((pair[: start - 2], b", ", pair[start:]))
+                else:
+                    parts.append(json.dumps(id).encode() + b", " + json.dumps(record).encode())
+                parts.append(b", " if i == 0 else b"]")
+        parts.append(b"]" if parts else b"[]")
+        return RawJSON(parts)
+
+    def sections(self, data: Dict[str, Any]) -> RawJSON:
+        # GET_ALL: {section: {id: record}}, anything else is encoded as usual
+        parts: List[bytes] = []
+        for section, records in data.items():
+            parts.append(b", " if parts else b"{")
+            parts.append(json.dumps(section).encode() + b": ")
+            if isinstance(records, dict) and all(isinstance(r, dict) for r in records.values()):
+                parts.extend(self.records(section, records).parts)
+            else:
+                parts.append(json.dumps(records).encode())
+        parts.append(b"}" if parts else b"{}")
+        return RawJSON(parts)
+
+    def _forget(self, section: str, ids: Iterable[str]) -> None:
+        entries = self._sections.get(section)
+        if not entries:
+            return
+        with self._lock:
+            for id in ids:
+                entry = entries.pop(id, None)
+                if entry is not None:
+                    self._bytes -= len(entry[1])
+
+    # entries are cleared in place, a response being assembled from them may
+    # still add to them
+
+    def drop(self, section: str) -> None:
+        with self._lock:
+            entries = self._sections.get(section)
+            if entries:
+                self._bytes -= sum(len(entry[1]) for entry in entries.values())
+                entries.clear()
+
+    def _clear(self) -> None:
+        for entries in self._sections.values():
+            entries.clear()
+        self._bytes = 0
+        self.clears += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def observe(self, event: Dict) -> None:
+        # PysonDB listener, runs under the database lock
+        op = event["op"]
+        if op in ("update", "delete"):
+            self._forget(event["section"], (event["id"],))
+        elif op in ("purge", "add_section", "add_new_key"):
+            self.drop(event["section"])
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def stats(self) -> Dict:
+        return {
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "records": sum(len(entries) for entries in list(self._sections.values())),
+            "hits": self.hits,
+            "misses": self.misses,
+            "clears": self.clears,
+        }
@@ -0,0 +1,113 @@
+import os
+from itertools import islice
+from sys import getsizeof
+from time import perf_counter
+from typing import Any
+from typing import Dict
+from typing import Tuple
+
+try:
+    import ujson as json
+except ImportError:
+    import json as json
+
+from pysondb.db_types import DBSchemaType
+
+
+# Parsing a database file is CPU bound, the server runs parse_database in a
+# process pool at startup (see SocketServer.prewarm) and installs the parsed
+# data with PysonDB.force_load. It runs in the child process, so it only
+# takes the file name and returns plain (picklable) data.
+
+LoadInfoType = Dict[str, Any]
+
+# records measured per section by section_size
+SIZE_SAMPLE = 1000
+
+_CONTAINERS = frozenset((dict, list))
+
+
+def approx_size(obj: Any) -> int:
+    """
+    Bytes held by obj and everything it references, every object counted once.
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+    return size
+
+
+def record_size(id: str, record: Any) -> int:
+    """
+    Bytes added to a section by one record. Field names are not counted,
+    the parser shares them between the records.
+    """
+    if type(record) is dict and _CONTAINERS.isdisjoint(map(type, record.values())):
+        # flat record, the common case, without a Python level loop
+        return getsizeof(id) + getsizeof(record) + sum(map(getsizeof, record.values()))
+    size = getsizeof(id)
+    stack = [record]
+    while stack:
+        o = stack.pop()
+        size += getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.values())
+        elif isinstance(o, list):
+            stack.extend(o)
+    return size
+
+
+def section_size(records: Dict, sample: int = SIZE_SAMPLE) -> int:
+    """
+    Bytes held by the records of a section, extrapolated from the first
+    `sample` of them: walking every record costs more than parsing them.
+    PysonDB keeps it up to date with record_size on every mutation.
+    """
+    size = getsizeof(records)
+    if records:
+        head = list(islice(records.items(), sample))
+        size += sum(record_size(id, r) for id, r in head) * len(records) // len(head)
+    return size
+
+
+def estimate_size(data: DBSchemaType, sample: int = SIZE_SAMPLE) -> int:
+    size = getsizeof(data)
+    for section, records in data.items():
+        if section != "keys" and isinstance(records, dict):
+            size += section_size(records, sample)
+        else:
+            size += approx_size(records)
+    return size
+
+
+def count_records(data: DBSchemaType) -> int:
+    return sum(
+        len(data[section]) for section in data["keys"] if isinstance(data.get(section), dict)
+    )
+
+
+def parse_database(filename: str) -> Tuple[DBSchemaType, LoadInfoType]:
+    """
+    Reads a database file, returns its data and how long / how much memory it took.
+    """
+    start = perf_counter()
+    with open(filename, encoding="utf-8", mode="r") as f:
+        data = json.load(f)
+    parse_seconds = perf_counter() - start
+    return data, {
+        "file_bytes": os.path.getsize(filename),
+        "parse_seconds": round(parse_seconds, 4),
+        "memory_bytes": estimate_size(data),
+        "records": count_records(data),
+    }
@@ -0,0 +1,181 @@
+import heapq
+from bisect import bisect_left
+from bisect import insort
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+try:
+    import ujson as json
+except ImportError:
+    import json as json
+
+from pysondb.errors import MalformedQueryError
+from pysondb.filters import MISSING
+from pysondb.filters import get_path
+
+
+# order_by is a dotted path or a list of them, "-" in front sorts descending:
+#   "age", ["-meta.created", "name"]
+# Values of different types never compare, so every value sorts within its
+# group: missing / null first, then numbers (and booleans), strings, and
+# lists / dicts last (by their JSON text).
+
+SortKeyType = Tuple[int, Any]
+OrderType = Tuple[List[Tuple[str, bool]], Callable[[Dict], Tuple], bool]
+
+# the key of missing / null values, which never join (see PysonDB.lookup)
+NULL_KEY: SortKeyType = (0, 0)
+
+
+def sort_key(value: Any) -> SortKeyType:
+    if value is MISSING or value is None:
+        return NULL_KEY
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, json.dumps(value, sort_keys=True))
+
+
+class _Descending:
+    # wraps the descending keys of a mixed asc / desc order_by
+    __slots__ = ("key",)
+
+    def __init__(self, key: SortKeyType) -> None:
+        self.key = key
+
+    def __lt__(self, other: "_Descending") -> bool:
+        return other.key < self.key
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Descending) and self.key == other.key
+
+
+def compile_order(order_by: Any) -> Optional[OrderType]:
+    """
+    Returns ([(path, descending)], key function over a record, reverse), or None
+    without order_by.
+    """
+    if order_by is None or order_by == []:
+        return None
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    if not isinstance(order_by, list) or not all(isinstance(i, str) and i.strip("-") for i in order_by):
+        raise MalformedQueryError(f"order_by must be a path or a list of paths and not {order_by!r}")
+    keys = [(i[1:], True) if i.startswith("-") else (i, False) for i in order_by]
+    paths = [path for path, _ in keys]
+    directions = {desc for _, desc in keys}
+    if len(directions) == 1:
+        # one direction for all the keys: plain tuples, reversed as a whole
+        def key(record: Dict) -> Tuple:
+            return tuple(sort_key(get_path(record, path)) for path in paths)
+
+        return keys, key, directions.pop()
+
+    def mixed_key(record: Dict) -> Tuple:
+        return tuple(
+            _Descending(sort_key(get_path(record, path))) if desc else sort_key(get_path(record, path))
+            for path, desc in keys
+        )
+
+    return keys, mixed_key, False
+
+
+def check_limit(limit: Any) -> Optional[int]:
+    if limit is None:
+        return None
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+        raise MalformedQueryError(f"limit must be a non negative int and not {limit!r}")
+    return limit
+
+
+def top_k(
+    items: Iterable[Tuple[str, Dict]], order: OrderType, limit: Optional[int]
+) -> List[Tuple[str, Dict]]:
+    """
+    Sorts (id, record) pairs, keeping only the first `limit` ones with a heap
+    of that size: O(n log limit) instead of sorting every match. Equal values
+    are ordered by id, in the direction of the order like SortedIndex.walk,
+    so that an index never changes the result.
+    """
+    _, key, reverse = order
+
+    def item_key(item: Tuple[str, Dict]) -> Tuple:
+        return key(item[1]), item[0]
+
+    if limit is None:
+        return sorted(items, key=item_key, reverse=reverse)
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(limit, items, key=item_key)
+
+
+class SortedIndex:
+    """
+    The ids of a section ordered by the value at one path, kept up to date from
+    the database's mutation events like ExpiryIndex. Reads ordered by that path
+    walk it and stop after `limit` matches instead of ranking every record.
+    """
+
+    def __init__(self, section: str, path: str) -> None:
+        self.section = section
+        self.path = path
+        self._entries: List[Tuple[SortKeyType, str]] = []
+
+    def rebuild(self, records: Any) -> None:
+        if not isinstance(records, dict):
+            self._entries = []
+            return
+        self._entries = sorted(
+            (sort_key(get_path(r, self.path)), id) for id, r in records.items()
+        )
+
+    def _remove(self, entry: Tuple[SortKeyType, str]) -> None:
+        i = bisect_left(self._entries, entry)
+        if i < len(self._entries) and self._entries[i] == entry:
+            del self._entries[i]
+
+    def observe(self, event: Dict) -> None:
+        # PysonDB listener, runs under the database lock
+        if event["section"] != self.section:
+            return
+        op = event["op"]
+        if op in ("insert", "update"):
+            new = (sort_key(get_path(event["data"], self.path)), event["id"])
+            if op == "update":
+                old = (sort_key(get_path(event["old"], self.path)), event["id"])
+                if old == new:
+                    return
+                self._remove(old)
+            insort(self._entries, new)
+        elif op == "delete":
+            self._remove((sort_key(get_path(event["old"], self.path)), event["id"]))
+        elif op in ("purge", "add_section"):
+            self._entries = []
+        elif op == "add_new_key":
+            # every record now holds the default under the new key
+            root = self.path.split(".", 1)[0]
+            if root == event["key"]:
+                value = get_path({root: event["default"]}, self.path)
+                key = sort_key(value)
+                self._entries = sorted((key, id) for _, id in self._entries)
+
+    def walk(self, descending: bool = False) -> Iterator[str]:
+        entries = reversed(self._entries) if descending else iter(self._entries)
+        for _, id in entries:
+            yield id
+
+    def equal(self, key: SortKeyType) -> Iterator[str]:
+        # the ids whose value has sort_key key, a bisect away
+        i = bisect_left(self._entries, (key,))
+        while i < len(self._entries) and self._entries[i][0] == key:
+            yield self._entries[i][1]
+            i += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
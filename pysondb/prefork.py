@@ -0,0 +1,312 @@
+import builtins
+import os
+import signal
+import socket
+import socketserver
+import tempfile
+import zlib
+from threading import Thread
+from threading import local
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+try:
+    import ujson as json
+except ImportError:
+    import json as json
+
+import pysondb.errors
+from pysondb.errors import DatabaseNotFoundError
+
+
+# PysonDB methods a worker may call on a database owned by another worker.
+# Arguments and results are plain JSON, so they travel over the IPC socket.
+FORWARDED_METHODS = {
+    "add",
+    "add_many",
+    "add_new_key",
+    "add_section",
+    "aggregate",
+    "commit",
+    "commit_transaction",
+    "delete_by_id",
+    "delete_by_query",
+    "find",
+    "get_all",
+    "get_all_by_section",
+    "get_by_id",
+    "get_by_query",
+    "lookup",
+    "purge",
+    "purge_all",
+    "search",
+    "sections",
+    "snapshot",
+    "snapshot_with_seq",
+    "update_by_id",
+    "update_by_query",
+    "use_id_generator",
+}
+
+# attributes read from the owner's database, see RemoteDB.seq
+FORWARDED_ATTRIBUTES = {"seq", "run_id"}
+
+# commands holding per connection state in the owner (event streams) cannot
+# be forwarded call by call, the client is redirected to the owner instead
+OWNER_ONLY_COMMANDS = {"WATCH", "REPLICATE"}
+
+
+def owner_of(db_conf: Dict, workers: int) -> int:
+    """
+    The worker owning a database: "worker" from its config entry, otherwise a
+    stable hash of its name.
+    """
+    if "worker" in db_conf:
+        return int(db_conf["worker"]) % workers
+    return zlib.crc32(db_conf["name"].encode()) % workers
+
+
+def ipc_path(conf: Dict, worker_id: int) -> str:
+    prefork = conf.get("prefork", {})
+    directory = prefork.get("ipc_dir") or tempfile.gettempdir()
+    return os.path.join(directory, f"pysondb-{conf['port']}-worker-{worker_id}.sock")
+
+
+def _write_msg(sock: socket.socket, msg: Dict) -> None:
+    data = bytes(json.dumps(msg), "utf-8")
+    sock.sendall(len(data).to_bytes(8, "big") + data)
+
+
+def _read_msg(rfile) -> Optional[Dict]:
+    header = rfile.read(8)
+    if len(header) < 8:
+        return None
+    return json.loads(rfile.read(int.from_bytes(header, "big")))
+
+
+def _rebuild_error(name: str, message: str) -> Exception:
+    # re-raise under the owner's exception class so error replies are unchanged
+    cls = getattr(pysondb.errors, name, None) or getattr(builtins, name, None)
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        e = cls.__new__(cls)
+        Exception.__init__(e, message)
+        e.message = message
+        return e
+    e = Exception(message)
+    e.message = message
+    return e
+
+
+class _OwnerHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        while True:
+            msg = _read_msg(self.rfile)
+            if msg is None:
+                return
+            reply: Dict[str, Any] = {}
+            try:
+                if msg["method"] not in FORWARDED_METHODS and msg["method"] not in FORWARDED_ATTRIBUTES:
+                    raise AttributeError(f"{msg['method']} cannot be forwarded")
+                db = self.server.main.get_db(msg["db"])
+                if msg["method"] in FORWARDED_ATTRIBUTES:
+                    reply["result"] = getattr(db, msg["method"])
+                else:
+                    db.reset_op_stats()
+                    reply["result"] = getattr(db, msg["method"])(*msg["args"], **msg.get("kwargs", {}))
+                    reply["stats"] = db.last_op_stats()
+            except Exception as e:
+                reply = {"error": e.__class__.__name__, "message": getattr(e, "message", str(e))}
+            _write_msg(self.request, reply)
+
+
+class OwnerServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Serves the databases owned by this worker to the other workers.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, main, path: str) -> None:
+        self.main = main
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, _OwnerHandler)
+
+
+class RemoteDB:
+    """
+    Stands in for a PysonDB owned by another worker, forwarding calls over
+    one unix socket per thread so the owner stays the database's single writer.
+    """
+
+    def __init__(self, dbname: str, path: str, owner: int, redirect: Optional[str] = None) -> None:
+        self.dbname = dbname
+        self.owner = owner
+        self.redirect = redirect
+        self._path = path
+        self._local = local()
+
+    def _sock(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self._path)
+            self._local.sock = sock
+            self._local.rfile = sock.makefile("rb")
+        return sock
+
+    def _call(self, method: str, *args, **kwargs) -> Any:
+        try:
+            _write_msg(
+                self._sock(), {"db": self.dbname, "method": method, "args": list(args), "kwargs": kwargs}
+            )
+            reply = _read_msg(self._local.rfile)
+        except OSError:
+            reply = None
+        if reply is None:
+            self._local.sock = None
+            raise DatabaseNotFoundError(
+                f"database : {self.dbname} is owned by worker {self.owner} which is unavailable."
+            )
+        self._local.stats = reply.get("stats")
+        if "error" in reply:
+            raise _rebuild_error(reply["error"], reply["message"])
+        return reply["result"]
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in FORWARDED_METHODS:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+
+    @property
+    def seq(self) -> int:
+        # read from the owner like any call, e.g. for the seq of a transaction
+        # that wrote nothing
+        return self._call("seq")
+
+    @property
+    def run_id(self) -> str:
+        return self._call("run_id")
+
+    def set_id_generator(self, fn) -> None:
+        raise TypeError(
+            f"database {self.dbname} lives in worker {self.owner}, use a built in id generator"
+        )
+
+    def reset_op_stats(self) -> None:
+        self._local.stats = None
+
+    def last_op_stats(self) -> Dict:
+        return getattr(self._local, "stats", None) or {"scanned": 0, "returned": 0, "phases": {}}
+
+    def force_load(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class WorkerPortServer(socketserver.ThreadingTCPServer):
+    """
+    Private per worker listener, the target of redirects for OWNER_ONLY_COMMANDS.
+    Everything but the socket is shared with the worker's main server.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, main, address, handler) -> None:
+        self._main = main
+        super().__init__(address, handler)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._main, name)
+
+
+def _run_worker(cfile: str, worker_id: int, workers: int) -> None:
+    from pysondb.pysondb_server import SocketServer
+
+    def stop(signum, frame):
+        # a second signal (e.g. sent to the whole process group) must not
+        # interrupt the shutdown of the first one
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server = SocketServer(cfile, worker_id=worker_id, workers=workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def serve_prefork(cfile: str = "./config.json", workers: Optional[int] = None) -> int:
+    """
+    Forks `workers` server processes accepting on the same port (SO_REUSEPORT).
+    Every database is owned by exactly one of them, the others forward to it.
+    Crashed workers are restarted, SIGINT / SIGTERM stops all of them.
+    """
+    if not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork"):
+        raise OSError("pre-fork mode needs fork() and SO_REUSEPORT")
+    if workers is None:
+        with open(cfile, encoding="utf-8", mode="r") as f:
+            conf = json.load(f)
+        workers = conf.get("prefork", {}).get("workers") or os.cpu_count() or 1
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(worker_id: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(cfile, worker_id, workers)
+            except BaseException as e:
+                print(f"worker {worker_id} failed: {e}")
+                code = 1
+            os._exit(code)
+        children[pid] = worker_id
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for i in range(workers):
+        spawn(i)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id = children.pop(pid, None)
+        if worker_id is not None and not stopping:
+            print(f"worker {worker_id} exited with status {status}, restarting")
+            spawn(worker_id)
+    return 0
+
+
+def start_owner_threads(server, conf: Dict, worker_id: int, handler) -> None:
+    """
+    Starts the IPC listener (and the optional private port) of a worker.
+    """
+    owner = OwnerServer(server, ipc_path(conf, worker_id))
+    Thread(target=owner.serve_forever, name="owner-ipc", daemon=True).start()
+    server._owner_server = owner
+    base_port = conf.get("prefork", {}).get("worker_base_port")
+    if base_port:
+        private = WorkerPortServer(server, (conf["host"], base_port + worker_id), handler)
+        Thread(target=private.serve_forever, name="worker-port", daemon=True).start()
+        server._worker_port_server = private
@@ -0,0 +1,120 @@
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+try:
+    import ujson as json
+except ImportError:
+    import json as json
+
+
+MAX_PROFILE_SECONDS = 60
+
+
+class PhaseTimer:
+    """
+    Accumulates wall clock time (in ms) spent in the named phases of one request.
+    """
+
+    def __init__(self) -> None:
+        self._start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def add(self, phases: Dict[str, float]) -> None:
+        for name, ms in phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + ms
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+
+class SlowQueryLog:
+    def __init__(
+        self, enabled: bool = False, threshold_ms: float = 100, filename: Optional[str] = None
+    ) -> None:
+        self.enabled = enabled
+        self.threshold_ms = threshold_ms
+        self.filename = filename
+        self._lock = Lock()
+
+    @classmethod
+    def from_config(cls, conf: Optional[Dict]) -> "SlowQueryLog":
+        conf = conf or {}
+        return cls(
+            conf.get("enabled", False),
+            conf.get("threshold_ms", 100),
+            conf.get("filename"),
+        )
+
+    def is_slow(self, total_ms: float) -> bool:
+        return self.enabled and total_ms >= self.threshold_ms
+
+    def log(self, entry: Dict) -> None:
+        line = json.dumps(entry)
+        with self._lock:
+            if self.filename:
+                with open(self.filename, encoding="utf-8", mode="a") as f:
+                    f.write(line + "\n")
+            else:
+                print(f"slow operation: {line}")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stacks of every other thread in the process and
+    aggregates them as collapsed stacks (``root;child;leaf count``), the input
+    format expected by flame graph tools.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self._stacks: Counter = Counter()
+        self.samples = 0
+
+    def _sample(self, exclude: List[int]) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident in exclude:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self._stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, seconds: float) -> str:
+        seconds = min(max(seconds, 0), MAX_PROFILE_SECONDS)
+        exclude = [threading.get_ident()]
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            self._sample(exclude)
+            time.sleep(self.interval)
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        return "\n".join(
+            f"{stack} {count}" for stack, count in self._stacks.most_common()
+        )
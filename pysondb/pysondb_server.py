@@ -1,20 +1,56 @@
 #!/usr/bin/python           # This is server.py file
 
 
+from typing import Any
 from typing import Dict
+from typing import Optional
+from typing import Tuple
 from typing import Type
 from typing import List
+from typing import Union
 from os.path import exists
+from os import cpu_count
 from os import remove
+from pysondb.backup import BackupManager
+from pysondb.changefeed import ALL_SECTIONS
+from pysondb.changefeed import ChangeDispatcher
+from pysondb.changefeed import Subscriber
 from pysondb.config import Config
 from pysondb.errors import DatabaseNotFoundError, InvalidUserError
 from pysondb.errors import DatabaseAlreadyExistsError
+from pysondb.errors import SchemaTypeError
 from pysondb.errors import SectionNotFoundError
+from pysondb.errors import TransactionError
 from pysondb.errors import MalformedIdGeneratorError
+from pysondb.errors import PermissionDeniedError
+from pysondb.errors import RateLimitExceededError
+from pysondb.errors import ServerBusyError
+from pysondb.errors import ReadOnlyReplicaError
+from pysondb.errors import WatchResumeError
+from pysondb.errors import WorkerRedirectError
+from pysondb.jsoncache import JsonCache
+from pysondb.jsoncache import RawJSON
+from pysondb.loader import LoadInfoType
+from pysondb.loader import parse_database
+from pysondb.profiler import PhaseTimer
+from pysondb.profiler import SamplingProfiler
+from pysondb.profiler import SlowQueryLog
+from pysondb.scheduler import Scheduler
+from pysondb.spill import MemoryBudget
+from pysondb.transactions import TRANSACTION_COMMANDS
+from pysondb.transactions import Transaction
 from enum import Enum
-from copy import deepcopy
 from pysondb.db import PysonDB
+import socket
 import socketserver
+import time
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from threading import Event
+from threading import Lock
+from threading import Thread
 import uuid
 import zlib
 from base64 import urlsafe_b64encode as b64e, urlsafe_b64decode as b64d
@@ -27,68 +63,413 @@ except ImportError:
 
 RETVAL: Dict = {"error": "NoError", "data": ""}
 
+# buffers handed to one sendmsg call, well under IOV_MAX
+MAX_IOV = 64
+
+
+def sendall_parts(sock: socket.socket, parts: List[bytes]) -> None:
+    """
+    sendall for a list of buffers, gathered by the kernel (sendmsg) instead
+    of being joined into one more copy first.
+    """
+    if not hasattr(sock, "sendmsg") or len(parts) > MAX_IOV:
+        sock.sendall(b"".join(parts))
+        return
+    views = [memoryview(part) for part in parts if part]
+    while views:
+        sent = sock.sendmsg(views)
+        while sent:
+            if sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
 
 class SocketServer(socketserver.ThreadingTCPServer):
-    def __init__(self, cfile: str = "./config.json"):
+    # a restarted primary must be able to bind its port again while old
+    # replica connections sit in TIME_WAIT
+    allow_reuse_address = True
+    # idle client connections must not hold up a worker's shutdown
+    daemon_threads = True
+
+    def __init__(self, cfile: str = "./config.json", worker_id: int = 0, workers: int = 1):
         print("pysondb server starting")
+        self.worker_id = worker_id
+        self.workers = workers
+        self._owner_server = None
+        self._worker_port_server = None
         self._config_file = cfile
         self._config = Config(self._config_file)
+        self._databases: Dict[str, PysonDB] = {}
+        self._db_lock = Lock()
+        self._load_locks: Dict[str, Lock] = {}
+        # parses submitted by prewarm and not installed yet, see get_db
+        self._pending_loads: Dict[str, Tuple[Future, str, float]] = {}
+        self._load_info: Dict[str, LoadInfoType] = {}
+        self._ready = Event()
+        self._started = time.time()
 
         print("config loaded")
         c = self._config.get_config()
+        self._slow_log = SlowQueryLog.from_config(c.get("slow_log"))
+        self._scheduler = Scheduler.from_config(c.get("scheduler"))
+        watch = c.get("watch", {})
+        self._dispatcher = ChangeDispatcher(watch.get("buffer_size", 10000))
+        self._watch_max_pending = watch.get("max_pending", 10000)
+        memory = c.get("memory", {})
+        self._memory = None
+        if memory.get("budget_mb"):
+            # every pre-fork worker holds its own share of the databases
+            limit = int(memory["budget_mb"] * 1024 * 1024 / workers)
+            self._memory = MemoryBudget(limit, memory.get("interval", 1.0))
+            self._memory.start()
+        backup = c.get("backup", {})
+        self.backups = BackupManager(
+            self._config.get_pwd() + "/" + backup.get("dir", "backups"),
+            backup.get("max_mb_per_sec", 0) * 1024 * 1024,
+        )
+        # ReplicaSync when this server is a read-only replica
+        self._replica = None
         print(f"execuition path : {self._config.get_pwd()}")
         HOST, PORT = c["host"], c["port"]
+        if workers > 1:
+            # pre-fork mode: every worker accepts on the same port
+            self.allow_reuse_port = True
         super().__init__((HOST, PORT), ClientTCPHandler)
+        if workers > 1:
+            from pysondb.prefork import start_owner_threads
+
+            start_owner_threads(self, c, worker_id, ClientTCPHandler)
+            print(f"worker {worker_id} of {workers}")
         print(f"server started on {HOST}:{PORT}")
         print("Available databases:")
         for f in c["databases"]:
             print(f"\t{f['name']}")
+        self._config.add_listener(self._on_config_change)
+        self._config.start_watching()
+        replication = c.get("replication", {})
+        if replication.get("role") == "replica":
+            from pysondb.replication import ReplicaSync
+
+            self._replica = ReplicaSync(self, replication)
+            self._replica.start()
+            print(f"read-only replica of {self._replica.primary}")
+        prewarm = c.get("prewarm", {})
+        if prewarm.get("enabled"):
+            names = prewarm.get("databases") or [d["name"] for d in c["databases"]]
+            args = (names, prewarm.get("pool", "auto"), prewarm.get("workers", 4))
+            if prewarm.get("wait", True):
+                self.prewarm(*args)
+            else:
+                # HEALTH reports "loading" until it is done
+                Thread(target=self.prewarm, args=args, name="prewarm", daemon=True).start()
+        else:
+            self._ready.set()
         print("server accepting requests")
 
+    def prewarm(self, names: List[str], pool: str = "auto", workers: int = 4) -> None:
+        """
+        Loads the given databases before the first connection needs them,
+        parsing the files concurrently in a process pool (or a thread pool).
+        """
+        start = time.perf_counter()
+        if pool == "auto":
+            # the parsed data is pickled back to the server, which only pays
+            # off when the parses really run in parallel
+            pool = "process" if (cpu_count() or 1) > 1 else "thread"
+        if pool == "process":
+            import multiprocessing
+
+            # spawn, forking a process that already runs threads is not safe
+            context = multiprocessing.get_context("spawn")
+            executor = ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context)
+        else:
+            executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prewarm")
+        with executor:
+            futures = {}
+            for dbname in dict.fromkeys(names):
+                d = self._config.get_db_conf(dbname)
+                if d is None or not self._owns(d):
+                    continue
+                futures[executor.submit(parse_database, self.db_path(d["filename"]))] = dbname
+            with self._db_lock:
+                for future, dbname in futures.items():
+                    self._pending_loads[dbname] = (future, pool, start)
+            for future in as_completed(futures):
+                try:
+                    self.get_db(futures[future])
+                except Exception as e:
+                    print(f"prewarm of {futures[future]} failed: {e}")
+        self._ready.set()
+        print(f"prewarmed {len(futures)} databases in {time.perf_counter() - start:.3f}s")
+
+    def _owns(self, d: Dict) -> bool:
+        if self.workers == 1:
+            return True
+        from pysondb.prefork import owner_of
+
+        return owner_of(d, self.workers) == self.worker_id
+
+    def is_remote(self, db) -> bool:
+        # RemoteDB handles only exist in pre-fork mode, which imports prefork anyway
+        if self.workers == 1:
+            return False
+        from pysondb.prefork import RemoteDB
+
+        return isinstance(db, RemoteDB)
+
+    def db_path(self, filename: str) -> str:
+        return (
+            self._config.get_pwd()
+            + "/"
+            + self._config.get_config()["path"]
+            + "/"
+            + filename
+        )
+
+    def get_db(self, dbname: str) -> PysonDB:
+        """
+        Returns the handle shared by every connection, loading the database on
+        first use (or taking over the parse prewarm started for it).
+        """
+        if (
+            self.workers > 1
+            and dbname not in self._databases
+            and self._config.get_db_conf(dbname) is None
+        ):
+            # created through another worker, whose config write may not be polled
+            # yet. Reloaded outside _db_lock, the reload listeners take it too
+            self._config.reload()
+        with self._db_lock:
+            if dbname in self._databases:
+                return self._databases[dbname]
+            d = self._config.get_db_conf(dbname)
+            if d is None:
+                raise DatabaseNotFoundError(f"database : {dbname} not found.")
+            if not self._owns(d):
+                from pysondb.prefork import RemoteDB
+                from pysondb.prefork import ipc_path
+                from pysondb.prefork import owner_of
+
+                owner = owner_of(d, self.workers)
+                c = self._config.get_config()
+                base_port = c.get("prefork", {}).get("worker_base_port")
+                redirect = f"{c['host']}:{base_port + owner}" if base_port else None
+                handle = RemoteDB(dbname, ipc_path(c, owner), owner, redirect)
+                self._databases[dbname] = handle
+                return handle
+            load_lock = self._load_locks.setdefault(dbname, Lock())
+        # loaded outside _db_lock so that other databases can be used (or
+        # prewarmed) meanwhile, load_lock makes sure it is loaded only once
+        with load_lock:
+            with self._db_lock:
+                if dbname in self._databases:
+                    return self._databases[dbname]
+                pending = self._pending_loads.pop(dbname, None)
+            start = time.perf_counter()
+            try:
+                if pending is not None:
+                    # parsed by prewarm, possibly still running
+                    future, pool, start = pending
+                    data, info = future.result()
+                    info["via"] = pool
+                else:
+                    data, info = parse_database(self.db_path(d["filename"]))
+                    info["via"] = "request"
+            except Exception as e:
+                self._load_info[dbname] = {"error": str(e)}
+                raise
+            interval = d.get(
+                "checkpoint_interval",
+                self._config.get_config().get("checkpoint_interval", 0),
+            )
+            handle = PysonDB(self.db_path(d["filename"]), False, checkpoint_interval=interval)
+            if "id_generator" in d:
+                handle.use_id_generator(d["id_generator"])
+            self._apply_section_conf(handle, d)
+            interning = self._config.get_config().get("interning", {})
+            if interning.get("enabled", False):
+                handle.enable_interning(int(interning.get("max_entries", 1 << 18)))
+            handle.force_load(data)
+            json_cache = self._config.get_config().get("json_cache", {})
+            if json_cache.get("enabled", False):
+                handle.enable_json_cache(int(json_cache.get("max_mb", 64) * 1024 * 1024))
+            if self._memory is not None:
+                handle.set_memory_budget(self._memory)
+            handle.add_listener(self._dispatcher.listener(dbname))
+            info["load_seconds"] = round(time.perf_counter() - start, 4)
+            info["loaded_at"] = time.time()
+            with self._db_lock:
+                self._databases[dbname] = handle
+                self._load_info[dbname] = info
+            return handle
+
+    def unload_db(self, dbname: str) -> None:
+        with self._db_lock:
+            handle = self._databases.pop(dbname, None)
+            self._load_info.pop(dbname, None)
+        if handle is not None:
+            handle.close()
+
+    def _apply_section_conf(self, handle: PysonDB, d: Dict) -> None:
+        for section, schema in d.get("schemas", {}).items():
+            handle.set_schema(section, schema.get("types"), schema.get("defaults"))
+        for section, ttl in d.get("ttl", {}).items():
+            handle.set_ttl(section, ttl["field"], ttl.get("seconds"))
+        indexes = {(section, path) for section, paths in d.get("indexes", {}).items() for path in paths}
+        for section, path in handle.indexes():
+            if (section, path) not in indexes:
+                handle.drop_index(section, path)
+        for section, path in indexes:
+            handle.create_index(section, path)
+        text_indexes = d.get("text_indexes", {})
+        for section in handle.text_indexes():
+            if section not in text_indexes:
+                handle.drop_text_index(section)
+        for section, fields in text_indexes.items():
+            handle.create_text_index(section, fields)
+        columns = d.get("columns", {})
+        for section in handle.columns():
+            if section not in columns:
+                handle.drop_columns(section)
+        for section, fields in columns.items():
+            if not handle.create_columns(section, fields):
+                print(f"numpy is not installed, FIND and AGGREGATE on {d['name']}.{section} run row by row")
+                break
+        if d.get("ttl") and self._replica is None:
+            # a replica deletes expired records when the primary's deletes arrive
+            sweep = self._config.get_config().get("ttl_sweep", {})
+            handle.start_sweeper(sweep.get("interval", 1.0), sweep.get("batch", 500))
+
+    def _on_config_change(self, config: Dict) -> None:
+        # drop handles of databases removed from the config, new ones load lazily
+        names = {d["name"] for d in config["databases"]}
+        with self._db_lock:
+            removed = [n for n in self._databases if n not in names]
+            loaded = [
+                (self._databases[d["name"]], d)
+                for d in config["databases"]
+                if isinstance(self._databases.get(d["name"]), PysonDB)
+            ]
+        for dbname in removed:
+            self.unload_db(dbname)
+        for handle, d in loaded:
+            try:
+                self._apply_section_conf(handle, d)
+            except (SchemaTypeError, KeyError, TypeError) as e:
+                print(f"schemas / ttl / indexes of database {d['name']} not applied: {e}")
+
+    def health(self) -> Dict:
+        """
+        Readiness of this server and the load time / memory of every database.
+        """
+        databases = {}
+        loaded = {}
+        with self._db_lock:
+            for d in self._config.get_config()["databases"]:
+                dbname = d["name"]
+                if not self._owns(d):
+                    databases[dbname] = {"state": "remote"}
+                elif dbname in self._databases:
+                    databases[dbname] = {"state": "loaded", **self._load_info.get(dbname, {})}
+                    loaded[dbname] = self._databases[dbname]
+                elif dbname in self._pending_loads:
+                    databases[dbname] = {"state": "loading"}
+                elif "error" in self._load_info.get(dbname, {}):
+                    databases[dbname] = {"state": "failed", **self._load_info[dbname]}
+                else:
+                    databases[dbname] = {"state": "not_loaded"}
+        # memory_stats takes the database's lock, get_db must not wait for it
+        for dbname, handle in loaded.items():
+            databases[dbname].update(handle.memory_stats())
+        return {
+            "status": "ready" if self._ready.is_set() else "loading",
+            "worker": self.worker_id,
+            "uptime_seconds": round(time.time() - self._started, 3),
+            "memory": (
+                self._memory.stats()
+                if self._memory is not None
+                else {"resident_bytes": sum(i.get("resident_bytes", 0) for i in databases.values())}
+            ),
+            "databases": databases,
+        }
+
+    def server_close(self) -> None:
+        self._config.flush()
+        for extra in (self._owner_server, self._worker_port_server):
+            if extra is not None:
+                extra.shutdown()
+                extra.server_close()
+        if self._owner_server is not None:
+            try:
+                remove(self._owner_server.server_address)
+            except OSError:
+                pass
+        with self._db_lock:
+            handles = list(self._databases.values())
+        for handle in handles:
+            handle.close()
+        if self._memory is not None:
+            self._memory.close()
+        super().server_close()
+
 
 class ClientTCPHandler(socketserver.StreamRequestHandler):
+    # replies to pipelined requests go out back to back, Nagle would hold
+    # each one until the client ACKs the previous one
+    disable_nagle_algorithm = True
+
     def __init__(self, request, client_address, server) -> None:
         self._commands = {
             "ADD": self.add,
             "ADD_MANY": self.add_many,
             "ADD_NEW_KEY": self.add_new_key,
             "ADD_SECTION": self.add_section,
+            "AGGREGATE": self.aggregate,
             "AUTH": self.authenticate,
+            "BACKUP": self.backup,
+            "BEGIN": self.begin,
+            "COMMIT": self.commit,
             "CREATE_DB": self.create_db,
+            "FIND": self.find,
             "GET_ALL": self.get_all,
             "GET_ALL_BY_SECTION": self.get_all_by_section,
             "GET_BY_ID": self.get_by_id,
             "GET_BY_QUERY": self.get_by_query,
-            "UPDATE_BY_ID": self.get_by_id,
+            "HEALTH": self.health,
+            "LOOKUP": self.lookup,
+            "UPDATE_BY_ID": self.update_by_id,
             "UPDATE_BY_QUERY": self.update_by_query,
             "DELETE_BY_ID": self.delete_by_id,
             "DELETE_BY_QUERY": self.delete_by_query,
             "PURGE": self.purge,
             "PURGE_ALL": self.purge_all,
+            "ROLLBACK": self.rollback,
+            "SEARCH": self.search,
+            "PROFILE": self.profile,
+            "STATS": self.stats,
             "USE_DB": self.use_db,
             "USE_SECTION": self.use_section,
             "SET_ID_GENERATOR": self.set_id_generator,
+            "WATCH": self.watch,
+            "UNWATCH": self.unwatch,
+            "REPLICATE": self.replicate,
         }
 
         self._auth_exclude: List = ["AUTH"]
         self._auth: Dict = None
         self._encrypt = True
+        self._salt: Optional[bytes] = None
 
-        self._config: Config = server.__getattribute__("_config")
-        self._db_list = {}
-        for d in self._config.get_config()["databases"]:
-            path = (
-                self._config.get_pwd()
-                + "/"
-                + self._config.get_config()["path"]
-                + "/"
-                + d["filename"]
-            )
-            self._db_list[d["name"]] = {
-                "filename": d["filename"],
-                "handle": PysonDB(path, False),
-            }
+        self._config: Config = server._config
         self._db: Type[PysonDB] = None
+        self._dbname: str = None
+        self._timer: PhaseTimer = None
+        self._op_stats: Dict = None
+        self._send_lock = Lock()
+        self._subscriber: Subscriber = None
+        self._txn: Transaction = None
         super().__init__(request, client_address, server)
 
     def _check_auth(self, d: Dict) -> bool:
@@ -100,35 +481,59 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
         except Exception:
             raise InvalidUserError("Unable to athenticate user credentials")
 
+    def _check_admin(self) -> None:
+        if not self._auth.get("admin", False):
+            raise PermissionDeniedError(
+                f"user '{self._auth['user']}' is not allowed to run admin commands"
+            )
+
     def _process_error(self, e):
         rval = {}
         rval["error"] = e.__class__.__name__
-        rval["data"] = e.message
+        rval["data"] = getattr(e, "message", str(e))
+        if hasattr(e, "redirect"):
+            rval["redirect"] = e.redirect
         return rval
 
     def _recvall(self):
-        MAX_BUF = 1024
-        data = bytearray()
-        len = int.from_bytes(self.request.recv(8), "big")
-        loop = len // MAX_BUF
-        while loop > 0:
-            data += self.request.recv(MAX_BUF)
-            loop -= 1
-        data += self.request.recv(len % MAX_BUF)
-        return data.decode()
-
-    def _send(self, msg):
-        _msg = msg.encode()
-        if self._encrypt:
-            _msg = self._config.password_encrypt(_msg, self._auth["passwd"])
-        self.wfile.write(len(_msg).to_bytes(8, "big"))
-        self.wfile.write(_msg)
+        # buffered exact reads: a pipelining client sends the next messages
+        # right behind this one, a short recv would split them at random
+        header = self.rfile.read(8)
+        if len(header) < 8:
+            return ""
+        return self.rfile.read(int.from_bytes(header, "big")).decode()
+
+    def _encode_response(self, result: Any) -> Union[str, List[bytes]]:
+        # a reply whose data comes from the JSON cache is spliced from its parts
+        data = result.get("data") if isinstance(result, dict) else None
+        if not isinstance(data, RawJSON):
+            return json.dumps(result)
+        rest = json.dumps({k: v for k, v in result.items() if k != "data"})
+        parts = [b'{"data": ', *data.parts]
+        parts.append(b", " + rest[1:].encode() if rest != "{}" else b"}")
+        return parts
+
+    def _send(self, msg: Union[str, List[bytes]], timer: PhaseTimer = None):
+        parts = [msg.encode()] if isinstance(msg, str) else msg
+        if self._encrypt and self._auth is not None:
+            start = time.perf_counter()
+            parts = [self._config.password_encrypt(b"".join(parts), self._auth["passwd"], salt=self._salt)]
+            if timer is not None:
+                timer.add({"encrypt": (time.perf_counter() - start) * 1000})
+        header = sum(map(len, parts)).to_bytes(8, "big")
+        # WATCH events are pushed from another thread on the same socket
+        with self._send_lock:
+            # header and body in one write, two small writes stall on Nagle / delayed ACK
+            sendall_parts(self.request, [header, *parts])
+
+    def _push(self, message: Dict) -> None:
+        self._send(json.dumps(message))
 
     def add(self, data: Dict) -> Dict:
         retval = RETVAL.copy()
         try:
             retval["data"] = self._db.add(
-                data["section"], data["data"], data["ignore_missing_key"]
+                data["section"], data["data"], data["ignore_missing_key"], copy=False
             )
             self._db.commit()
             return retval
@@ -143,6 +548,7 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
                 data["data"],
                 data["json_response"],
                 data["ignore_missing_key"],
+                copy=False,
             )
             self._db.commit()
             return retval
@@ -174,45 +580,102 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
     def authenticate(self, data: Dict) -> Dict:
         retval = RETVAL.copy()
         try:
+            auth = self._config.auth_user(data["credentials"])
+            # replies are encrypted with the client's salt, so both ends derive
+            # the key once per connection instead of once per message
+            salt = b64d(data["salt"]) if data.get("salt") else None
+            if salt is not None and len(salt) != 16:
+                raise ValueError("salt must be 16 bytes")
+            scheduler: Scheduler = self.server._scheduler
+            scheduler.connect(auth)
+            if self._auth is not None:
+                scheduler.disconnect(self._auth)
+            self._auth = auth
             self._encrypt = data["encrypt"]
-            self._auth = self._config.auth_user(data["credentials"])
+            self._salt = salt
             retval["data"] = self._auth["key"]
             return retval
         except Exception as e:
             return self._process_error(e)
 
+    def backup(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            self._check_admin()
+            dbname = data.get("dbname") or self._dbname
+            if dbname is None:
+                raise DatabaseNotFoundError("give a dbname or select a database with USE_DB before BACKUP")
+            db = self.server.get_db(dbname)
+            if self.server.is_remote(db):
+                raise self._redirect_error(db)
+            rate = data.get("max_mb_per_sec")
+            retval["data"] = self.server.backups.backup(
+                dbname, db, data.get("full", False), rate * 1024 * 1024 if rate is not None else None
+            )
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
+    def begin(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            if self._txn is not None:
+                raise TransactionError("a transaction is already open, COMMIT or ROLLBACK it first")
+            if self._db is None:
+                raise DatabaseNotFoundError("select a database with USE_DB before BEGIN")
+            self._txn = Transaction(self._db)
+            self._db = self._txn
+            retval["data"] = {"seq": self._txn.base_seq}
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
+    def _end_transaction(self) -> Transaction:
+        if self._txn is None:
+            raise TransactionError("no transaction is open, use BEGIN first")
+        txn = self._txn
+        self._txn = None
+        self._db = txn.db
+        return txn
+
+    def commit(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            txn = self._end_transaction()
+            # the transaction is over even if it conflicts, the client retries from BEGIN
+            seq = txn.apply()
+            self._db.commit()
+            retval["data"] = {"seq": seq, "operations": len(txn.events)}
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
     def create_db(self, data: Dict):
         retval = RETVAL.copy()
         try:
             dbname = data["dbname"]
             filename = f"{dbname}.json"
             force = data["force"]
-            path = (
-                self._config.get_pwd()
-                + "/"
-                + self._config.get_config()["path"]
-                + "/"
-                + filename
-            )
+            path = self.server.db_path(filename)
             if not force:
-                if dbname in self._db_list or exists(filename):
+                if self._config.exists(dbname) or exists(path):
                     raise DatabaseAlreadyExistsError(
                         f"database {dbname} already exists"
                     )
             else:
                 if exists(path):
                     remove(path)
+                self.server.unload_db(dbname)
             newdb = PysonDB(path)
             del newdb
             self._auth["access"].append(dbname)
-            self._config.add_db(self._auth["user"], dbname)
-            self._db_list[dbname] = {
-                "filename": filename,
-                "handle": PysonDB(path, False),
-            }
+            self._config.add_db(dbname, self._auth["user"])
+            if self.server.workers > 1:
+                # the owning worker may be another process, it reads the config from disk
+                self._config.flush()
             if data["use"]:
-                self._db = self._db_list[dbname]["handle"]
-                self._db.force_load()
+                self._db = self.server.get_db(dbname)
+                self._dbname = dbname
             return retval
         except Exception as e:
             return self._process_error(e)
@@ -235,10 +698,25 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
         except Exception as e:
             return self._process_error(e)
 
+    def _json_cache(self) -> Optional[JsonCache]:
+        # only the database itself has one, not a transaction or another worker's database
+        return getattr(self._db, "json_cache", None)
+
+    def _cached_records(self, section: str, fields: Optional[List[str]], records: Any) -> Any:
+        # whole records are sent from the JSON cache, projections are new dicts every time
+        cache = self._json_cache()
+        if cache is None or fields is not None or not isinstance(records, dict):
+            return records
+        if not all(isinstance(record, dict) for record in records.values()):
+            return records
+        return cache.records(section, records)
+
     def get_all(self, data: Dict) -> Dict:
         retval = RETVAL.copy()
         try:
-            retval["data"] = self._db.get_all()
+            result = self._db.get_all(copy=False)
+            cache = self._json_cache()
+            retval["data"] = cache.sections(result) if cache is not None and isinstance(result, dict) else result
             return retval
         except Exception as e:
             return self._process_error(e)
@@ -246,7 +724,13 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
     def get_all_by_section(self, data: Dict) -> Dict:
         retval = RETVAL.copy()
         try:
-            retval["data"] = self._db.get_all_by_section(data["section"])
+            retval["data"] = self._cached_records(
+                data["section"],
+                data.get("fields"),
+                self._db.get_all_by_section(
+                    data["section"], data.get("fields"), data.get("order_by"), data.get("limit"), copy=False
+                ),
+            )
             return retval
         except Exception as e:
             return self._process_error(e)
@@ -254,7 +738,11 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
     def get_by_id(self, data: Dict) -> Dict:
         retval = RETVAL.copy()
         try:
-            retval["data"] = self._db.get_by_id(data["section"], data["id"])
+            record = self._db.get_by_id(data["section"], data["id"], data.get("fields"), copy=False)
+            cache = self._json_cache()
+            if cache is not None and data.get("fields") is None and isinstance(record, dict):
+                record = cache.record(data["section"], data["id"], record)
+            retval["data"] = record
             return retval
         except Exception as e:
             return self._process_error(e)
@@ -262,7 +750,85 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
     def get_by_query(self, data: Dict) -> Dict:
         retval = RETVAL.copy()
         try:
-            retval["data"] = self._db.get_by_query(data["section"], data["query"])
+            retval["data"] = self._cached_records(
+                data["section"],
+                data.get("fields"),
+                self._db.get_by_query(
+                    data["section"],
+                    data["query"],
+                    data.get("fields"),
+                    data.get("order_by"),
+                    data.get("limit"),
+                    copy=False,
+                ),
+            )
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
+    def find(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            retval["data"] = self._cached_records(
+                data["section"],
+                data.get("fields"),
+                self._db.find(
+                    data["section"],
+                    data.get("filter"),
+                    data.get("fields"),
+                    data.get("order_by"),
+                    data.get("limit"),
+                    copy=False,
+                ),
+            )
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
+    def lookup(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            section, other = data["section"], data["other"]
+            rows = self._db.lookup(
+                section,
+                data.get("field"),
+                other,
+                data.get("other_field"),
+                data.get("filter"),
+                data.get("other_filter"),
+                data.get("fields"),
+                data.get("other_fields"),
+                data.get("limit"),
+                data.get("outer", False),
+                copy=False,
+            )
+            cache = self._json_cache()
+            whole = (data.get("fields") is None, data.get("other_fields") is None)
+            if cache is not None and any(whole):
+                rows = cache.rows(section, other, rows, whole)
+            retval["data"] = rows
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
+    def aggregate(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            retval["data"] = self._db.aggregate(
+                data["section"],
+                data["field"],
+                data.get("filter"),
+                data.get("bins"),
+                data.get("bounds"),
+            )
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
+    def health(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            retval["data"] = self.server.health()
             return retval
         except Exception as e:
             return self._process_error(e)
@@ -274,35 +840,132 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
                 data = self._recvall()
                 if not data:
                     break
-                if self._auth == None:
-                    data = self._config.unobscure(data)
-                else:
-                    if self._encrypt:
-                        data = self._config.password_decrypt(data, self._auth["passwd"])
+                self._timer = PhaseTimer()
+                with self._timer.phase("decrypt"):
+                    if self._auth == None:
+                        data = self._config.unobscure(data)
+                    else:
+                        if self._encrypt:
+                            data = self._config.password_decrypt(data, self._auth["passwd"])
                 self.data = data
                 # print("{} wrote:".format(self.client_address[0]))
                 # print(self.data)
-                d = json.loads(self.data)
+                with self._timer.phase("parse"):
+                    d = json.loads(self.data)
                 try:
                     self._check_auth(d)
-                    retval = json.dumps(self._commands.get(d["cmd"])(d["payload"]))
-                except InvalidUserError as e:
-                    retVal = self._process_error(e)
-                self._send(retval)
+                    if self.server._replica is not None:
+                        self.server._replica.check_write(d["cmd"])
+                    if self.server.workers > 1:
+                        self._check_owner(d["cmd"])
+                    if self._txn is not None and d["cmd"] not in TRANSACTION_COMMANDS:
+                        raise TransactionError(f"{d['cmd']} is not allowed inside a transaction")
+                    with self._timer.phase("execute"):
+                        result = self.server._scheduler.run(
+                            self._auth, d["cmd"], self._execute, d, self._timer
+                        )
+                    with self._timer.phase("encode"):
+                        retval = self._encode_response(result)
+                except (
+                    InvalidUserError,
+                    RateLimitExceededError,
+                    ServerBusyError,
+                    ReadOnlyReplicaError,
+                    WorkerRedirectError,
+                    TransactionError,
+                ) as e:
+                    retval = json.dumps(self._process_error(e))
+                self._send(retval, self._timer)
+                self._log_if_slow(d)
 
         except:
             pass
+        if self._auth is not None:
+            self.server._scheduler.disconnect(self._auth)
+        if self._subscriber is not None:
+            self.server._dispatcher.unsubscribe_all(self._subscriber)
+            self._subscriber.close()
         print("Connection Terminated")
 
+    def _execute(self, d: Dict) -> Dict:
+        # runs on a scheduler worker thread, so the per thread op stats are collected here
+        db = self._db
+        if db is not None:
+            db.reset_op_stats()
+        try:
+            return self._commands.get(d["cmd"])(d["payload"])
+        finally:
+            self._op_stats = db.last_op_stats() if db is not None else None
+
+    def _log_if_slow(self, d: Dict) -> None:
+        slow_log: SlowQueryLog = self.server._slow_log
+        total_ms = self._timer.total_ms()
+        if not slow_log.is_slow(total_ms):
+            return
+        stats = self._op_stats or {"scanned": 0, "returned": 0, "phases": {}}
+        self._timer.add({f"db.{k}": v for k, v in stats["phases"].items()})
+        payload = d.get("payload") if isinstance(d.get("payload"), dict) else {}
+        slow_log.log(
+            {
+                "time": time.time(),
+                "client": self.client_address[0],
+                "user": self._auth["user"] if self._auth else None,
+                "cmd": d.get("cmd"),
+                "db": self._dbname,
+                "section": payload.get("section"),
+                "query": payload.get("query"),
+                "scanned": stats["scanned"],
+                "returned": stats["returned"],
+                "total_ms": round(total_ms, 3),
+                "phases": {k: round(v, 3) for k, v in self._timer.phases.items()},
+            }
+        )
+
+    def profile(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            self._check_admin()
+            profiler = SamplingProfiler(data.get("interval_ms", 5) / 1000)
+            stacks = profiler.run(data.get("seconds", 5))
+            retval["data"] = {"samples": profiler.samples, "stacks": stacks}
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
+    def stats(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            retval["data"] = {
+                "scheduler": self.server._scheduler.stats(),
+                "watch": self.server._dispatcher.stats(),
+                "worker": {"id": self.server.worker_id, "workers": self.server.workers},
+                "replication": (
+                    self.server._replica.stats()
+                    if self.server._replica is not None
+                    else {"role": "primary"}
+                ),
+            }
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
     def update_by_id(self, data: Dict) -> Dict:
         retval = RETVAL.copy()
         try:
-            retval = self._db.update_by_id(data["section"], data["id"], data["data"])
+            retval["data"] = self._db.update_by_id(data["section"], data["id"], data["data"], copy=False)
             self._db.commit()
             return retval
         except Exception as e:
             return self._process_error(e)
 
+    def rollback(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            retval["data"] = {"operations": len(self._end_transaction().events)}
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
     def purge(self, data: Dict) -> Dict:
         retval = RETVAL.copy()
         try:
@@ -321,9 +984,29 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
         except Exception as e:
             return self._process_error(e)
 
+    def search(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            retval["data"] = self._db.search(
+                data["section"],
+                data["query"],
+                data.get("limit", 20),
+                data.get("offset", 0),
+                data.get("mode", "all"),
+                data.get("fields"),
+                copy=False,
+            )
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
     def set_id_generator(self, data: Dict) -> Dict:
         retval = RETVAL.copy()
         try:
+            if "type" in data:
+                # built in generator, e.g. {"type": "snowflake", "node": 2}
+                self._db.use_id_generator(data)
+                return retval
             fn = data["fn"]
             try:
                 _fn = eval(fn)
@@ -340,22 +1023,125 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
         retval = RETVAL.copy()
         try:
             retval["data"] = self._db.update_by_query(
-                data["section"], data["query"], data["data"]
+                data["section"], data["query"], data["data"], copy=False
             )
             self._db.commit()
             return retval
         except Exception as e:
             return self._process_error(e)
 
+    def _on_watch_overflow(self, subscriber: Subscriber) -> None:
+        # the client fell too far behind, drop it so it reconnects and resumes
+        # from its last seq. Called by the dispatcher under its lock, which
+        # unsubscribes the subscriber itself once the lock is released
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def watch(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            if self._db is None:
+                raise DatabaseNotFoundError("select a database with USE_DB before WATCH")
+            section = data["section"]
+            if section not in self._db.sections():
+                raise SectionNotFoundError(f"Section { section} not found.")
+            if self._subscriber is None:
+                self._subscriber = Subscriber(self._push, self.server._watch_max_pending)
+                self._subscriber.on_overflow = self._on_watch_overflow
+            # the events after seq are delivered, whatever is committed meanwhile
+            seq, run_id = self._db.seq, self._db.run_id
+            sub = self.server._dispatcher.subscribe(
+                self._subscriber,
+                self._dbname,
+                section,
+                data.get("filter"),
+                data.get("since"),
+                seq,
+                run_id=data.get("run_id", run_id),
+                current_run_id=run_id,
+            )
+            retval["data"] = {"watch_id": sub.watch_id, "seq": seq, "run_id": run_id}
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
+    def _check_owner(self, cmd: str) -> None:
+        from pysondb.prefork import OWNER_ONLY_COMMANDS
+
+        if cmd in OWNER_ONLY_COMMANDS and self.server.is_remote(self._db):
+            raise self._redirect_error(self._db)
+
+    def _redirect_error(self, db) -> WorkerRedirectError:
+        e = WorkerRedirectError(
+            f"database {db.dbname} is owned by worker {db.owner}, "
+            + (f"connect to {db.redirect}" if db.redirect else "set prefork.worker_base_port to reach it")
+        )
+        if db.redirect:
+            e.redirect = db.redirect
+        return e
+
+    def replicate(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            if not (self._auth.get("replication") or self._auth.get("admin")):
+                raise PermissionDeniedError(
+                    f"user '{self._auth['user']}' is not allowed to replicate"
+                )
+            names = data.get("databases") or [
+                d["name"] for d in self._config.get_config()["databases"]
+            ]
+            since = data.get("since") or {}
+            dispatcher: ChangeDispatcher = self.server._dispatcher
+            if self._subscriber is None:
+                self._subscriber = Subscriber(self._push, self.server._watch_max_pending)
+                self._subscriber.on_overflow = self._on_watch_overflow
+            snapshots = {}
+            for name in names:
+                db = self.server.get_db(name)
+                if self.server.is_remote(db):
+                    raise self._redirect_error(db)
+                # since: {name: {"seq", "run_id"}}, a resume from another run of
+                # the database (the primary restarted) gets a full snapshot
+                resume = since.get(name)
+                if isinstance(resume, dict) and isinstance(resume.get("seq"), int):
+                    try:
+                        dispatcher.subscribe(
+                            self._subscriber, name, ALL_SECTIONS, None, resume["seq"], db.seq,
+                            "REPLICATE", resume.get("run_id"), db.run_id,
+                        )
+                        snapshots[name] = {"seq": resume["seq"], "run_id": db.run_id}
+                        continue
+                    except WatchResumeError:
+                        pass
+                run_id = db.run_id
+                seq, view = db.snapshot_with_seq()
+                # every event after seq is either replayed from the buffer or still queued
+                dispatcher.subscribe(
+                    self._subscriber, name, ALL_SECTIONS, None, seq, db.seq, "REPLICATE", run_id, db.run_id
+                )
+                snapshots[name] = {"seq": seq, "run_id": run_id, "data": view}
+            retval["data"] = snapshots
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
+    def unwatch(self, data: Dict) -> Dict:
+        retval = RETVAL.copy()
+        try:
+            retval["data"] = self.server._dispatcher.unsubscribe(data["watch_id"])
+            return retval
+        except Exception as e:
+            return self._process_error(e)
+
     def use_db(self, data: Dict):
         retval = RETVAL.copy()
         try:
             dbname = data["dbname"]
             section = data["section"]
-            if not dbname in self._db_list:
-                raise DatabaseNotFoundError(f"database : {dbname} not found.")
-            self._db = self._db_list[dbname]["handle"]
-            self._db.force_load()
+            self._db = self.server.get_db(dbname)
+            self._dbname = dbname
             retval["data"] = {"dbname": dbname}
             if section != None:
                 sec_retval = self.use_section({"section": section})
@@ -371,7 +1157,7 @@ class ClientTCPHandler(socketserver.StreamRequestHandler):
         retval = RETVAL.copy()
         try:
             section = data["section"]
-            if not section in self._db._load_file():
+            if not section in self._db.sections():
                 raise SectionNotFoundError(f"Section { section} not found.")
             retval["data"] = section
             return retval
@@ -0,0 +1,230 @@
+import secrets
+import socket
+import time
+from base64 import urlsafe_b64encode as b64e
+from threading import Thread
+from typing import Dict
+from typing import List
+from typing import Optional
+
+try:
+    import ujson as json
+except ImportError:
+    import json as json
+
+from pysondb.errors import ReadOnlyReplicaError
+
+
+# commands a replica refuses, they must be sent to the primary
+WRITE_COMMANDS = {
+    "ADD",
+    "ADD_MANY",
+    "ADD_NEW_KEY",
+    "ADD_SECTION",
+    "CREATE_DB",
+    "UPDATE_BY_ID",
+    "UPDATE_BY_QUERY",
+    "DELETE_BY_ID",
+    "DELETE_BY_QUERY",
+    "PURGE",
+    "PURGE_ALL",
+    "SET_ID_GENERATOR",
+}
+
+# consecutive events of a database that fail to apply before the replica
+# gives up on resuming it and asks for a full snapshot
+MAX_APPLY_FAILURES = 3
+
+
+def read_only_error(primary: str) -> ReadOnlyReplicaError:
+    e = ReadOnlyReplicaError(
+        f"this server is a read-only replica, send writes to the primary at {primary}"
+    )
+    e.redirect = primary
+    return e
+
+
+class _Connection:
+    """
+    Minimal client side of the wire protocol: 8 byte big endian length
+    prefix, obscured AUTH, then optionally password encrypted messages.
+    """
+
+    def __init__(self, config, host: str, port: int, user: str, passwd: str, encrypt: bool) -> None:
+        self._config = config
+        self._passwd = passwd
+        self._encrypt = False
+        self._sock = socket.create_connection((host, port))
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        credentials = "c" + str(
+            config.obscure(bytes(json.dumps({"u": user, "p": passwd}), "utf-8")), "utf-8"
+        )
+        # one salt for the connection, the primary encrypts its replies with it too
+        self._salt = secrets.token_bytes(16)
+        payload = {"encrypt": encrypt, "credentials": credentials, "salt": str(b64e(self._salt), "utf-8")}
+        self._write(config.obscure(bytes(json.dumps({"cmd": "AUTH", "payload": payload}), "utf-8")))
+        self._encrypt = encrypt
+        reply = self.recv()
+        if reply["error"] != "NoError":
+            raise ConnectionError(f"replication AUTH failed: {reply['data']}")
+        self._key = reply["data"]
+
+    def _write(self, msg: bytes) -> None:
+        self._sock.sendall(len(msg).to_bytes(8, "big") + msg)
+
+    def _read_exact(self, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self._sock.recv(min(n - len(buf), 1 << 20))
+            if not chunk:
+                raise ConnectionError("connection to the primary closed")
+            buf += chunk
+        return bytes(buf)
+
+    def send(self, cmd: str, payload: Dict) -> None:
+        msg = bytes(json.dumps({"cmd": cmd, "auth": self._key, "payload": payload}), "utf-8")
+        if self._encrypt:
+            msg = self._config.password_encrypt(msg, self._passwd, salt=self._salt)
+        self._write(msg)
+
+    def recv(self) -> Dict:
+        msg = self._read_exact(int.from_bytes(self._read_exact(8), "big"))
+        if self._encrypt:
+            msg = self._config.password_decrypt(msg, self._passwd)
+        return json.loads(msg)
+
+    def close(self) -> None:
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class ReplicaSync(Thread):
+    """
+    Keeps the databases of a replica server in sync with the primary: it
+    sends REPLICATE, loads the returned snapshots and then applies the
+    mutation events the primary pushes, reconnecting (and resuming from the
+    last applied seq when the primary still buffers it) on failure. A seq is
+    only resumed from within the run of the primary's database it came from
+    (see PysonDB.seq), after a restart of the primary the replica loads a
+    full snapshot again, as it does when an event keeps failing to apply.
+    """
+
+    def __init__(self, server, conf: Dict) -> None:
+        super().__init__(name="replica-sync", daemon=True)
+        self._server = server
+        self._conf = conf
+        primary = conf["primary"]
+        self.primary = f"{primary['host']}:{primary['port']}"
+        self.connected = False
+        self.last_error: Optional[str] = None
+        self._applied: Dict[str, Dict] = {}
+        self._failures: Dict[str, int] = {}
+
+    def check_write(self, cmd: str) -> None:
+        if cmd in WRITE_COMMANDS:
+            raise read_only_error(self.primary)
+
+    def _databases(self) -> List[str]:
+        names = self._conf.get("databases")
+        if names:
+            return names
+        return [d["name"] for d in self._server._config.get_config()["databases"]]
+
+    def run(self) -> None:
+        while True:
+            try:
+                self._sync()
+            except Exception as e:
+                self.last_error = f"{e.__class__.__name__}: {e}"
+            self.connected = False
+            time.sleep(self._conf.get("retry_interval", 2))
+
+    def _sync(self) -> None:
+        primary = self._conf["primary"]
+        conn = _Connection(
+            self._server._config,
+            primary["host"],
+            primary["port"],
+            primary["user"],
+            primary["passwd"],
+            primary.get("encrypt", False),
+        )
+        try:
+            since = {name: {"seq": s["seq"], "run_id": s["run_id"]} for name, s in self._applied.items()}
+            conn.send("REPLICATE", {"databases": self._databases(), "since": since})
+            pending = []
+            while True:
+                reply = conn.recv()
+                if reply.get("push") == "REPLICATE":
+                    # events can overtake the snapshot reply, keep them until it is loaded
+                    pending.append(reply)
+                    continue
+                break
+            if reply["error"] != "NoError":
+                raise ConnectionError(f"REPLICATE failed: {reply['data']}")
+            for name, snap in reply["data"].items():
+                if "data" in snap:
+                    self._server.get_db(name).load_snapshot(snap["data"], snap["seq"])
+                self._mark(name, snap["seq"], snap["run_id"], None)
+            self.connected = True
+            self.last_error = None
+            for message in pending:
+                self._apply(message)
+            while True:
+                message = conn.recv()
+                if message.get("push") == "REPLICATE":
+                    self._apply(message)
+        finally:
+            conn.close()
+
+    def _mark(self, name: str, seq: int, run_id: str, ts: Optional[float]) -> None:
+        now = time.time()
+        self._applied[name] = {
+            "seq": seq,
+            "run_id": run_id,
+            "applied_at": now,
+            "lag_seconds": round(now - ts, 6) if ts is not None else 0.0,
+        }
+
+    def _apply(self, message: Dict) -> None:
+        name, event = message["db"], message["data"]
+        applied = self._applied.get(name)
+        if applied is None:
+            return
+        if event.get("run_id") != applied["run_id"]:
+            # the primary reloaded the database, its seqs start over
+            del self._applied[name]
+            raise ConnectionError(f"database {name} was reloaded on the primary, resyncing")
+        if event["seq"] <= applied["seq"]:
+            return
+        try:
+            self._server.get_db(name).apply_event(event)
+        except Exception:
+            failures = self._failures[name] = self._failures.get(name, 0) + 1
+            if failures >= MAX_APPLY_FAILURES:
+                # the replica diverged, the next sync starts from a snapshot
+                del self._applied[name]
+                self._failures.pop(name, None)
+            raise
+        self._failures.pop(name, None)
+        self._mark(name, event["seq"], event["run_id"], event.get("ts"))
+
+    def stats(self) -> Dict:
+        now = time.time()
+        return {
+            "role": "replica",
+            "primary": self.primary,
+            "connected": self.connected,
+            "last_error": self.last_error,
+            "databases": {
+                name: {
+                    "applied_seq": s["seq"],
+                    "primary_run_id": s["run_id"],
+                    "lag_seconds": s["lag_seconds"],
+                    "seconds_since_last_apply": round(now - s["applied_at"], 3),
+                }
+                for name, s in self._applied.items()
+            },
+        }
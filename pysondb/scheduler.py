@@ -0,0 +1,257 @@
+import time
+from queue import Full
+from queue import Queue
+from threading import BoundedSemaphore
+from threading import Event
+from threading import Lock
+from threading import Thread
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+from pysondb.errors import RateLimitExceededError
+from pysondb.errors import ServerBusyError
+from pysondb.errors import TooManyConnectionsError
+
+
+POINT = "point"
+SCAN = "scan"
+
+# commands that touch every record of a section (or database) are queued
+# separately so that point operations never wait behind them
+COMMAND_COST = {
+    "ADD": POINT,
+    "ADD_MANY": SCAN,
+    "ADD_NEW_KEY": SCAN,
+    "ADD_SECTION": POINT,
+    "AGGREGATE": SCAN,
+    "BEGIN": POINT,
+    "COMMIT": POINT,
+    "CREATE_DB": POINT,
+    "FIND": SCAN,
+    "GET_ALL": SCAN,
+    "GET_ALL_BY_SECTION": SCAN,
+    "GET_BY_ID": POINT,
+    "GET_BY_QUERY": SCAN,
+    "LOOKUP": SCAN,
+    "UPDATE_BY_ID": POINT,
+    "UPDATE_BY_QUERY": SCAN,
+    "DELETE_BY_ID": POINT,
+    "DELETE_BY_QUERY": SCAN,
+    "PURGE": POINT,
+    "PURGE_ALL": SCAN,
+    "ROLLBACK": POINT,
+    "SEARCH": POINT,
+    "USE_DB": POINT,
+    "USE_SECTION": POINT,
+    "SET_ID_GENERATOR": POINT,
+    "WATCH": POINT,
+    "UNWATCH": POINT,
+    "REPLICATE": SCAN,
+}
+
+# run on the connection thread: session / admin commands that must not queue
+INLINE_COMMANDS = {"AUTH", "BACKUP", "HEALTH", "PROFILE", "STATS"}
+
+
+def command_cost(cmd: str) -> str:
+    return COMMAND_COST.get(cmd, POINT)
+
+
+class _Job:
+    __slots__ = ("fn", "payload", "queued", "wait_ms", "result", "error", "done")
+
+    def __init__(self, fn: Callable, payload: Any) -> None:
+        self.fn = fn
+        self.payload = payload
+        self.queued = time.perf_counter()
+        self.wait_ms = 0.0
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.done = Event()
+
+
+class _QueueStats:
+    def __init__(self) -> None:
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.run_ms_total = 0.0
+
+    def as_dict(self, depth: int, workers: int) -> Dict:
+        done = self.completed or 1
+        return {
+            "workers": workers,
+            "depth": depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_ms_avg": round(self.wait_ms_total / done, 3),
+            "wait_ms_max": round(self.wait_ms_max, 3),
+            "run_ms_avg": round(self.run_ms_total / done, 3),
+        }
+
+
+class _UserLimits:
+    """
+    Concurrency semaphore plus a token bucket (rate_limit requests / second).
+    """
+
+    def __init__(self, max_concurrency: Optional[int], rate_limit: Optional[float]) -> None:
+        self.key = (max_concurrency, rate_limit)
+        self.semaphore = BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.rate = rate_limit
+        self._tokens = float(rate_limit or 0)
+        self._stamp = time.monotonic()
+        self._lock = Lock()
+
+    def take_token(self) -> bool:
+        if not self.rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class Scheduler:
+    """
+    Bounded worker pools between the connection threads and the command
+    handlers, one pool and queue per cost class, with per user limits taken
+    from the user entries in config.json (max_connections, max_concurrency,
+    rate_limit).
+    """
+
+    def __init__(
+        self,
+        point_workers: int = 8,
+        scan_workers: int = 2,
+        max_queue: int = 1024,
+        max_connections: int = 0,
+    ) -> None:
+        self.max_connections = max_connections
+        self._workers = {POINT: point_workers, SCAN: scan_workers}
+        self._queues: Dict[str, Queue] = {POINT: Queue(max_queue), SCAN: Queue(max_queue)}
+        self._stats = {POINT: _QueueStats(), SCAN: _QueueStats()}
+        self._stats_lock = Lock()
+        self._limits: Dict[str, _UserLimits] = {}
+        self._limits_lock = Lock()
+        self._connections: Dict[str, int] = {}
+        self._total_connections = 0
+        self._conn_lock = Lock()
+        for cost, count in self._workers.items():
+            for i in range(count):
+                Thread(target=self._work, args=(cost,), name=f"{cost}-worker-{i}", daemon=True).start()
+
+    @classmethod
+    def from_config(cls, conf: Optional[Dict]) -> "Scheduler":
+        conf = conf or {}
+        return cls(
+            conf.get("point_workers", 8),
+            conf.get("scan_workers", 2),
+            conf.get("max_queue", 1024),
+            conf.get("max_connections", 0),
+        )
+
+    def _work(self, cost: str) -> None:
+        queue = self._queues[cost]
+        stats = self._stats[cost]
+        while True:
+            job: _Job = queue.get()
+            start = time.perf_counter()
+            job.wait_ms = (start - job.queued) * 1000
+            try:
+                job.result = job.fn(job.payload)
+            except BaseException as e:
+                job.error = e
+            run_ms = (time.perf_counter() - start) * 1000
+            with self._stats_lock:
+                stats.completed += 1
+                stats.wait_ms_total += job.wait_ms
+                stats.wait_ms_max = max(stats.wait_ms_max, job.wait_ms)
+                stats.run_ms_total += run_ms
+            job.done.set()
+
+    def _user_limits(self, user: Dict) -> _UserLimits:
+        key = (user.get("max_concurrency"), user.get("rate_limit"))
+        with self._limits_lock:
+            limits = self._limits.get(user["user"])
+            if limits is None or limits.key != key:
+                # (re)built when the user's limits change on a config reload
+                limits = self._limits[user["user"]] = _UserLimits(*key)
+            return limits
+
+    def run(self, user: Optional[Dict], cmd: str, fn: Callable, payload: Any, timer=None) -> Any:
+        if user is None or cmd in INLINE_COMMANDS:
+            return fn(payload)
+        limits = self._user_limits(user)
+        if not limits.take_token():
+            raise RateLimitExceededError(
+                f"user '{user['user']}' exceeded {limits.rate} requests per second"
+            )
+        cost = command_cost(cmd)
+        job = _Job(fn, payload)
+        if limits.semaphore is not None:
+            limits.semaphore.acquire()
+        try:
+            try:
+                self._queues[cost].put_nowait(job)
+            except Full:
+                with self._stats_lock:
+                    self._stats[cost].rejected += 1
+                raise ServerBusyError(f"the {cost} queue is full, try again later")
+            with self._stats_lock:
+                self._stats[cost].submitted += 1
+            job.done.wait()
+        finally:
+            if limits.semaphore is not None:
+                limits.semaphore.release()
+        if timer is not None:
+            timer.add({"queue": job.wait_ms})
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def connect(self, user: Dict) -> None:
+        """
+        Registers an authenticated connection for user, enforcing the connection limits.
+        """
+        with self._conn_lock:
+            if self.max_connections and self._total_connections >= self.max_connections:
+                raise TooManyConnectionsError(
+                    f"the server limit of {self.max_connections} connections is reached"
+                )
+            count = self._connections.get(user["user"], 0)
+            limit = user.get("max_connections")
+            if limit and count >= limit:
+                raise TooManyConnectionsError(
+                    f"user '{user['user']}' already has {count} open connections"
+                )
+            self._connections[user["user"]] = count + 1
+            self._total_connections += 1
+
+    def disconnect(self, user: Dict) -> None:
+        with self._conn_lock:
+            count = self._connections.get(user["user"], 0)
+            if count <= 1:
+                self._connections.pop(user["user"], None)
+            else:
+                self._connections[user["user"]] = count - 1
+            self._total_connections -= 1
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            queues = {
+                cost: self._stats[cost].as_dict(self._queues[cost].qsize(), self._workers[cost])
+                for cost in self._queues
+            }
+        with self._conn_lock:
+            connections = {"total": self._total_connections, "by_user": dict(self._connections)}
+        return {"queues": queues, "connections": connections}
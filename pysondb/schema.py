@@ -0,0 +1,91 @@
+from typing import Any
+from typing import Dict
+from typing import FrozenSet
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from pysondb.errors import SchemaTypeError
+from pysondb.errors import UnknownKeyError
+
+
+# field types a section schema may declare, e.g. in config.json:
+#   "schemas": {"users": {"types": {"age": "int"}, "defaults": {"age": 0}}}
+FIELD_TYPES: Dict[str, Tuple[type, ...]] = {
+    "str": (str,),
+    "int": (int,),
+    "float": (int, float),
+    "bool": (bool,),
+    "list": (list,),
+    "dict": (dict,),
+}
+
+
+def _type_ok(value: Any, name: str) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, bool) and name != "bool":
+        return False
+    return isinstance(value, FIELD_TYPES[name])
+
+
+class SectionSchema:
+    """
+    The keys of a section compiled once: a frozenset for O(fields) checks
+    without sorting, plus the optional field types and defaults. PysonDB
+    caches one per section and rebuilds it when the section's key list is
+    replaced (add_section, purge, add_new_key, first insert).
+    """
+
+    __slots__ = ("source", "keys", "types", "defaults")
+
+    def __init__(
+        self,
+        source: List[str],
+        types: Optional[Dict[str, str]] = None,
+        defaults: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.source = source
+        self.keys: FrozenSet[str] = frozenset(source)
+        self.types = types or {}
+        self.defaults = defaults or {}
+
+    @staticmethod
+    def check_conf(types: Optional[Dict[str, str]], defaults: Optional[Dict[str, Any]]) -> None:
+        for field, name in (types or {}).items():
+            if name not in FIELD_TYPES:
+                raise SchemaTypeError(
+                    f"unknown type {name!r} for {field!r}, use one of {sorted(FIELD_TYPES)}"
+                )
+        for field, value in (defaults or {}).items():
+            name = (types or {}).get(field)
+            if name is not None and not _type_ok(value, name):
+                raise SchemaTypeError(f"the default of {field!r} must be of type {name}")
+
+    def check_types(self, record: Dict) -> None:
+        for field, name in self.types.items():
+            if field in record and not _type_ok(record[field], name):
+                raise SchemaTypeError(
+                    f"{field!r} must be of type {name} and not {type(record[field]).__name__}"
+                )
+
+    def validate(self, record: Dict, ignore: bool = False) -> Dict:
+        """
+        Checks a new record, returns it with the defaults of missing keys filled in.
+        """
+        if not ignore and record.keys() != self.keys:
+            missing = self.keys - record.keys()
+            if self.defaults and missing and missing <= self.defaults.keys() and record.keys() <= self.keys:
+                record = {**record, **{k: self.defaults[k] for k in missing}}
+            else:
+                raise UnknownKeyError(
+                    f"Unrecognized / missing key(s) {set(self.keys ^ record.keys())}"
+                    "(Either the key(s) does not exists in the DB or is missing in the given data)"
+                )
+        if self.types:
+            self.check_types(record)
+        return record
+
+    def unknown(self, fields: Iterable[str]) -> List[str]:
+        return [i for i in fields if i not in self.keys]
@@ -0,0 +1,202 @@
+import heapq
+import math
+import re
+from bisect import bisect_left
+from bisect import insort
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Set
+from typing import Tuple
+
+from pysondb.errors import MalformedQueryError
+from pysondb.filters import get_path
+
+
+# A query is a list of words, case-folded like the indexed text. A word
+# ending with "*" matches every term starting with it:
+#   "kitchen light", "kitch*"
+# mode "all" (the default) returns records holding every word, "any"
+# records holding at least one. Hits are ranked with BM25.
+
+_TOKEN = re.compile(r"\w+")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.casefold())
+
+
+class TextIndex:
+    """
+    Inverted index over string fields of a section: term -> {id: term count},
+    kept up to date from the database's mutation events like SortedIndex.
+    Terms are also kept sorted, so a prefix is a bisect away. A lookup costs
+    the length of the postings of its terms, not the size of the section.
+    """
+
+    def __init__(
+        self, section: str, fields: List[str], records: Callable[[], Any]
+    ) -> None:
+        self.section = section
+        self.fields = list(fields)
+        # returns the current records of the section, see add_new_key below
+        self._records = records
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._terms: List[str] = []
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+
+    def _tokens(self, record: Any) -> List[str]:
+        tokens = []
+        if isinstance(record, dict):
+            for field in self.fields:
+                value = get_path(record, field)
+                if isinstance(value, str):
+                    tokens.extend(tokenize(value))
+                elif isinstance(value, list):
+                    for item in value:
+                        if isinstance(item, str):
+                            tokens.extend(tokenize(item))
+        return tokens
+
+    def _add(self, id: str, record: Any, sort_terms: bool = True) -> None:
+        tokens = self._tokens(record)
+        if not tokens:
+            return
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for term, count in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                if sort_terms:
+                    insort(self._terms, term)
+            postings[id] = count
+        self._lengths[id] = len(tokens)
+        self._total_length += len(tokens)
+
+    def _remove(self, id: str, record: Any) -> None:
+        length = self._lengths.pop(id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in set(self._tokens(record)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(id, None)
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect_left(self._terms, term)]
+
+    def rebuild(self, records: Any) -> None:
+        self._postings = {}
+        self._lengths = {}
+        self._total_length = 0
+        if isinstance(records, dict):
+            for id, record in records.items():
+                self._add(id, record, sort_terms=False)
+        self._terms = sorted(self._postings)
+
+    def observe(self, event: Dict) -> None:
+        # PysonDB listener, runs under the database lock
+        if event["section"] != self.section:
+            return
+        op = event["op"]
+        if op == "insert":
+            self._add(event["id"], event["data"])
+        elif op == "update":
+            if self._tokens(event["old"]) != self._tokens(event["data"]):
+                self._remove(event["id"], event["old"])
+                self._add(event["id"], event["data"])
+        elif op == "delete":
+            self._remove(event["id"], event["old"])
+        elif op in ("purge", "add_section"):
+            self.rebuild(None)
+        elif op == "add_new_key" and event["key"] in {f.split(".", 1)[0] for f in self.fields}:
+            # every record now holds the default in an indexed field, rare enough to rebuild
+            self.rebuild(self._records())
+
+    def _expand(self, word: str) -> List[str]:
+        if not word.endswith("*"):
+            return [word] if word in self._postings else []
+        prefix = word[:-1]
+        i = bisect_left(self._terms, prefix)
+        terms = []
+        while i < len(self._terms) and self._terms[i].startswith(prefix):
+            terms.append(self._terms[i])
+            i += 1
+        return terms
+
+    def _parse(self, query: str) -> List[str]:
+        if not isinstance(query, str):
+            raise MalformedQueryError(f"a search query must be of type str and not {type(query)}")
+        words = []
+        for part in query.split():
+            prefix = part.endswith("*")
+            tokens = tokenize(part)
+            if prefix and tokens:
+                tokens[-1] += "*"
+            words.extend(tokens)
+        if not words:
+            raise MalformedQueryError(f"search query {query!r} has no words")
+        return words
+
+    def search(self, query: str, mode: str = "all") -> Dict[str, float]:
+        """
+        The ids matching query with their BM25 score.
+        """
+        if mode not in ("all", "any"):
+            raise MalformedQueryError(f'mode must be "all" or "any" and not {mode!r}')
+        # one {id: count} per word, prefix words sum the counts of their terms
+        matches: List[Dict[str, int]] = []
+        for word in self._parse(query):
+            terms = self._expand(word)
+            if len(terms) == 1:
+                matches.append(self._postings[terms[0]])
+                continue
+            merged: Dict[str, int] = {}
+            for term in terms:
+                for id, count in self._postings[term].items():
+                    merged[id] = merged.get(id, 0) + count
+            matches.append(merged)
+        if mode == "all":
+            # intersect starting from the rarest word
+            smallest = min(matches, key=len)
+            ids: Iterable[str] = [id for id in smallest if all(id in m for m in matches)]
+        else:
+            union: Set[str] = set()
+            for m in matches:
+                union.update(m)
+            ids = union
+        docs = len(self._lengths)
+        average = self._total_length / docs if docs else 0.0
+        idf = [math.log(1 + (docs - len(m) + 0.5) / (len(m) + 0.5)) for m in matches]
+        scores = {}
+        for id in ids:
+            norm = K1 * (1 - B + B * self._lengths[id] / average)
+            score = 0.0
+            for m, weight in zip(matches, idf):
+                count = m.get(id)
+                if count:
+                    score += weight * count * (K1 + 1) / (count + norm)
+            scores[id] = score
+        return scores
+
+    def stats(self) -> Dict:
+        return {"fields": self.fields, "terms": len(self._terms), "records": len(self._lengths)}
+
+
+def rank(scores: Dict[str, float], offset: int, limit: int) -> List[Tuple[str, float]]:
+    """
+    The hits of one page, best first, with a heap of offset + limit entries.
+    """
+    best = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+    return best[offset:]
@@ -0,0 +1,164 @@
+import os
+import shutil
+import weakref
+from collections import OrderedDict
+from itertools import count
+from threading import Event
+from threading import Lock
+from threading import Thread
+from typing import Dict
+from typing import IO
+from typing import List
+from typing import Tuple
+
+try:
+    import ujson as json
+except ImportError:
+    import json as json
+
+
+# sections smaller than this stay in memory, spilling them frees next to nothing
+MIN_SPILL_BYTES = 64 * 1024
+
+_segment_ids = count()
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class SpilledSection:
+    """
+    Stands in for the records of a section that were written to a segment
+    file, a JSON object {id: record}. PysonDB reads it back when the section
+    is accessed. Snapshots taken meanwhile share the same segment, which is
+    removed once the last of them is gone.
+    """
+
+    __slots__ = ("path", "size", "records", "__weakref__")
+
+    def __init__(self, path: str, size: int, records: int) -> None:
+        self.path = path
+        self.size = size
+        self.records = records
+        weakref.finalize(self, _remove, path)
+
+    @classmethod
+    def write(cls, directory: str, records: Dict, size: int) -> "SpilledSection":
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}-{next(_segment_ids)}.json")
+        with open(path, encoding="utf-8", mode="w") as f:
+            json.dump(records, f)
+        return cls(path, size, len(records))
+
+    def load(self) -> Dict:
+        with open(self.path, encoding="utf-8", mode="r") as f:
+            return json.load(f)
+
+    def copy_to(self, f: IO[str]) -> None:
+        # checkpoints copy the segment into the database file without parsing it
+        with open(self.path, encoding="utf-8", mode="r") as segment:
+            shutil.copyfileobj(segment, f)
+
+
+def clear_segments(directory: str) -> None:
+    # segments left behind by a previous run, their data is in the database file
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            _remove(os.path.join(directory, name))
+
+
+class MemoryBudget(Thread):
+    """
+    Keeps the resident size of the registered databases under `limit` bytes
+    by spilling their least recently used sections to segment files.
+
+    PysonDB touches a section on every access (under its own lock, so the
+    LRU has a lock of its own), this thread checks the total every
+    `interval` seconds, or at once after a section was read back.
+    """
+
+    def __init__(self, limit: int, interval: float = 1.0) -> None:
+        super().__init__(name="memory-budget", daemon=True)
+        self.limit = limit
+        self.interval = interval
+        self.spills = 0
+        self.page_ins = 0
+        self._databases: List = []
+        self._lru: "OrderedDict[Tuple[object, str], None]" = OrderedDict()
+        self._lock = Lock()
+        self._wake = Event()
+        self._stop_event = Event()
+
+    def register(self, db) -> None:
+        with self._lock:
+            self._databases.append(db)
+
+    def unregister(self, db) -> None:
+        with self._lock:
+            if db in self._databases:
+                self._databases.remove(db)
+            for key in [k for k in self._lru if k[0] is db]:
+                del self._lru[key]
+
+    def touch(self, db, section: str) -> None:
+        key = (db, section)
+        with self._lock:
+            self._lru[key] = None
+            self._lru.move_to_end(key)
+
+    def paged_in(self) -> None:
+        self.page_ins += 1
+        self._wake.set()
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            databases = list(self._databases)
+        return sum(db.resident_bytes() for db in databases)
+
+    def enforce(self) -> int:
+        """
+        Spills sections, least recently used first, until the databases fit
+        in the budget. The most recently used section always stays.
+        """
+        spilled = 0
+        with self._lock:
+            candidates = len(self._lru) - 1
+        while candidates > 0 and self.resident_bytes() > self.limit:
+            candidates -= 1
+            with self._lock:
+                if len(self._lru) <= 1:
+                    break
+                (db, section), _ = self._lru.popitem(last=False)
+            # a section that is too small, gone or written meanwhile is
+            # tracked again on its next access
+            if db.section_bytes(section) >= MIN_SPILL_BYTES and db.spill(section):
+                spilled += 1
+                self.spills += 1
+        return spilled
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.enforce()
+            except Exception as e:
+                print(f"memory budget enforcement failed: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "limit_bytes": self.limit,
+            "resident_bytes": self.resident_bytes(),
+            "spills": self.spills,
+            "page_ins": self.page_ins,
+        }
+
+    def close(self) -> None:
+        self._stop_event.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join()
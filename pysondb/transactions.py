@@ -0,0 +1,81 @@
+from typing import Dict
+from typing import List
+
+from pysondb.db import PysonDB
+
+
+# commands a connection may run between BEGIN and COMMIT / ROLLBACK
+TRANSACTION_COMMANDS = {
+    "ADD",
+    "ADD_MANY",
+    "ADD_NEW_KEY",
+    "ADD_SECTION",
+    "AGGREGATE",
+    "FIND",
+    "GET_ALL",
+    "GET_ALL_BY_SECTION",
+    "GET_BY_ID",
+    "GET_BY_QUERY",
+    "HEALTH",
+    "LOOKUP",
+    "UPDATE_BY_ID",
+    "UPDATE_BY_QUERY",
+    "DELETE_BY_ID",
+    "DELETE_BY_QUERY",
+    "PURGE",
+    "USE_SECTION",
+    "COMMIT",
+    "ROLLBACK",
+    "STATS",
+}
+
+
+class Transaction(PysonDB):
+    """
+    A connection's private copy of a database between BEGIN and COMMIT.
+
+    It starts from a snapshot of the database, which is cheap since records
+    are copy-on-write, so reads see that snapshot plus the transaction's own
+    writes. Writes are recorded as mutation events and applied to the
+    database in one step by apply(), which fails with
+    TransactionConflictError if another client wrote the same records.
+    """
+
+    def __init__(self, db: PysonDB) -> None:
+        # the copy lives in memory only, a RemoteDB (pre-fork mode) has no file here
+        super().__init__(getattr(db, "filename", ""), auto_update=False)
+        self.db = db
+        if isinstance(db, PysonDB):
+            # spilled sections are only read if the transaction uses them
+            self.base_seq, view = db.snapshot_with_seq(materialize=False)
+        else:
+            self.base_seq, view = db.snapshot_with_seq()
+        self._base_keys: Dict[str, List[str]] = {k: list(v) for k, v in view["keys"].items()}
+        self._au_memory = view
+        self.events: List[Dict] = []
+        self._listeners.append(self.events.append)
+        self._schema_conf = dict(getattr(db, "_schema_conf", {}))
+        self._ttl = dict(getattr(db, "_ttl", {}))
+        # new records get their ids from the database's own generator
+        generator = getattr(db, "_id_generator", None)
+        if generator is not None:
+            self._id_generator = generator
+
+    def commit(self) -> None:
+        # called by the command handlers after every write, nothing is
+        # persisted before the transaction is applied
+        pass
+
+    def checkpoint(self) -> bool:
+        return False
+
+    def close(self) -> None:
+        pass
+
+    def apply(self) -> int:
+        """
+        Applies the buffered writes to the database, returns its seq afterwards.
+        """
+        if not self.events:
+            return self.db.seq
+        return self.db.commit_transaction(self.events, self.base_seq, self._base_keys)
@@ -0,0 +1,217 @@
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from pysondb.errors import MalformedQueryError
+from pysondb.errors import MalformedUpdateError
+from pysondb.errors import SchemaTypeError
+
+
+# Update documents change single fields instead of replacing whole records.
+# Every key is an operator mapping dotted paths to arguments:
+#   {"$set": {"states.on": false}, "$inc": {"visits": 1},
+#    "$push": {"tags": "new"}, "$pull": {"tags": "old"}, "$unset": {"traits.x": true}}
+# Records are shared with snapshots (see PysonDB), so an update never mutates
+# them: only the containers along the changed paths are copied.
+
+UPDATE_OPERATORS = ("$set", "$unset", "$inc", "$push", "$pull")
+# the operators creating the missing objects along their path, $unset and
+# $pull leave a record without the path unchanged
+CREATING_OPERATORS = ("$set", "$inc", "$push")
+
+
+def copy_value(value: Any) -> Any:
+    """
+    A copy of a JSON value sharing no container with it.
+    """
+    if isinstance(value, dict):
+        return {k: copy_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_value(v) for v in value]
+    return value
+
+
+def is_update_spec(new_data: Any) -> bool:
+    return isinstance(new_data, dict) and bool(new_data) and all(
+        isinstance(k, str) and k.startswith("$") for k in new_data
+    )
+
+
+def _split(path: Any, error: type = MalformedUpdateError) -> List[str]:
+    if not isinstance(path, str) or not path or "" in path.split("."):
+        raise error(f"invalid field path {path!r}")
+    return path.split(".")
+
+
+def _child(container: Any, part: str, create: bool, copied: Set[int]) -> Any:
+    """
+    The child container at part, copied once per update so it can be written.
+    """
+    if isinstance(container, dict):
+        value = container.get(part)
+        if value is None:
+            if not create:
+                return None
+            value = {}
+        elif not isinstance(value, (dict, list)):
+            raise SchemaTypeError(f"field {part!r} is a {type(value).__name__}, not an object")
+        elif id(value) not in copied:
+            value = dict(value) if isinstance(value, dict) else list(value)
+        container[part] = value
+    elif isinstance(container, list) and part.isdigit() and int(part) < len(container):
+        value = container[int(part)]
+        if not isinstance(value, (dict, list)):
+            raise SchemaTypeError(f"element {part} is a {type(value).__name__}, not an object")
+        if id(value) not in copied:
+            value = dict(value) if isinstance(value, dict) else list(value)
+            container[int(part)] = value
+    else:
+        raise SchemaTypeError(f"cannot address {part!r} inside a {type(container).__name__}")
+    copied.add(id(value))
+    return value
+
+
+def _slot(container: Any, part: str) -> Tuple[Any, Any]:
+    if isinstance(container, list):
+        if not part.isdigit() or int(part) >= len(container):
+            raise SchemaTypeError(f"list index {part!r} is out of range")
+        return int(part), container[int(part)]
+    return part, container.get(part)
+
+
+def _set(value: Any, arg: Any) -> Any:
+    return arg
+
+
+def _inc(value: Any, arg: Any) -> Any:
+    if value is None:
+        return arg
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise SchemaTypeError(f"$inc needs a number, the field holds a {type(value).__name__}")
+    return value + arg
+
+
+def _push(value: Any, arg: Any) -> Any:
+    items = arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]
+    if value is None:
+        return list(items)
+    if not isinstance(value, list):
+        raise SchemaTypeError(f"$push needs a list, the field holds a {type(value).__name__}")
+    return value + list(items)
+
+
+def _pull(value: Any, arg: Any) -> Any:
+    if not isinstance(value, list):
+        raise SchemaTypeError(f"$pull needs a list, the field holds a {type(value).__name__}")
+    if isinstance(arg, dict) and "$in" in arg:
+        return [v for v in value if v not in arg["$in"]]
+    return [v for v in value if v != arg]
+
+
+_APPLY: Dict[str, Callable[[Any, Any], Any]] = {
+    "$set": _set,
+    "$inc": _inc,
+    "$push": _push,
+    "$pull": _pull,
+}
+
+
+def _check_arg(op: str, path: str, arg: Any) -> None:
+    if op == "$inc" and (isinstance(arg, bool) or not isinstance(arg, (int, float))):
+        raise MalformedUpdateError(f"$inc for {path!r} expects a number")
+    if op == "$push" and isinstance(arg, dict) and "$each" in arg and not isinstance(arg["$each"], list):
+        raise MalformedUpdateError(f"$each for {path!r} expects a list")
+    if op == "$pull" and isinstance(arg, dict) and "$in" in arg and not isinstance(arg["$in"], list):
+        raise MalformedUpdateError(f"$in for {path!r} expects a list")
+
+
+def update_keys(spec: Dict) -> List[str]:
+    """
+    The top level keys an update document writes, to check them against the section keys.
+    """
+    return sorted({_split(path)[0] for fields in spec.values() for path in fields})
+
+
+def compile_update(spec: Dict) -> Callable[[Dict], Dict]:
+    """
+    Turns an update document into a function returning the updated copy of a record.
+    """
+    steps = []
+    for op, fields in spec.items():
+        if op not in UPDATE_OPERATORS:
+            raise MalformedUpdateError(f"unknown update operator {op!r}")
+        if not isinstance(fields, dict) or not fields:
+            raise MalformedUpdateError(f"{op} expects an object of field paths")
+        for path, arg in fields.items():
+            parts = _split(path)
+            if op == "$unset" and len(parts) == 1:
+                # every record of a section has the same keys
+                raise MalformedUpdateError(f"$unset cannot remove the top level key {path!r}")
+            _check_arg(op, path, arg)
+            steps.append((op, parts, arg))
+
+    def apply(record: Dict) -> Dict:
+        new = dict(record)
+        copied = {id(new)}
+        for op, parts, arg in steps:
+            container = new
+            for part in parts[:-1]:
+                container = _child(container, part, op in CREATING_OPERATORS, copied)
+                if container is None:
+                    break
+            if container is None:
+                continue
+            key, value = _slot(container, parts[-1])
+            if op == "$pull" and value is None:
+                continue
+            if op == "$unset":
+                if isinstance(container, dict):
+                    container.pop(key, None)
+                else:
+                    container[key] = None
+                continue
+            container[key] = _APPLY[op](value, arg)
+        return new
+
+    return apply
+
+
+def compile_projection(fields: Optional[List[str]]) -> Optional[Callable[[Dict], Dict]]:
+    """
+    Turns a list of dotted paths into a function copying only those parts of a
+    record. Lists of objects are projected element by element.
+    """
+    if fields is None:
+        return None
+    if not isinstance(fields, list):
+        raise MalformedQueryError(f"fields must be a list of field paths and not {type(fields)}")
+    tree: Dict = {}
+    for path in fields:
+        node = tree
+        parts = _split(path, MalformedQueryError)
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if child is True:
+                break
+            node = child
+        else:
+            node[parts[-1]] = True
+
+    def project(value: Any, node: Dict) -> Any:
+        if isinstance(value, list):
+            return [project(v, node) for v in value if isinstance(v, (dict, list))]
+        out = {}
+        for key, sub in node.items():
+            if key in value:
+                child = value[key]
+                if sub is True:
+                    out[key] = child
+                elif isinstance(child, (dict, list)):
+                    out[key] = project(child, sub)
+        return out
+
+    return lambda record: project(record, tree)
@@ -5,12 +5,6 @@ from typing import List
 from typing import Tuple
 from typing import Union
 
-try:
-    from prettytable import PrettyTable
-    PRETTYTABLE = True
-except ImportError:
-    PRETTYTABLE = False
-
 from pysondb.db_types import DBSchemaType
 from pysondb.db_types import SingleDataType
 
@@ -49,7 +43,10 @@ def migrate(old_db_data: OldDataType) -> NewDataType:
 
 
 def print_db_as_table(data: NewDataType) -> Tuple[str, int]:
-    if not PRETTYTABLE:
+    # only the show command needs prettytable, import it there
+    try:
+        from prettytable import PrettyTable
+    except ImportError:
         return 'install prettytable (pip3 install prettytable) to run the following command', 1
     if 'version' not in data:
         return 'the DB must be a v2 DB, you can use the migrate command to the convert your DB', 1
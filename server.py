@@ -1,12 +1,31 @@
 
 
 
+import argparse
+import json
+import os
+
 from pysondb.pysondb_server import ClientTCPHandler,SocketServer
 
 
 def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='./config.json')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of pre-forked worker processes sharing the port '
+                             '(default: prefork.workers of the config, else 1)')
+    args = parser.parse_args()
+    workers = args.workers
+    if workers is None:
+        with open(args.config, encoding='utf-8') as f:
+            prefork = json.load(f).get('prefork', {})
+        # prefork.workers 0 means one per cpu, like in serve_prefork
+        workers = (prefork['workers'] or os.cpu_count() or 1) if 'workers' in prefork else 1
+    if workers > 1:
+        from pysondb.prefork import serve_prefork
+        return serve_prefork(args.config, workers)
     try:
-        server = SocketServer() 
+        server = SocketServer(args.config) 
         server.serve_forever()
     except:
         pass
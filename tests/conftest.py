@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from pysondb.client import Connection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def until(check, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if check():
+                return
+        except (OSError, ConnectionError):
+            pass
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.05)
+
+
+class ServerProcess:
+    """
+    A SocketServer in its own process, on a copy of the repo's config and
+    databases. patch(config) adjusts the config before the start.
+    """
+
+    def __init__(self, directory, patch=None):
+        self.directory = directory
+        self.port = free_port()
+        shutil.copytree(os.path.join(ROOT, "database"), os.path.join(directory, "database"))
+        with open(os.path.join(ROOT, "config.json"), encoding="utf-8") as f:
+            config = json.load(f)
+        config["port"] = self.port
+        config["prewarm"]["enabled"] = False
+        for user in config["users"]:
+            user.pop("rate_limit", None)
+        if patch is not None:
+            patch(config)
+        self.config_file = os.path.join(directory, "config.json")
+        with open(self.config_file, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        self.process = None
+
+    def start(self):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", "from pysondb.pysondb_server import SocketServer; SocketServer().serve_forever()"],
+            cwd=self.directory,
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        until(lambda: self.connect().close() or True)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+    def connect(self, **kwargs):
+        kwargs.setdefault("dbname", "testfile")
+        return Connection("localhost", self.port, "test", "password", **kwargs)
+
+
+@pytest.fixture
+def start_server(tmp_path):
+    # start_server(patch=None) -> a started ServerProcess, stopped after the test
+    started = []
+
+    def start(patch=None):
+        server = ServerProcess(str(tmp_path / f"server{len(started)}"), patch)
+        server.start()
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        if server.process.poll() is None:
+            server.stop()
+
+
+@pytest.fixture
+def server(start_server):
+    return start_server()
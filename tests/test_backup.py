@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from pysondb.backup import BackupManager
+from pysondb.backup import restore
+from pysondb.db import PysonDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    db.add("s", {"n": 0})
+    return db
+
+
+def test_backups_after_the_first_are_incremental(db, tmp_path):
+    backups = BackupManager(str(tmp_path / "backups"))
+    assert backups.backup("db", db)["type"] == "full"
+    id = db.add("s", {"n": 1})
+    assert backups.backup("db", db)["type"] == "incremental"
+    assert restore(os.path.join(backups.directory, "db"))["s"][id] == {"n": 1}
+
+
+@pytest.mark.parametrize("reload", ["force_load", "load_snapshot"])
+def test_reload_makes_the_next_backup_full(db, tmp_path, reload):
+    backups = BackupManager(str(tmp_path / "backups"))
+    backups.backup("db", db)
+    db.add("s", {"n": 1})
+    data = {"version": 2, "keys": {"s": ["n"]}, "s": {"1": {"n": 2}}}
+    if reload == "force_load":
+        db.force_load(data)
+    else:
+        db.load_snapshot(data, 100)
+    point = backups.backup("db", db)
+    assert point["type"] == "full"
+    assert restore(os.path.join(backups.directory, "db"))["s"] == {"1": {"n": 2}}
@@ -0,0 +1,80 @@
+import threading
+import time
+from queue import Queue
+
+from pysondb.changefeed import ChangeDispatcher
+from pysondb.changefeed import Subscriber
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _event(seq):
+    return {"seq": seq, "op": "insert", "section": "s", "id": str(seq), "data": {"n": seq}}
+
+
+def test_overflow_does_not_deadlock_the_dispatcher():
+    dispatcher = ChangeDispatcher()
+    blocked = threading.Event()
+    # the pusher thread never gets past the first message, so the queue fills up
+    subscriber = Subscriber(lambda message: blocked.wait(), max_pending=1)
+    overflowed = []
+    subscriber.on_overflow = overflowed.append
+    sub = dispatcher.subscribe(subscriber, "db", "s")
+    other = Subscriber(lambda message: None)
+    kept = dispatcher.subscribe(other, "db", "s")
+
+    for seq in range(1, 10):
+        dispatcher.publish("db", _event(seq))
+
+    assert _wait(lambda: dispatcher.stats()["last_seq"].get("db") == 9)
+    assert overflowed == [subscriber]
+    # the dispatcher dropped the overflowed subscriber and released its lock
+    assert dispatcher._lock.acquire(timeout=2)
+    dispatcher._lock.release()
+    assert dispatcher.unsubscribe(sub.watch_id) is False
+    # connection teardown
+    assert dispatcher.unsubscribe_all(subscriber) == []
+    assert dispatcher.unsubscribe(kept.watch_id) is True
+    blocked.set()
+
+
+def test_events_after_an_overflow_are_still_dispatched():
+    dispatcher = ChangeDispatcher()
+    blocked = threading.Event()
+    slow = Subscriber(lambda message: blocked.wait(), max_pending=1)
+    slow.on_overflow = lambda subscriber: None
+    dispatcher.subscribe(slow, "db", "s")
+    received = []
+    dispatcher.subscribe(Subscriber(received.append), "db", "s")
+
+    for seq in range(1, 6):
+        dispatcher.publish("db", _event(seq))
+    assert _wait(lambda: len(received) == 5)
+
+    dispatcher.publish("db", _event(6))
+    assert _wait(lambda: len(received) == 6)
+    assert dispatcher.stats()["subscriptions"] == 1
+    blocked.set()
+
+
+def test_events_queued_before_the_subscription_are_not_delivered():
+    dispatcher = ChangeDispatcher()
+    # the dispatcher thread waits on the old queue, events published to the
+    # new one stay queued until it is woken up
+    waiting, dispatcher._events = dispatcher._events, Queue()
+    for seq in range(1, 5):
+        dispatcher.publish("db", dict(_event(seq), run_id="run"))
+    # a reload renumbers the events, those of the new run are all new
+    dispatcher.publish("db", dict(_event(2), run_id="reloaded"))
+    received = []
+    dispatcher.subscribe(Subscriber(received.append), "db", "s", current_seq=3, current_run_id="run")
+    waiting.put(dispatcher._events.get())
+    assert _wait(lambda: len(received) == 2)
+    assert [(m["data"]["run_id"], m["data"]["seq"]) for m in received] == [("run", 4), ("reloaded", 2)]
@@ -0,0 +1,149 @@
+import asyncio
+import socket
+from threading import Thread
+
+import pytest
+
+from pysondb import errors
+from pysondb.client import _Commands
+from pysondb.client import AsyncConnection
+from pysondb.client import ConnectionPool
+from pysondb.client import server_error
+
+RECORD = {"name": "ada", "age": 36, "foo": "x"}
+
+
+def test_round_trip(server):
+    with server.connect(encrypt=True) as conn:
+        id = conn.add("data", RECORD)
+        assert conn.get_by_id("data", id) == RECORD
+        assert conn.get_by_id("data", id, fields=["name"]) == {"name": "ada"}
+        assert id in conn.find("data", {"name": "ada"})
+        conn.update_by_id("data", id, {"age": 37})
+        assert conn.get_by_id("data", id)["age"] == 37
+        conn.delete_by_id("data", id)
+        with pytest.raises(errors.IdDoesNotExistError):
+            conn.get_by_id("data", id)
+
+
+def test_pipeline_replies_in_order(server):
+    with server.connect() as conn:
+        id = conn.add("data", RECORD)
+        with conn.pipeline() as p:
+            p.get_by_id("data", id)
+            p.get_by_id("data", "missing")
+            p.find("data", {"name": "ada"})
+            record, missing, found = p.execute(raise_on_error=False)
+        assert record == RECORD
+        assert isinstance(missing, errors.IdDoesNotExistError)
+        assert id in found
+        with conn.pipeline() as p:
+            p.get_by_id("data", "missing")
+            p.add("data", RECORD)
+            with pytest.raises(errors.IdDoesNotExistError):
+                p.execute()
+        # the commands after the failed one still ran
+        assert len(conn.find("data", {"name": "ada"})) == 2
+
+
+def test_transaction(server):
+    with server.connect() as conn:
+        conn.begin()
+        assert conn.in_transaction
+        id = conn.add("data", RECORD)
+        conn.rollback()
+        assert not conn.in_transaction
+        with pytest.raises(errors.IdDoesNotExistError):
+            conn.get_by_id("data", id)
+        conn.begin()
+        id = conn.add("data", RECORD)
+        conn.commit()
+        assert conn.get_by_id("data", id) == RECORD
+
+
+def test_reconnects_after_a_lost_connection(server):
+    with server.connect() as conn:
+        conn.use_section("data")
+        conn._sock.shutdown(socket.SHUT_RDWR)
+        # a read is retried on a new connection, with the database back
+        assert conn.get_all_by_section("data")
+        conn._sock.shutdown(socket.SHUT_RDWR)
+        conn.health()
+        # a write that could not be sent is retried too, once
+        conn._sock.shutdown(socket.SHUT_RDWR)
+        conn.add("data", RECORD)
+        assert len(conn.find("data", {"name": "ada"})) == 1
+        conn.begin()
+        conn._sock.shutdown(socket.SHUT_RDWR)
+        # the server dropped the transaction with the connection
+        with pytest.raises(ConnectionError):
+            conn.get_all_by_section("data")
+        assert not conn.in_transaction
+
+
+def test_pool_shared_by_threads(server):
+    with ConnectionPool(port=server.port, user="test", password="password", dbname="testfile", size=2) as pool:
+        ids = []
+
+        def add(i):
+            ids.append(pool.add("data", {"name": str(i), "age": i, "foo": "pool"}))
+
+        threads = [Thread(target=add, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert set(pool.find("data", {"foo": "pool"})) == set(ids)
+        assert pool.pool_stats()["open"] <= 2
+        with pytest.raises(TypeError):
+            pool.begin()
+        with pool.connection() as conn:
+            conn.begin()
+            conn.add("data", RECORD)
+            conn.commit()
+
+
+def test_async_connection(server):
+    async def run():
+        async with await AsyncConnection.open(
+            port=server.port, user="test", password="password", dbname="testfile", encrypt=True
+        ) as conn:
+            ids = await asyncio.gather(*(conn.add("data", {"name": str(i), "age": i, "foo": "async"}) for i in range(10)))
+            records = await asyncio.gather(*(conn.get_by_id("data", id) for id in ids))
+            assert [r["age"] for r in records] == list(range(10))
+            with pytest.raises(errors.IdDoesNotExistError):
+                await conn.get_by_id("data", "missing")
+
+    asyncio.run(run())
+
+
+def test_profile(server):
+    with server.connect() as conn:
+        assert "stacks" in conn.profile(seconds=0.1, interval_ms=10)
+
+
+def test_server_error():
+    assert isinstance(server_error({"error": "IdDoesNotExistError", "data": "m"}), errors.IdDoesNotExistError)
+    assert isinstance(server_error({"error": "KeyError", "data": "m"}), KeyError)
+    # unknown, not an exception, or not built from a message alone
+    for name in ("NoSuchError", "print", "UnicodeDecodeError"):
+        e = server_error({"error": name, "data": "m"})
+        assert type(e) is errors.ServerError
+        assert name in str(e)
+
+
+def test_commands_need_a_call():
+    with pytest.raises(TypeError):
+        _Commands()
+
+
+def test_empty_fields_project_to_no_fields(server):
+    with server.connect() as conn:
+        id = conn.add("data", RECORD)
+        # twice, the second reply could come from the JSON cache
+        for _ in range(2):
+            assert conn.get_by_id("data", id, fields=[]) == {}
+            assert conn.find("data", {"name": "ada"}, fields=[]) == {id: {}}
+        # and the projections were not cached as the records
+        assert conn.get_by_id("data", id) == RECORD
+        assert conn.find("data", {"name": "ada"}) == {id: RECORD}
@@ -0,0 +1,67 @@
+import pytest
+
+from pysondb.db import PysonDB
+
+pytest.importorskip("numpy")
+
+BIG = 2 ** 53
+
+VALUES = [0, 1, -1, 2.5, True, None, "7", BIG - 1, BIG, BIG + 1, BIG + 2, -BIG - 1, 10 ** 20, 1e20]
+
+FILTERS = [
+    {},
+    {"n": BIG},
+    {"n": BIG + 1},
+    {"n": {"$gt": BIG}},
+    {"n": {"$gte": BIG + 1}},
+    {"n": {"$lt": -BIG}},
+    {"n": {"$ne": BIG + 2}},
+    {"n": {"$in": [BIG + 1, 1]}},
+    {"n": {"$nin": [BIG, 0]}},
+    {"n": {"$gt": 0, "$lt": 3}},
+    {"$or": [{"n": BIG + 2}, {"m": 1}]},
+    {"n": {"$gt": 0}, "m": {"$lte": 2}},
+]
+
+
+def _db(tmp_path, values):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    db.add_many("s", [{"n": v, "m": i % 4} for i, v in enumerate(values)])
+    return db
+
+
+def _compare(db):
+    vectorized = [(db.find("s", f), db.aggregate("s", "n", f)) for f in FILTERS]
+    db.drop_columns("s")
+    row_wise = [(db.find("s", f), db.aggregate("s", "n", f)) for f in FILTERS]
+    for spec, (found, agg), (expected, expected_agg) in zip(FILTERS, vectorized, row_wise):
+        assert found == expected, spec
+        assert agg["count"] == expected_agg["count"], spec
+        assert agg["min"] == expected_agg["min"] and agg["max"] == expected_agg["max"], spec
+        assert agg["sum"] == pytest.approx(expected_agg["sum"]), spec
+        assert agg["avg"] == pytest.approx(expected_agg["avg"]), spec
+
+
+def test_vectorized_matches_row_wise(tmp_path):
+    db = _db(tmp_path, VALUES)
+    assert db.create_columns("s", ["n", "m"])
+    assert db.columns()["s"]["inexact"] == ["n"]
+    _compare(db)
+
+
+def test_large_int_written_after_the_columns(tmp_path):
+    db = _db(tmp_path, [0, 1, BIG])
+    assert db.create_columns("s", ["n", "m"])
+    assert db.columns()["s"]["inexact"] == []
+    db.add("s", {"n": BIG + 1, "m": 0})
+    assert db.columns()["s"]["inexact"] == ["n"]
+    _compare(db)
+
+
+def test_large_operands_on_exact_columns(tmp_path):
+    db = _db(tmp_path, [0, 1, BIG, 2.0 ** 60])
+    assert db.create_columns("s", ["n", "m"])
+    assert db.find("s", {"n": 2 ** 60 + 1}) == {}
+    assert len(db.find("s", {"n": {"$lt": 2 ** 60 + 1}})) == 4
+    _compare(db)
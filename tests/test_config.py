@@ -0,0 +1,91 @@
+import json
+import os
+
+import pytest
+
+from pysondb.config import Config
+from pysondb.config import obscure
+from pysondb.errors import InvalidUserError
+
+USERS = [
+    {"user": "test", "passwd": str(obscure(b"testpasswordtest"), "utf-8"), "access": ["a"]},
+]
+
+
+@pytest.fixture
+def filename(tmp_path):
+    filename = str(tmp_path / "config.json")
+    _write(filename, {"databases": [{"name": "a", "filename": "a.json"}], "users": USERS})
+    return filename
+
+
+def _write(filename, config):
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    # a distinct mtime even on coarse clocks
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+def _read(filename):
+    with open(filename, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _credentials(user, password):
+    return "c" + str(obscure(bytes(json.dumps({"u": user, "p": password}), "utf-8")), "utf-8")
+
+
+def test_saves_are_delayed_and_coalesced(filename):
+    config = Config(filename, reload_interval=0, write_delay=60)
+    config.add_db("b", "test")
+    config.add_db("c", "test")
+    assert [d["name"] for d in _read(filename)["databases"]] == ["a"]
+    config.flush()
+    saved = _read(filename)
+    assert [d["name"] for d in saved["databases"]] == ["a", "b", "c"]
+    assert saved["users"][0]["access"] == ["a", "b", "c"]
+
+
+def test_save_keeps_external_edits(filename):
+    config = Config(filename, reload_interval=0, write_delay=60)
+    config.add_db("b", "test")
+    # edited by hand before the delayed save
+    edited = _read(filename)
+    edited["databases"].append({"name": "manual", "filename": "manual.json"})
+    edited["port"] = 1234
+    _write(filename, edited)
+    config.flush()
+    saved = _read(filename)
+    assert [d["name"] for d in saved["databases"]] == ["a", "manual", "b"]
+    assert saved["port"] == 1234
+    assert config.exists("manual") and config.exists("b")
+
+
+def test_reload_keeps_unsaved_changes(filename, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    open("a.json", "w").close()
+    config = Config(filename, reload_interval=0, write_delay=60)
+    config.add_db("b", "test")
+    config.del_db("a")
+    edited = _read(filename)
+    edited["port"] = 1234
+    _write(filename, edited)
+    assert config.reload()
+    assert config.get_config()["port"] == 1234
+    assert config.exists("b") and not config.exists("a")
+    config.flush()
+    assert [d["name"] for d in _read(filename)["databases"]] == ["b"]
+
+
+def test_auth_follows_reloads(filename):
+    config = Config(filename, reload_interval=0)
+    assert config.auth_user(_credentials("test", "password"))["access"] == ["a"]
+    # the second time from the cache
+    assert config.auth_user(_credentials("test", "password"))["user"] == "test"
+    with pytest.raises(InvalidUserError):
+        config.auth_user(_credentials("test", "wrong"))
+    _write(filename, {"databases": [], "users": []})
+    config.reload()
+    with pytest.raises(InvalidUserError):
+        config.auth_user(_credentials("test", "password"))
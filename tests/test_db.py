@@ -0,0 +1,134 @@
+import gc
+import json
+import weakref
+from threading import Thread
+
+import pytest
+
+from pysondb.db import PysonDB
+from pysondb.loader import section_size
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    return db
+
+
+def test_added_records_are_copied(db):
+    record = {"name": "a", "tags": ["x"]}
+    id = db.add("s", record)
+    record["name"] = "b"
+    record["tags"].append("y")
+    many = [{"name": "c", "tags": ["x"]}]
+    (other,) = db.add_many("s", many)
+    many[0]["tags"].append("y")
+    assert db.get_by_id("s", id) == {"name": "a", "tags": ["x"]}
+    assert db.get_by_id("s", other) == {"name": "c", "tags": ["x"]}
+
+
+def test_returned_records_are_copied(db):
+    id = db.add("s", {"name": "a", "tags": ["x"]})
+    db.get_by_id("s", id)["tags"].append("y")
+    db.get_all_by_section("s")[id]["name"] = "b"
+    db.find("s", {"name": "a"})[id]["tags"].append("z")
+    db.get_by_query("s", "lambda r: True")[id]["name"] = "c"
+    db.get_all()["s"][id]["name"] = "d"
+    db.update_by_id("s", id, {"name": "a"})["tags"].append("w")
+    assert db.get_by_id("s", id) == {"name": "a", "tags": ["x"]}
+
+
+def test_updates_are_copied(db):
+    id = db.add("s", {"name": "a", "tags": ["x"]})
+    tags = ["y"]
+    db.update_by_id("s", id, {"tags": tags})
+    tags.append("z")
+    db.update_by_query("s", "lambda r: True", {"$set": {"tags": tags}})
+    tags.append("w")
+    assert db.get_by_id("s", id) == {"name": "a", "tags": ["y", "z"]}
+
+
+def test_copy_false_shares_the_stored_record(db):
+    id = db.add("s", {"name": "a"})
+    assert db.get_by_id("s", id, copy=False) is db.get_by_id("s", id, copy=False)
+    assert db.get_by_id("s", id) is not db.get_by_id("s", id, copy=False)
+
+
+def test_interned_values_stay_shared_safely(db):
+    db.enable_interning()
+    first = db.add("s", {"name": "a", "tags": ["x"]})
+    second = db.add("s", {"name": "b", "tags": ["x"]})
+    db.get_by_id("s", first)["tags"].append("y")
+    assert db.get_by_id("s", second) == {"name": "b", "tags": ["x"]}
+
+
+def test_closed_checkpointer_releases_the_database(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False, checkpoint_interval=60)
+    ref = weakref.ref(db)
+    db.close()
+    del db
+    gc.collect()
+    assert ref() is None
+
+
+def test_memory_stats_are_kept_without_a_budget(db, monkeypatch):
+    ids = db.add_many("s", [{"name": str(i), "tags": ["x"] * i} for i in range(20)])
+    db.update_by_id("s", ids[0], {"tags": ["y"] * 50})
+    db.delete_by_id("s", ids[1])
+    db.add_section("t")
+    db.add("t", {"a": 1})
+    expected = sum(section_size(db.get_all_by_section(s, copy=False)) for s in ("s", "t"))
+    # no walk over the records, the sizes follow the mutations
+    monkeypatch.setattr("pysondb.db.section_size", None)
+    # the dicts of the sections grow in steps that are not followed
+    assert db.memory_stats()["resident_bytes"] == pytest.approx(expected, rel=0.05)
+
+
+def _on_disk(db):
+    with open(db.filename, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_commit_waits_for_the_checkpointer(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False, checkpoint_interval=60)
+    db.add_section("s")
+    ids = []
+
+    def add(i):
+        ids.append(db.add("s", {"n": i}))
+        db.commit()
+
+    threads = [Thread(target=add, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert set(_on_disk(db)["s"]) == set(ids)
+    db.close()
+
+
+def test_failed_checkpoint_fails_the_commit(tmp_path, monkeypatch):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False, checkpoint_interval=60)
+    db.add_section("s")
+
+    def fail():
+        raise OSError("disk full")
+
+    monkeypatch.setattr(db, "checkpoint", fail)
+    with pytest.raises(OSError):
+        db.commit()
+    monkeypatch.undo()
+    db.commit()
+    assert "s" in _on_disk(db)
+    db.close()
+
+
+def test_empty_fields_project_to_no_fields(db):
+    id = db.add("s", {"name": "ada", "tags": ["x"]})
+    db.create_text_index("s", ["name"])
+    assert db.get_by_id("s", id, fields=[]) == {}
+    assert db.find("s", {}, fields=[]) == {id: {}}
+    assert db.get_all_by_section("s", fields=[]) == {id: {}}
+    assert db.search("s", "ada", fields=[])["hits"][0]["record"] == {}
+    assert "record" not in db.search("s", "ada")["hits"][0]
@@ -0,0 +1,80 @@
+import json
+import time
+
+import pytest
+
+from pysondb.db import PysonDB
+from pysondb.errors import IdDoesNotExistError
+from tests.conftest import until
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    db.add("s", {"n": 0, "expires": None})
+    db.set_ttl("s", "expires")
+    return db
+
+
+def _add(db, n, expires):
+    return db.add("s", {"n": n, "expires": expires})
+
+
+def test_expired_records_are_hidden(db):
+    past = _add(db, 1, time.time() - 10)
+    future = _add(db, 2, time.time() + 3600)
+    with pytest.raises(IdDoesNotExistError):
+        db.get_by_id("s", past)
+    assert db.get_by_id("s", future)["n"] == 2
+    assert sorted(r["n"] for r in db.find("s", {}).values()) == [0, 2]
+    assert past not in db.get_all_by_section("s")
+    assert db.aggregate("s", "n")["count"] == 2
+
+
+def test_expire_deletes_due_records_in_batches(db):
+    events = []
+    db.add_listener(events.append)
+    ids = [_add(db, i, time.time() - 10 + i) for i in range(5)]
+    kept = _add(db, 9, time.time() + 3600)
+    assert db.next_expiry() == pytest.approx(time.time() - 10, abs=1)
+    assert db.expire(limit=3) == 3
+    assert db.expire(limit=3) == 2
+    assert db.expire() == 0
+    remaining = set(db.get_all_by_section("s"))
+    assert len(remaining) == 2 and kept in remaining and not remaining & set(ids)
+    deleted = [e for e in events if e["op"] == "delete"]
+    assert [e["id"] for e in deleted] == ids
+    assert all(e["expired"] for e in deleted)
+
+
+def test_new_expiry_makes_the_old_entry_stale(db):
+    id = _add(db, 1, time.time() - 10)
+    db.update_by_id("s", id, {"expires": time.time() + 3600})
+    assert db.expire() == 0
+    assert db.get_by_id("s", id)["n"] == 1
+    db.update_by_id("s", id, {"expires": None})
+    assert db.next_expiry() is not None
+    assert db.expire() == 0
+
+
+def test_default_ttl_stamps_new_records(db):
+    db.set_ttl("s", "expires", 60)
+    id = _add(db, 1, None)
+    assert db.get_by_id("s", id)["expires"] == pytest.approx(time.time() + 60, abs=5)
+    # an explicit expiry is kept
+    assert db.get_by_id("s", _add(db, 2, 5e9))["expires"] == 5e9
+
+
+def test_sweeper_deletes_and_commits(db):
+    def on_disk():
+        with open(db.filename, encoding="utf-8") as f:
+            return json.load(f)["s"]
+
+    id = _add(db, 1, time.time() + 0.2)
+    db.commit()
+    assert id in on_disk()
+    db.start_sweeper(interval=0.05)
+    until(lambda: id not in on_disk(), timeout=5)
+    assert len(on_disk()) == 1
+    db.close()
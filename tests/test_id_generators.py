@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from pysondb.db import PysonDB
+from pysondb.errors import MalformedIdGeneratorError
+from pysondb.id_generators import ID_WIDTH
+from pysondb.id_generators import make_id_generator
+from pysondb.id_generators import TimeOrderedIdGenerator
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    # legacy ids: random, 18 digits
+    db.add_many("s", [{"n": i} for i in range(20)])
+    return db
+
+
+@pytest.mark.parametrize("conf", [{"type": "counter"}, {"type": "snowflake", "node": 3}])
+def test_ids_sort_in_insertion_order(db, conf):
+    legacy = set(db.get_all_by_section("s"))
+    db.use_id_generator(conf)
+    ids = [db.add("s", {"n": i}) for i in range(5)] + db.add_many("s", [{"n": i} for i in range(5, 10)])
+    assert all(len(id) == ID_WIDTH for id in ids)
+    assert ids == sorted(ids)
+    new = sorted(id for id in db.get_all_by_section("s") if id not in legacy)
+    assert [db.get_by_id("s", id)["n"] for id in new] == list(range(10))
+
+
+def test_counter_is_not_seeded_from_legacy_ids(db):
+    db.use_id_generator({"type": "counter"})
+    assert db.add("s", {"n": 0}) == "1".zfill(ID_WIDTH)
+
+
+def test_snowflake_is_not_seeded_from_legacy_ids(db):
+    db.force_load({"version": 2, "keys": {"s": ["n"]}, "s": {"999999999999999999": {"n": 0}}})
+    db.use_id_generator({"type": "snowflake"})
+    ms = int(db.add("s", {"n": 1})) >> (TimeOrderedIdGenerator.NODE_BITS + TimeOrderedIdGenerator.SEQUENCE_BITS)
+    assert ms <= int(time.time() * 1000) - TimeOrderedIdGenerator.EPOCH_MS
+
+
+@pytest.mark.parametrize("conf", [{"type": "counter"}, {"type": "snowflake"}])
+def test_reload_continues_after_the_stored_ids(db, conf):
+    db.use_id_generator(conf)
+    ids = db.add_many("s", [{"n": i} for i in range(5)])
+    data = {"version": 2, "keys": {"s": ["n"]}, "s": db.get_all_by_section("s")}
+    db.use_id_generator(conf)
+    db.force_load(data)
+    assert db.add("s", {"n": 5}) > max(ids)
+
+
+def test_unknown_generator():
+    with pytest.raises(MalformedIdGeneratorError):
+        make_id_generator({"type": "nope"})
+    with pytest.raises(MalformedIdGeneratorError):
+        make_id_generator({"type": "snowflake", "node": 1 << 10})
@@ -0,0 +1,74 @@
+from pysondb.db import PysonDB
+from pysondb.interning import Interner
+from pysondb.interning import intern_data
+from pysondb.interning import MAX_STRING
+
+
+def _device(n):
+    # json.load builds new objects for every record
+    return {"name": f"light {n}", "type": "LIGHT", "traits": ["OnOff", "Brightness"], "attributes": {"min": 0}}
+
+
+def test_equal_values_are_shared():
+    interner = Interner()
+    a, b = interner.record(_device(1)), interner.record(_device(2))
+    assert a["traits"] is b["traits"] and a["attributes"] is b["attributes"]
+    assert a is not interner.record(_device(1))
+    assert interner.stats()["hits"] > 0 and interner.saved_bytes > 0
+
+
+def test_types_stay_apart():
+    interner = Interner()
+    values = [interner.intern(v) for v in ([1], [1.0], [True], {"a": 1}, {"a": True})]
+    assert len({id(v) for v in values}) == 5
+    assert [type(v[0]) for v in values[:3]] == [int, float, bool]
+
+
+def test_given_values_are_not_modified():
+    interner = Interner()
+    shared = interner.intern({"x": ["a"]})
+    given = {"x": ["a"], "y": 1}
+    result = interner.intern(given)
+    assert result is not given and given["x"] is not shared["x"]
+    assert result["x"] is shared["x"]
+
+
+def test_large_values_are_not_interned():
+    interner = Interner()
+    long = "x" * (MAX_STRING + 1)
+    interner.intern(long)
+    assert interner.stats()["entries"] == 0
+    interner.intern(list(range(100)))
+    # only the items
+    assert interner.stats()["entries"] == 100
+
+
+def test_table_is_cleared_when_full():
+    interner = Interner(max_entries=4)
+    for i in range(10):
+        interner.intern(f"s{i}")
+    assert interner.clears == 2 and interner.stats()["entries"] == 2
+
+
+def test_intern_data():
+    data = {"version": 2, "keys": {"s": ["type"]}, "s": {str(i): _device(i) for i in range(10)}}
+    hits, saved = intern_data(Interner(), data)
+    assert hits > 0 and saved > 0
+    assert data["s"]["0"]["traits"] is data["s"]["9"]["traits"]
+
+
+def test_database_interns_loads_and_writes(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.force_load({"version": 2, "keys": {"s": ["name", "type", "traits", "attributes"]}, "s": {"1": _device(1)}})
+    db.enable_interning()
+    id = db.add("s", _device(2))
+    (other,) = db.add_many("s", [_device(3)])
+    records = db.get_all_by_section("s", copy=False)
+    assert records["1"]["traits"] is records[id]["traits"] is records[other]["traits"]
+    db.update_by_id("s", id, {"attributes": {"min": 0}})
+    assert db.get_by_id("s", id, copy=False)["attributes"] is records["1"]["attributes"]
+    # an update through a shared value leaves the other records alone
+    db.update_by_query("s", "lambda r: r['name'] == 'light 3'", {"$push": {"traits": "Color"}})
+    assert db.get_by_id("s", "1")["traits"] == ["OnOff", "Brightness"]
+    assert db.get_by_id("s", other)["traits"] == ["OnOff", "Brightness", "Color"]
+    assert db.memory_stats()["interning"]["hits"] > 0
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from pysondb.db import PysonDB
+from pysondb.jsoncache import JsonCache
+
+
+def _load(raw):
+    return json.loads(bytes(raw))
+
+
+def test_encodes_like_json():
+    cache = JsonCache(1 << 20)
+    records = {"1": {"n": 1, "s": "é"}, "2": {"n": [1, {"x": None}]}}
+    assert _load(cache.record("s", "1", records["1"])) == records["1"]
+    assert _load(cache.records("s", records)) == records
+    assert _load(cache.records("s", {})) == {}
+    assert _load(cache.sections({"s": records, "keys": {"s": ["n"]}})) == {"s": records, "keys": {"s": ["n"]}}
+    rows = [["1", records["1"], "a", {"m": 1}], ["2", records["2"], None, None]]
+    for cached in ((True, True), (True, False), (False, True)):
+        assert _load(cache.rows("s", "o", rows, cached)) == rows
+    assert _load(cache.rows("s", "o", [], (True, True))) == []
+
+
+def test_entries_follow_the_record_objects():
+    cache = JsonCache(1 << 20)
+    record = {"n": 1}
+    cache.record("s", "1", record)
+    cache.record("s", "1", record)
+    assert (cache.hits, cache.misses) == (1, 1)
+    # copy-on-write: a changed record is a new object
+    assert _load(cache.record("s", "1", {"n": 2})) == {"n": 2}
+    assert cache.misses == 2
+    assert cache.stats()["records"] == 1
+
+
+def test_cleared_when_full():
+    cache = JsonCache(100)
+    for i in range(10):
+        cache.record("s", str(i), {"n": "x" * 20})
+    assert cache.clears > 0 and cache.bytes <= 100
+
+
+def test_mutations_free_entries(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    db.enable_json_cache(1 << 20)
+    cache = db.json_cache
+    ids = db.add_many("s", [{"n": i} for i in range(3)])
+    records = db.get_all_by_section("s", copy=False)
+    assert _load(cache.records("s", records)) == records
+    assert cache.stats()["records"] == 3
+    db.update_by_id("s", ids[0], {"n": 10})
+    db.delete_by_id("s", ids[1])
+    assert cache.stats()["records"] == 1
+    assert _load(cache.records("s", db.get_all_by_section("s", copy=False))) == {ids[0]: {"n": 10}, ids[2]: {"n": 2}}
+    db.purge("s")
+    assert cache.stats()["records"] == 0 and cache.bytes == 0
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_server_replies(start_server, enabled):
+    def patch(config):
+        config["json_cache"]["enabled"] = enabled
+
+    server = start_server(patch)
+    with server.connect() as conn:
+        first = conn.get_all_by_section("data")
+        assert conn.get_all_by_section("data") == first
+        id = next(iter(first))
+        conn.update_by_id("data", id, {"age": 1000})
+        assert conn.get_by_id("data", id)["age"] == 1000
+        assert conn.find("data", {"age": 1000}) == {id: dict(first[id], age=1000)}
+        assert conn.get_all()["data"][id]["age"] == 1000
@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+from pysondb.loader import count_records
+from pysondb.loader import estimate_size
+from pysondb.loader import parse_database
+from pysondb.loader import record_size
+from pysondb.loader import section_size
+from tests.conftest import ROOT
+
+DATA = {"version": 2, "keys": {"a": ["n"], "b": ["n"]}, "a": {"1": {"n": 1}, "2": {"n": [1, 2]}}, "b": {}}
+
+
+def test_parse_database(tmp_path):
+    filename = str(tmp_path / "db.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(DATA, f)
+    data, info = parse_database(filename)
+    assert data == DATA
+    assert info["records"] == 2
+    assert info["file_bytes"] == os.path.getsize(filename)
+    assert info["memory_bytes"] == estimate_size(data) > 0
+
+
+def test_sizes():
+    assert count_records(DATA) == 2
+    # nested values are counted
+    assert record_size("2", {"n": [1, 2]}) > record_size("1", {"n": 1})
+    records = {str(i): {"n": i, "s": "x" * 10} for i in range(100)}
+    # sampled sizes are extrapolated
+    assert section_size(records, sample=10) == pytest.approx(section_size(records), rel=0.05)
+
+
+@pytest.mark.parametrize("pool", ["thread", "process"])
+def test_prewarm_loads_every_database(start_server, pool):
+    def patch(config):
+        config["prewarm"] = {"enabled": True, "pool": pool, "workers": 2, "wait": True}
+        config["databases"].append({"name": "broken", "filename": "missing.json"})
+
+    server = start_server(patch)
+    with server.connect(dbname=None) as conn:
+        health = conn.health()
+    assert health["status"] == "ready"
+    with open(os.path.join(ROOT, "config.json"), encoding="utf-8") as f:
+        databases = json.load(f)["databases"]
+    # the repo's config also names databases without a file
+    names = [d["name"] for d in databases if os.path.isfile(os.path.join(ROOT, "database", d["filename"]))]
+    assert names
+    for name in names:
+        database = health["databases"][name]
+        assert database["state"] == "loaded", name
+        assert database["via"] == pool
+    testfile = health["databases"]["testfile"]
+    assert testfile["records"] > 0 and testfile["resident_bytes"] > 0
+    assert health["databases"]["broken"]["state"] == "failed"
+
+
+def test_databases_load_on_first_use(server):
+    with server.connect(dbname=None) as conn:
+        assert conn.health()["databases"]["testfile2"]["state"] == "not_loaded"
+        conn.use_db("testfile2")
+        database = conn.health()["databases"]["testfile2"]
+    assert database["state"] == "loaded" and database["via"] == "request"
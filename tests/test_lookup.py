@@ -0,0 +1,109 @@
+import time
+
+import pytest
+
+from pysondb.db import PysonDB
+from pysondb.filters import get_path
+from pysondb.ordering import NULL_KEY
+from pysondb.ordering import sort_key
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.force_load(
+        {
+            "version": 2,
+            "keys": {"orders": ["user", "total"], "users": ["name", "team", "expires"]},
+            "orders": {
+                "o1": {"user": "u1", "total": 10},
+                "o2": {"user": "u2", "total": 20},
+                "o3": {"user": "u1", "total": 30},
+                "o4": {"user": "missing", "total": 40},
+                "o5": {"user": None, "total": 50},
+            },
+            "users": {
+                "u1": {"name": "ada", "team": 1, "expires": None},
+                "u2": {"name": "bob", "team": 2, "expires": None},
+                "u3": {"name": "cy", "team": 1, "expires": time.time() - 1},
+                "u4": {"name": "dee", "team": 1.0, "expires": None},
+                "u5": {"name": "eve", "team": None, "expires": None},
+            },
+        }
+    )
+    db.set_ttl("users", "expires")
+    return db
+
+
+def _expected(db, section, field, other, other_field, outer=False, filter=None, other_filter=None):
+    # nested loops over the live records
+    records = db.find(section, filter or {})
+    others = db.find(other, other_filter or {})
+    rows = []
+    for id, record in records.items():
+        k = sort_key(id if field is None else get_path(record, field))
+        matched = [
+            [id, record, oid, o]
+            for oid, o in others.items()
+            if k != NULL_KEY and sort_key(oid if other_field is None else get_path(o, other_field)) == k
+        ]
+        rows.extend(matched or ([[id, record, None, None]] if outer else []))
+    return rows
+
+
+def _sorted(rows):
+    return sorted(rows, key=lambda row: (row[0], str(row[2])))
+
+
+JOINS = [
+    ("orders", "user", "users", None),
+    ("users", None, "orders", "user"),
+    ("users", "team", "users", "team"),
+    ("orders", "total", "users", "team"),
+]
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+@pytest.mark.parametrize("section, field, other, other_field", JOINS)
+@pytest.mark.parametrize("outer", [False, True])
+def test_matches_nested_loops(db, section, field, other, other_field, outer, indexed):
+    if indexed and other_field is not None:
+        db.create_index(other, other_field)
+    rows = db.lookup(section, field, other, other_field, outer=outer)
+    assert _sorted(rows) == _sorted(_expected(db, section, field, other, other_field, outer))
+    # in the order of section
+    order = list(db.get_all_by_section(section))
+    positions = [order.index(row[0]) for row in rows]
+    assert positions == sorted(positions)
+
+
+def test_filters_projections_and_limit(db):
+    rows = db.lookup(
+        "orders", "user", "users", None,
+        filter={"total": {"$gte": 20}}, other_filter={"team": 1},
+        fields=["total"], other_fields=["name"],
+    )
+    assert rows == [["o3", {"total": 30}, "u1", {"name": "ada"}]]
+    # a small left side against a larger right one
+    rows = db.lookup("users", "team", "orders", "total", filter={"name": "ada"}, outer=True)
+    assert rows == [["u1", db.get_by_id("users", "u1"), None, None]]
+    assert len(db.lookup("orders", "user", "users", None, outer=True, limit=2)) == 2
+
+
+def test_expired_and_null_keys_never_join(db):
+    rows = db.lookup("users", "team", "users", "team")
+    ids = {row[0] for row in rows} | {row[2] for row in rows}
+    assert "u3" not in ids and "u5" not in ids
+    # 1 and 1.0 are the same key
+    assert ["u1", db.get_by_id("users", "u1"), "u4", db.get_by_id("users", "u4")] in rows
+
+
+def test_server_lookup(server):
+    with server.connect() as conn:
+        conn.add_section("teams")
+        team = conn.add("teams", {"title": "analysts"})
+        id = conn.add("data", {"name": "ada", "age": 36, "foo": team})
+        # twice, with the JSON cache filled the second time
+        for _ in range(2):
+            rows = conn.lookup("data", "foo", "teams", other_fields=["title"])
+            assert rows == [[id, {"name": "ada", "age": 36, "foo": team}, team, {"title": "analysts"}]]
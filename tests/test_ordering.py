@@ -0,0 +1,62 @@
+import os
+import shutil
+
+import pytest
+
+from pysondb.db import PysonDB
+from pysondb.errors import MalformedQueryError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def db(tmp_path):
+    filename = str(tmp_path / "testfile.json")
+    shutil.copy(os.path.join(ROOT, "database", "testfile.json"), filename)
+    db = PysonDB(filename, auto_update=False)
+    db.force_load()
+    return db
+
+
+def _ages(records):
+    return [r["age"] for r in records.values()]
+
+
+def test_order_by_and_limit(db):
+    everything = db.get_all_by_section("data")
+    ages = sorted(r["age"] for r in everything.values())
+    assert _ages(db.get_all_by_section("data", order_by="age")) == ages
+    assert _ages(db.get_all_by_section("data", order_by="-age", limit=5)) == ages[::-1][:5]
+    assert len(db.find("data", {}, order_by="name", limit=3)) == 3
+
+
+def test_mixed_directions(db):
+    records = list(db.get_all_by_section("data", order_by=["-age", "name"]).values())
+    keys = [(-r["age"], r["name"]) for r in records]
+    assert keys == sorted(keys)
+
+
+@pytest.mark.parametrize("order_by", ["age", "-age", "name", "-name"])
+@pytest.mark.parametrize("limit", [1, 5, 20, None])
+def test_an_index_does_not_change_the_result(db, order_by, limit):
+    without = list(db.get_all_by_section("data", order_by=order_by, limit=limit))
+    found = list(db.find("data", {"age": {"$gte": 0}}, order_by=order_by, limit=limit))
+    db.create_index("data", order_by.lstrip("-"))
+    assert list(db.get_all_by_section("data", order_by=order_by, limit=limit)) == without
+    assert list(db.find("data", {"age": {"$gte": 0}}, order_by=order_by, limit=limit)) == found
+
+
+def test_index_follows_writes(db):
+    db.create_index("data", "age")
+    id = db.add("data", {"name": "young", "age": -1, "foo": ""})
+    assert next(iter(db.get_all_by_section("data", order_by="age", limit=1))) == id
+    db.update_by_id("data", id, {"age": 10 ** 6})
+    assert next(iter(db.get_all_by_section("data", order_by="-age", limit=1))) == id
+    db.delete_by_id("data", id)
+    assert id not in db.get_all_by_section("data", order_by="-age", limit=1)
+
+
+@pytest.mark.parametrize("order_by, limit", [(["-"], None), (3, None), ("age", -1), ("age", True)])
+def test_malformed_order_by_and_limit(db, order_by, limit):
+    with pytest.raises(MalformedQueryError):
+        db.get_all_by_section("data", order_by=order_by, limit=limit)
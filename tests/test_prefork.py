@@ -0,0 +1,66 @@
+import json
+import sys
+from threading import Thread
+
+import pytest
+
+from pysondb.db import PysonDB
+from pysondb.prefork import OwnerServer
+from pysondb.prefork import RemoteDB
+from pysondb.transactions import Transaction
+
+
+class Main:
+    # the part of a SocketServer that OwnerServer uses
+    def __init__(self, db):
+        self.db = db
+
+    def get_db(self, name):
+        return self.db
+
+
+@pytest.fixture
+def remote(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    server = OwnerServer(Main(db), str(tmp_path / "owner.sock"))
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield db, RemoteDB("db", str(tmp_path / "owner.sock"), 1)
+    server.shutdown()
+    server.server_close()
+
+
+def test_seq_is_read_from_the_owner(remote):
+    db, proxy = remote
+    proxy.add("s", {"n": 1})
+    db.add("s", {"n": 2})
+    assert proxy.seq == db.seq == 3
+    assert proxy.run_id == db.run_id
+
+
+def test_empty_transaction_returns_the_owner_seq(remote):
+    db, proxy = remote
+    proxy.add("s", {"n": 1})
+    assert Transaction(proxy).apply() == db.seq
+
+
+@pytest.mark.parametrize(
+    "args, prefork, expected",
+    [
+        ([], {}, 1),
+        ([], {"workers": 3}, 3),
+        (["--workers", "2"], {"workers": 3}, 2),
+        (["--workers", "1"], {"workers": 3}, 1),
+    ],
+)
+def test_workers_default_to_the_config(tmp_path, monkeypatch, args, prefork, expected):
+    import server
+
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({"prefork": prefork}))
+    started = []
+    monkeypatch.setattr("pysondb.prefork.serve_prefork", lambda cfile, workers: started.append(workers))
+    monkeypatch.setattr(server, "SocketServer", lambda cfile: started.append(1))
+    monkeypatch.setattr(sys, "argv", ["server.py", "--config", str(config)] + args)
+    server.main()
+    assert started == [expected]
@@ -0,0 +1,89 @@
+import json
+import os
+import time
+from threading import Event
+from threading import Thread
+
+from pysondb.db import PysonDB
+from pysondb.profiler import PhaseTimer
+from pysondb.profiler import SamplingProfiler
+from pysondb.profiler import SlowQueryLog
+from tests.conftest import until
+
+
+def test_phase_timer():
+    timer = PhaseTimer()
+    for _ in range(2):
+        with timer.phase("scan"):
+            time.sleep(0.01)
+    timer.add({"queue": 5.0})
+    assert timer.phases["scan"] >= 20
+    assert timer.phases["queue"] == 5.0
+    assert timer.total_ms() >= timer.phases["scan"]
+
+
+def test_slow_log(tmp_path):
+    filename = str(tmp_path / "slow.log")
+    log = SlowQueryLog.from_config({"enabled": True, "threshold_ms": 50, "filename": filename})
+    assert not log.is_slow(49) and log.is_slow(50)
+    assert not SlowQueryLog.from_config(None).is_slow(10 ** 6)
+    log.log({"cmd": "FIND"})
+    log.log({"cmd": "GET_ALL"})
+    with open(filename, encoding="utf-8") as f:
+        assert [json.loads(line)["cmd"] for line in f] == ["FIND", "GET_ALL"]
+
+
+def _busy_waiting(stop):
+    while not stop.is_set():
+        pass
+
+
+def test_sampling_profiler_sees_other_threads():
+    stop = Event()
+    thread = Thread(target=_busy_waiting, args=(stop,), name="busy")
+    thread.start()
+    try:
+        profiler = SamplingProfiler(0.001)
+        stacks = profiler.run(0.05)
+    finally:
+        stop.set()
+        thread.join()
+    assert profiler.samples > 0
+    busy = [line for line in stacks.splitlines() if line.startswith("busy;")]
+    assert busy and "_busy_waiting" in busy[0]
+    # collapsed stacks: frames separated by ";", then the count
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in stacks.splitlines())
+
+
+def test_op_stats(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    db.add_many("s", [{"n": i} for i in range(10)])
+    db.reset_op_stats()
+    db.find("s", {"n": {"$lt": 3}})
+    stats = db.last_op_stats()
+    assert (stats["scanned"], stats["returned"]) == (10, 3)
+    assert "scan" in stats["phases"]
+    db.reset_op_stats()
+    assert db.last_op_stats()["scanned"] == 0
+
+
+def test_server_logs_slow_operations(start_server):
+    def patch(config):
+        config["slow_log"] = {"enabled": True, "threshold_ms": 0, "filename": "slow.log"}
+
+    server = start_server(patch)
+    with server.connect() as conn:
+        conn.find("data", {"age": {"$gte": 0}})
+    filename = os.path.join(server.directory, "slow.log")
+
+    def logged():
+        # written once the reply is sent
+        with open(filename, encoding="utf-8") as f:
+            return [e for e in map(json.loads, f) if e["cmd"] == "FIND"]
+
+    until(logged)
+    (find,) = logged()
+    assert find["db"] == "testfile" and find["section"] == "data" and find["user"] == "test"
+    assert find["scanned"] >= find["returned"] > 0
+    assert {"execute", "queue"} <= set(find["phases"])
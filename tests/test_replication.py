@@ -0,0 +1,125 @@
+import os
+import socket
+from threading import Thread
+
+import pytest
+
+from pysondb import replication
+from pysondb.config import Config
+from pysondb.db import PysonDB
+from pysondb.replication import MAX_APPLY_FAILURES
+from pysondb.replication import ReplicaSync
+from tests.conftest import until
+
+
+class ReplicaServer:
+    # the part of a SocketServer that ReplicaSync uses
+    def __init__(self, config, directory):
+        self._config = config
+        self.db = PysonDB(os.path.join(directory, "replica.json"), auto_update=False)
+
+    def get_db(self, name):
+        return self.db
+
+
+@pytest.fixture
+def primary(server):
+    return server
+
+
+def _sync_in_thread(sync):
+    # one connection to the primary, until it is lost
+    errors = []
+
+    def run():
+        try:
+            sync._sync()
+        except Exception as e:
+            errors.append(e)
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    return thread, errors
+
+
+def test_snapshot_stream_resume_and_primary_restart(primary, tmp_path, monkeypatch):
+    connections = []
+
+    class Recorded(replication._Connection):
+        def __init__(self, *args):
+            super().__init__(*args)
+            connections.append(self)
+
+    monkeypatch.setattr(replication, "_Connection", Recorded)
+    server = ReplicaServer(Config(primary.config_file), str(tmp_path))
+    sync = ReplicaSync(
+        server,
+        {
+            "databases": ["testfile"],
+            "primary": {"host": "localhost", "port": primary.port, "user": "test", "passwd": "password"},
+        },
+    )
+    client = primary.connect()
+
+    def in_sync():
+        return server.db.get_all_by_section("data") == client.get_all_by_section("data")
+
+    # snapshot
+    client.add("data", {"name": "before", "age": 1, "foo": "a"})
+    thread, _ = _sync_in_thread(sync)
+    until(lambda: sync.connected)
+    assert in_sync()
+    loaded_run = server.db.run_id
+
+    # event stream
+    for i in range(3):
+        client.add("data", {"name": f"streamed{i}", "age": i, "foo": "b"})
+    until(in_sync)
+
+    # resume: the connection drops, the primary still buffers everything
+    connections[-1]._sock.shutdown(socket.SHUT_RDWR)
+    thread.join(5)
+    client.add("data", {"name": "while away", "age": 9, "foo": "c"})
+    thread, _ = _sync_in_thread(sync)
+    until(in_sync)
+    assert server.db.run_id == loaded_run, "resumed without loading a snapshot"
+    first_run = sync.stats()["databases"]["testfile"]["primary_run_id"]
+    applied = sync.stats()["databases"]["testfile"]["applied_seq"]
+
+    # primary restart: its seqs start over, more writes than the replica
+    # applied before, so the old seq is valid in the new numbering too
+    primary.stop()
+    thread.join(5)
+    client.close()
+    primary.start()
+    client = primary.connect()
+    for i in range(applied + 2):
+        client.add("data", {"name": f"restarted{i}", "age": i, "foo": "d"})
+    thread, _ = _sync_in_thread(sync)
+    until(in_sync)
+    assert server.db.run_id != loaded_run, "a snapshot of the restarted primary was loaded"
+    assert sync.stats()["databases"]["testfile"]["primary_run_id"] != first_run
+    client.add("data", {"name": "after restart", "age": 0, "foo": "e"})
+    until(in_sync)
+    client.close()
+
+
+class FailingDB:
+    def apply_event(self, event):
+        raise KeyError("missing section")
+
+
+def test_failing_event_falls_back_to_snapshot():
+    server = ReplicaServer.__new__(ReplicaServer)
+    server.db = FailingDB()
+    sync = ReplicaSync(server, {"primary": {"host": "localhost", "port": 0}})
+    sync._mark("db", 1, "run", None)
+    message = {"db": "db", "data": {"seq": 2, "run_id": "run", "op": "insert", "section": "s"}}
+    for _ in range(MAX_APPLY_FAILURES - 1):
+        with pytest.raises(KeyError):
+            sync._apply(message)
+        assert "db" in sync._applied
+    with pytest.raises(KeyError):
+        sync._apply(message)
+    # the next REPLICATE asks for a full snapshot
+    assert "db" not in sync._applied
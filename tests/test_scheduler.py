@@ -0,0 +1,123 @@
+from threading import Barrier
+from threading import Event
+from threading import Thread
+
+import pytest
+
+from pysondb import scheduler as scheduler_module
+from pysondb.errors import RateLimitExceededError
+from pysondb.errors import ServerBusyError
+from pysondb.errors import TooManyConnectionsError
+from pysondb.scheduler import Scheduler
+
+
+def test_runs_jobs_on_the_workers():
+    scheduler = Scheduler(point_workers=1, scan_workers=1)
+    user = {"user": "u"}
+    assert scheduler.run(user, "GET_BY_ID", lambda p: p + 1, 1) == 2
+    with pytest.raises(KeyError):
+        scheduler.run(user, "FIND", lambda p: {}[p], "missing")
+    stats = scheduler.stats()["queues"]
+    assert stats["point"]["completed"] == 1 and stats["scan"]["completed"] == 1
+
+
+def test_point_jobs_do_not_wait_behind_scans():
+    scheduler = Scheduler(point_workers=1, scan_workers=1)
+    user = {"user": "u"}
+    release = Event()
+    scan = Thread(target=scheduler.run, args=(user, "GET_ALL", lambda p: release.wait(5), None))
+    scan.start()
+    try:
+        assert scheduler.run(user, "GET_BY_ID", lambda p: "point", None) == "point"
+    finally:
+        release.set()
+        scan.join()
+
+
+def test_full_queue_is_rejected():
+    scheduler = Scheduler(point_workers=0, scan_workers=1, max_queue=1)
+    user = {"user": "u"}
+    waiting = Thread(target=scheduler.run, args=(user, "GET_BY_ID", lambda p: None, None), daemon=True)
+    waiting.start()
+    while not scheduler.stats()["queues"]["point"]["depth"]:
+        pass
+    with pytest.raises(ServerBusyError):
+        scheduler.run(user, "GET_BY_ID", lambda p: None, None)
+    assert scheduler.stats()["queues"]["point"]["rejected"] == 1
+
+
+def test_rate_limit():
+    scheduler = Scheduler(point_workers=1, scan_workers=1)
+    user = {"user": "u", "rate_limit": 3}
+    for _ in range(3):
+        scheduler.run(user, "GET_BY_ID", lambda p: None, None)
+    with pytest.raises(RateLimitExceededError):
+        scheduler.run(user, "GET_BY_ID", lambda p: None, None)
+    # inline commands are not counted
+    scheduler.run(user, "HEALTH", lambda p: None, None)
+    # a reloaded config with another limit starts a new bucket
+    scheduler.run(dict(user, rate_limit=10), "GET_BY_ID", lambda p: None, None)
+
+
+def test_max_concurrency():
+    scheduler = Scheduler(point_workers=4, scan_workers=1)
+    user = {"user": "u", "max_concurrency": 2}
+    running = []
+    peak = []
+    start = Barrier(6)
+
+    def job(payload):
+        running.append(payload)
+        peak.append(len(running))
+        Event().wait(0.01)
+        running.remove(payload)
+
+    def client(i):
+        start.wait()
+        scheduler.run(user, "GET_BY_ID", job, i)
+
+    threads = [Thread(target=client, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 2
+
+
+def test_limits_are_shared_by_concurrent_lookups(monkeypatch):
+    class SlowLimits(scheduler_module._UserLimits):
+        def __init__(self, *args):
+            Event().wait(0.01)
+            super().__init__(*args)
+
+    monkeypatch.setattr(scheduler_module, "_UserLimits", SlowLimits)
+    scheduler = Scheduler(point_workers=0, scan_workers=0)
+    user = {"user": "u", "max_concurrency": 1}
+    start = Barrier(8)
+    seen = []
+
+    def lookup():
+        start.wait()
+        seen.append(scheduler._user_limits(user))
+
+    threads = [Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(limits is seen[0] for limits in seen)
+
+
+def test_connection_limits():
+    scheduler = Scheduler(point_workers=0, scan_workers=0, max_connections=3)
+    user = {"user": "u", "max_connections": 2}
+    scheduler.connect(user)
+    scheduler.connect(user)
+    with pytest.raises(TooManyConnectionsError):
+        scheduler.connect(user)
+    scheduler.connect({"user": "v"})
+    with pytest.raises(TooManyConnectionsError):
+        scheduler.connect({"user": "w"})
+    scheduler.disconnect(user)
+    scheduler.connect({"user": "w"})
+    assert scheduler.stats()["connections"] == {"total": 3, "by_user": {"u": 1, "v": 1, "w": 1}}
@@ -0,0 +1,71 @@
+import pytest
+
+from pysondb.db import PysonDB
+from pysondb.errors import SchemaTypeError
+from pysondb.errors import UnknownKeyError
+from pysondb.schema import SectionSchema
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    db.set_schema("s", {"name": "str", "age": "int", "score": "float"}, {"score": 0.0})
+    db.add("s", {"name": "ada", "age": 36, "score": 1.5})
+    return db
+
+
+def test_validate():
+    schema = SectionSchema(["age", "name"], {"age": "int"}, {"age": 0})
+    record = {"name": "ada", "age": 1}
+    assert schema.validate(record) is record
+    assert schema.validate({"name": "ada"}) == {"name": "ada", "age": 0}
+    assert schema.validate({"name": "ada", "age": None})["age"] is None
+    with pytest.raises(UnknownKeyError):
+        schema.validate({"age": 1})
+    with pytest.raises(UnknownKeyError):
+        schema.validate({"name": "ada", "age": 1, "other": 2})
+    assert schema.validate({"other": 2}, ignore=True) == {"other": 2}
+    for age in ("1", 1.0, True):
+        with pytest.raises(SchemaTypeError):
+            schema.validate({"name": "ada", "age": age})
+    assert schema.unknown(["name", "other"]) == ["other"]
+
+
+def test_check_conf():
+    SectionSchema.check_conf({"n": "float"}, {"n": 1})
+    with pytest.raises(SchemaTypeError):
+        SectionSchema.check_conf({"n": "decimal"}, None)
+    with pytest.raises(SchemaTypeError):
+        SectionSchema.check_conf({"n": "int"}, {"n": "1"})
+
+
+def test_writes_are_checked(db):
+    id = db.add("s", {"name": "bob", "age": 20})
+    assert db.get_by_id("s", id)["score"] == 0.0
+    with pytest.raises(SchemaTypeError):
+        db.add("s", {"name": "bob", "age": "20", "score": 1})
+    with pytest.raises(SchemaTypeError):
+        db.add_many("s", [{"name": "c", "age": 1}, {"name": "d", "age": 1.5}])
+    with pytest.raises(SchemaTypeError):
+        db.update_by_id("s", id, {"age": "21"})
+    with pytest.raises(SchemaTypeError):
+        db.update_by_query("s", "lambda r: True", {"$set": {"name": 1}})
+    with pytest.raises(UnknownKeyError):
+        db.update_by_id("s", id, {"other": 1})
+    # nothing of the failed writes was applied
+    assert len(db.get_all_by_section("s")) == 2
+    assert db.get_by_id("s", id) == {"name": "bob", "age": 20, "score": 0.0}
+
+
+def test_schema_follows_the_keys(db):
+    db.add_new_key("s", "tags", [])
+    with pytest.raises(UnknownKeyError):
+        db.add("s", {"name": "bob", "age": 20, "score": 1})
+    db.add("s", {"name": "bob", "age": 20, "score": 1, "tags": ["x"]})
+    db.purge("s")
+    # the first record of an empty section defines its keys, defaults included
+    id = db.add("s", {"city": "paris"})
+    assert db.get_by_id("s", id) == {"city": "paris", "score": 0.0}
+    with pytest.raises(UnknownKeyError):
+        db.add("s", {"name": "bob"})
@@ -0,0 +1,111 @@
+import time
+
+import pytest
+
+from pysondb.db import PysonDB
+from pysondb.errors import IndexNotFoundError
+from pysondb.errors import MalformedQueryError
+from pysondb.search import rank
+from pysondb.search import tokenize
+
+RECORDS = [
+    {"title": "Kitchen light", "tags": ["lamp"], "meta": {"room": "kitchen"}},
+    {"title": "Kitchen kitchen kitchen sink", "tags": [], "meta": {"room": "kitchen"}},
+    {"title": "Living room light", "tags": ["lamp", "LED"], "meta": {"room": "living"}},
+    {"title": "Garage door", "tags": [], "meta": {"room": None}},
+]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    db.add_many("s", RECORDS)
+    db.create_text_index("s", ["title", "tags", "meta.room"])
+    return db
+
+
+def _search(db, query, **kwargs):
+    hits = db.search("s", query, fields=["title"], **kwargs)["hits"]
+    return [hit["record"]["title"] for hit in hits]
+
+
+def test_tokenize():
+    assert tokenize("Hello, WORLD-wide 42") == ["hello", "world", "wide", "42"]
+
+
+def test_modes_and_prefixes(db):
+    assert sorted(_search(db, "light")) == ["Kitchen light", "Living room light"]
+    assert _search(db, "kitchen light") == ["Kitchen light"]
+    assert len(_search(db, "kitchen light", mode="any")) == 3
+    assert sorted(_search(db, "kit*")) == ["Kitchen kitchen kitchen sink", "Kitchen light"]
+    # list items and nested paths are indexed
+    assert _search(db, "led") == ["Living room light"]
+    assert sorted(_search(db, "living")) == ["Living room light"]
+    assert _search(db, "nothing") == []
+
+
+def test_bm25_ranking(db):
+    # more occurrences rank higher
+    assert _search(db, "kitchen")[0] == "Kitchen kitchen kitchen sink"
+    # a rare word weighs more than a common one
+    assert _search(db, "garage light", mode="any")[0] == "Garage door"
+
+
+def test_pages(db):
+    page = db.search("s", "kitchen light", mode="any", limit=2)
+    assert page["total"] == 3 and len(page["hits"]) == 2
+    rest = db.search("s", "kitchen light", mode="any", limit=2, offset=2)
+    assert [h["id"] for h in page["hits"] + rest["hits"]] == [h["id"] for h in db.search("s", "kitchen light", mode="any")["hits"]]
+    assert rank({"a": 1.0, "b": 1.0, "c": 2.0}, 0, 3) == [("c", 2.0), ("b", 1.0), ("a", 1.0)]
+
+
+def test_index_follows_writes(db):
+    id = db.add("s", {"title": "Garden light", "tags": [], "meta": {"room": "garden"}})
+    assert "Garden light" in _search(db, "garden")
+    db.update_by_id("s", id, {"title": "Garden hose"})
+    assert _search(db, "hose") == ["Garden hose"]
+    assert "Garden hose" not in _search(db, "light")
+    db.delete_by_id("s", id)
+    assert _search(db, "garden") == []
+    # the same results as an index built from scratch
+    queries = ["kitchen", "light", "l*", "lamp kitchen"]
+    before = [db.search("s", q, mode="any") for q in queries]
+    db.create_text_index("s", ["title", "tags"])
+    db.create_text_index("s", ["title", "tags", "meta.room"])
+    assert [db.search("s", q, mode="any") for q in queries] == before
+    db.purge("s")
+    assert _search(db, "kitchen") == []
+
+
+def test_expired_records_are_not_found(db):
+    db.add_new_key("s", "expires", None)
+    db.set_ttl("s", "expires")
+    id = db.add("s", {"title": "Old light", "tags": [], "meta": {}, "expires": time.time() - 1})
+    assert db.search("s", "old")["total"] == 0
+    assert id not in [h["id"] for h in db.search("s", "light")["hits"]]
+
+
+def test_errors(db):
+    with pytest.raises(IndexNotFoundError):
+        db.search("other", "x")
+    with pytest.raises(MalformedQueryError):
+        db.search("s", "  ,, ")
+    with pytest.raises(MalformedQueryError):
+        db.search("s", "x", mode="some")
+    with pytest.raises(TypeError):
+        db.create_text_index("s", [])
+
+
+def test_server_search(start_server):
+    def patch(config):
+        for d in config["databases"]:
+            if d["name"] == "testfile":
+                d["text_indexes"] = {"data": ["name"]}
+
+    server = start_server(patch)
+    with server.connect() as conn:
+        id = conn.add("data", {"name": "Ada Lovelace", "age": 36, "foo": "x"})
+        result = conn.search("data", "lovel*", fields=["name"])
+    assert result["total"] == 1
+    assert result["hits"][0]["id"] == id and result["hits"][0]["record"] == {"name": "Ada Lovelace"}
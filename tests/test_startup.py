@@ -0,0 +1,55 @@
+import subprocess
+import sys
+
+import pytest
+
+from pysondb.importtime import parse_importtime
+from pysondb.importtime import report
+from tests.conftest import ROOT
+
+OPTIONAL = ("cryptography", "prettytable", "pysondb.prefork", "pysondb.replication", "pysondb.db")
+
+
+def _loaded(module):
+    code = f"import sys, {module}; print(' '.join(m for m in {OPTIONAL!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return set(out.stdout.split())
+
+
+@pytest.mark.parametrize(
+    "module, expected",
+    [
+        ("pysondb", set()),
+        ("pysondb.cli", set()),
+        ("pysondb.db", {"pysondb.db"}),
+        ("pysondb.pysondb_server", {"pysondb.db"}),
+    ],
+)
+def test_optional_modules_are_imported_on_use(module, expected):
+    assert _loaded(module) == expected
+
+
+def test_engine_is_resolved_on_first_use():
+    import pysondb
+    from pysondb.db import PysonDB
+
+    assert pysondb.PysonDB is PysonDB
+    with pytest.raises(AttributeError):
+        pysondb.missing
+
+
+STDERR = """\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |   json.decoder
+import time:       250 |        350 | json
+noise
+import time:        40 |        390 | pysondb
+"""
+
+
+def test_parse_importtime():
+    times = parse_importtime(STDERR)
+    assert times == {"json.decoder": (100, 100), "json": (250, 350), "pysondb": (40, 390)}
+    lines = report("pysondb", [times, times], top=2).splitlines()
+    assert lines[0] == "pysondb: 0.4 ms cumulative, 3 modules"
+    assert [line.split()[-1] for line in lines[1:]] == ["json", "json.decoder"]
@@ -0,0 +1,39 @@
+import pytest
+
+from pysondb.db import PysonDB
+from pysondb.errors import TransactionConflictError
+from pysondb.transactions import Transaction
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = PysonDB(str(tmp_path / "db.json"), auto_update=False)
+    db.add_section("s")
+    db.add("s", {"n": 0})
+    return db
+
+
+def test_insert_then_update(db):
+    t = Transaction(db)
+    id = t.add("s", {"n": 1})
+    t.update_by_id("s", id, {"n": 2})
+    t.apply()
+    assert db.get_by_id("s", id) == {"n": 2}
+
+
+def test_insert_then_delete(db):
+    t = Transaction(db)
+    id = t.add("s", {"n": 1})
+    t.delete_by_id("s", id)
+    t.apply()
+    assert id not in db.get_all_by_section("s")
+
+
+def test_concurrent_update_conflicts(db):
+    id = next(iter(db.get_all_by_section("s")))
+    t = Transaction(db)
+    t.update_by_id("s", id, {"n": 1})
+    db.update_by_id("s", id, {"n": 2})
+    with pytest.raises(TransactionConflictError):
+        t.apply()
+    assert db.get_by_id("s", id) == {"n": 2}
@@ -0,0 +1,37 @@
+import pytest
+
+from pysondb.errors import SchemaTypeError
+from pysondb.updates import compile_update
+
+
+def test_pull_on_a_missing_path_leaves_the_record_unchanged():
+    record = {"a": 1}
+    assert compile_update({"$pull": {"meta.tags": "x"}})(record) == {"a": 1}
+    assert compile_update({"$pull": {"tags": "x"}})(record) == {"a": 1}
+
+
+def test_unset_on_a_missing_path_leaves_the_record_unchanged():
+    assert compile_update({"$unset": {"meta.tags": True}})({"a": 1}) == {"a": 1}
+
+
+@pytest.mark.parametrize(
+    "spec, expected",
+    [
+        ({"$set": {"meta.tags": ["x"]}}, {"a": 1, "meta": {"tags": ["x"]}}),
+        ({"$inc": {"meta.count": 2}}, {"a": 1, "meta": {"count": 2}}),
+        ({"$push": {"meta.tags": "x"}}, {"a": 1, "meta": {"tags": ["x"]}}),
+    ],
+)
+def test_writes_create_missing_objects(spec, expected):
+    assert compile_update(spec)({"a": 1}) == expected
+
+
+def test_pull_removes_values_without_changing_the_original():
+    record = {"meta": {"tags": ["x", "y", "x"]}}
+    assert compile_update({"$pull": {"meta.tags": "x"}})(record) == {"meta": {"tags": ["y"]}}
+    assert record == {"meta": {"tags": ["x", "y", "x"]}}
+
+
+def test_pull_needs_a_list():
+    with pytest.raises(SchemaTypeError):
+        compile_update({"$pull": {"a": "x"}})({"a": 1})